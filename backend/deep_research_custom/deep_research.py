@@ -1,29 +1,52 @@
 import os
 import requests
-from tavily import TavilyClient
-import google.generativeai as genai
 from concurrent.futures import ThreadPoolExecutor
 import json
-from time import time
+import logging
+import threading
+from time import sleep, time
 from dotenv import load_dotenv
 
+from scripts.metrics import span
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Load API keys
 TAVILY_API_KEY = os.getenv('TAVILY_API_KEY')
 JINA_API_KEY = os.getenv('JINA_API_KEY')
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 
-# Verify API keys are loaded
-print(f"TAVILY_API_KEY loaded: {'Yes' if TAVILY_API_KEY else 'No'}")
-print(f"JINA_API_KEY loaded: {'Yes' if JINA_API_KEY else 'No'}")
-print(f"GEMINI_API_KEY loaded: {'Yes' if GEMINI_API_KEY else 'No'}")
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_clients():
+    """The configured Gemini module and Tavily client, set up on first use since the SDKs are slow to import."""
+    with _clients_lock:
+        if not _clients:
+            import google.generativeai as genai
+            from tavily import TavilyClient
 
-# Configure APIs
-genai.configure(api_key=GEMINI_API_KEY)
-tavily = TavilyClient(api_key=TAVILY_API_KEY)
+            for name, key in (("TAVILY_API_KEY", TAVILY_API_KEY), ("JINA_API_KEY", JINA_API_KEY),
+                              ("GEMINI_API_KEY", GEMINI_API_KEY)):
+                if not key:
+                    logger.warning("%s is not set", name)
+            genai.configure(api_key=GEMINI_API_KEY)
+            _clients.update(genai=genai, tavily=TavilyClient(api_key=TAVILY_API_KEY))
+    return _clients["genai"], _clients["tavily"]
 
 def run_deep_research_from_file(input_file="cohere_post_processed.json", output_file="deep_research_report_1.json"):
+    # Load upgrades from Cohere output
+    with open(input_file, "r") as f:
+        cohere_data = json.load(f)
+
+    return run_deep_research(cohere_data["upgrades"], output_file)
+
+def run_deep_research(upgrades_data, output_file=None):
+    """Researches and summarizes every upgrade in parallel; returns the report and saves it to output_file if given."""
+    genai, tavily = get_clients()
 
     # Shared data structure to store research results
     research_data = {}
@@ -66,7 +89,8 @@ def run_deep_research_from_file(input_file="cohere_post_processed.json", output_
 
         model = genai.GenerativeModel("gemini-2.0-flash")
         try:
-            response = model.generate_content(prompt)
+            with span("gemini"):
+                response = model.generate_content(prompt)
             json_start = response.text.index("[")
             json_end = response.text.rindex("]") + 1
             sub_queries = json.loads(response.text[json_start:json_end])
@@ -86,7 +110,8 @@ def run_deep_research_from_file(input_file="cohere_post_processed.json", output_
     # Step 2: Tavily Search for URLs
     def tavily_search(query):
         try:
-            response = tavily.search(query=query, search_depth="basic", max_results=5, include_answer=False)
+            with span("tavily"):
+                response = tavily.search(query=query, search_depth="basic", max_results=5, include_answer=False)
             return [{"url": result["url"], "title": result.get("title", ""), "description": result.get("description", "")} for result in response["results"]]
         except Exception as e:
             print(f"Error searching for '{query}': {e}")
@@ -99,14 +124,15 @@ def run_deep_research_from_file(input_file="cohere_post_processed.json", output_
             try:
                 jina_url = f"https://r.jina.ai/{url}"
                 headers = {"Authorization": f"Bearer {JINA_API_KEY}"}
-                response = requests.get(jina_url, headers=headers, timeout=30)
-                response.raise_for_status()
+                with span("jina"):
+                    response = requests.get(jina_url, headers=headers, timeout=30)
+                    response.raise_for_status()
                 print(f"Successfully extracted content from {url}")
                 return response.text[:20000]
             except Exception as e:
                 print(f"Attempt {attempt + 1}/{max_retries + 1} - Error extracting content from {url}: {e}")
                 if attempt < max_retries:
-                    time.sleep(2)
+                    sleep(2)
                 else:
                     # Fallback to URL metadata from Tavily
                     fallback_content = f"Title: {url_data.get('title', 'N/A')}\nDescription: {url_data.get('description', 'N/A')}"
@@ -172,7 +198,8 @@ def run_deep_research_from_file(input_file="cohere_post_processed.json", output_
 
         model = genai.GenerativeModel("gemini-2.0-flash")
         try:
-            response = model.generate_content(full_prompt)
+            with span("gemini"):
+                response = model.generate_content(full_prompt)
             json_start = response.text.index("{")
             json_end = response.text.rindex("}") + 1
             return json.loads(response.text[json_start:json_end])
@@ -205,17 +232,13 @@ def run_deep_research_from_file(input_file="cohere_post_processed.json", output_
 
         final_report["deep_research_results"] = results
 
-        with open(output_file, "w") as f:
-            json.dump(final_report, f, indent=2)
-
         print(f"\nDeep research completed in {time() - start_time:.2f} seconds")
-        print("Report saved to deep_research_report.json")
-
-    # Load upgrades from Cohere output
-    with open(input_file, "r") as f:
-        cohere_data = json.load(f)
+        if output_file:
+            with open(output_file, "w") as f:
+                json.dump(final_report, f, indent=2)
+            print(f"Report saved to {output_file}")
+        return final_report
 
-    upgrades_data = cohere_data["upgrades"]
     return process_upgrades(upgrades_data)
 
 if __name__ == "__main__":
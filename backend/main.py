@@ -1,5 +1,5 @@
-from segment import process_image, visualize_results
-from gemini import analyze_accessibility
+from scripts.segment import process_image, visualize_results
+from scripts.gemini import analyze_accessibility
 from PIL import Image
 import numpy as np
 import cv2
@@ -28,7 +28,7 @@ def main():
     depth_map_path = "stairs_depth.png"
     annotated_path = "stairs_annotated.png"
     # Save depth map using save_numpy_as_image (appropriate for scalar arrays)
-    save_numpy_as_image(depth_map, depth_map_path)
+    save_numpy_as_image(depth_map.full(), depth_map_path)
     # Save annotated image using save_annotated_image (appropriate for RGB images)
     save_annotated_image(annotated_img, annotated_path)
 
@@ -42,7 +42,8 @@ def main():
         accessibility_type=accessibility_type
     )
 
-    visualize_results(img_np, seg_mask, depth_map, detected_objects)
+    # Show the annotation process_image already rendered instead of drawing it again
+    visualize_results(img_np, seg_mask, depth_map, detected_objects, annotated_img)
 
     # Step 4: Output results
     print("\n🧠 Gemini Accessibility Report:\n")
@@ -1,16 +1,29 @@
-from flask import Flask
+from flask import Flask, Response, jsonify, request
+from flask_cors import CORS
+import logging
+import os
 import sys
+from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent))
 
+from scripts.metrics import stage_metrics
+from scripts.worker_pool import readiness, start_warmup
 
 
-#from deep_research_flask import deep_research_bp
-#from final_generation_flask import final_generation_bp
-#from gemini_and_cohere_flask import gemini_bp
-from segment_flask import segment_bp
+
+from deep_research_flask import deep_research_bp
+from final_generation_flask import final_generation_bp
+from gemini_and_cohere_flask import gemini_bp
+from routes.jobs_flask import jobs_bp
+# Imported through the package like pipeline_flask does, so there is one copy of the module
+from routes.pipeline_flask import pipeline_bp
+from routes.segment_flask import segment_bp
 #from upload_flask import upload_bp
 
 
+# LOG_LEVEL=DEBUG adds per-span timings and per-image detail to the log
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
 app = Flask(__name__)
 CORS(app)
 
@@ -18,15 +31,42 @@ CORS(app)
 
 # API Registration
 
-#app.register_blueprint(deep_research_bp, url_prefix="/api")
-#app.register_blueprint(final_generation_bp, url_prefix="/api")
-#  app.register_blueprint(gemini_bp, url_prefix="/api")
+app.register_blueprint(deep_research_bp, url_prefix="/api")
+app.register_blueprint(final_generation_bp, url_prefix="/api")
+app.register_blueprint(gemini_bp, url_prefix="/api")
+app.register_blueprint(jobs_bp, url_prefix="/jobs")
+app.register_blueprint(pipeline_bp, url_prefix="/api")
 app.register_blueprint(segment_bp, url_prefix="/segment")
 #app.register_blueprint(upload_bp, url_prefix="/api")
 
 
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the process is up and serving; answers immediately, even while models load."""
+    return jsonify({"status": "ok"}), 200
+
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: 200 once the startup models are resident (or nothing is preloaded), 503 until then."""
+    state = readiness()
+    return jsonify(state), 200 if state["status"] in ("ready", "lazy") else 503
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Per-stage latency histograms and memory, in Prometheus text format (or JSON with ?format=json)."""
+    if request.args.get('format') == 'json':
+        return jsonify(stage_metrics.snapshot()), 200
+    return Response(stage_metrics.prometheus_text(), mimetype="text/plain; version=0.0.4")
+
+
 
 
 if __name__ == "__main__":
     os.makedirs("database", exist_ok=True)
-    app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
+    # Models load in the background; /readyz reports when they are resident (MODEL_WARMUP=0 loads on first use)
+    if os.getenv("MODEL_WARMUP", "1") == "1":
+        start_warmup()
+    # No reloader: it imports the app twice and both copies would resume interrupted jobs
+    app.run(debug=True, use_reloader=False, host='0.0.0.0', port=5001)
\ No newline at end of file
@@ -1,45 +1,57 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, request, jsonify
 import json
 import os
 
-from ..deep_research_custom.deep_research import run_deep_research_from_file
+from routes.jobs_flask import enqueue_response
+from scripts.admission import JOB_COSTS
+from scripts.jobs import job_queue
 
 deep_research_bp = Blueprint("deep_research", __name__)
 
 DATABASE_FOLDER = "database"
 
-@app.route('/deep_research', methods=['POST'])
+
+def research_paths(base_name):
+    return (os.path.join(DATABASE_FOLDER, f"{base_name}_upgrades.json"),
+            os.path.join(DATABASE_FOLDER, f"{base_name}_deep_research_report.json"))
+
+
+def run_deep_research(payload, input_paths=()):
+    """Job handler: researches every upgrade in {base_name}_upgrades.json and returns the report."""
+    from deep_research_custom.deep_research import run_deep_research_from_file
+
+    input_file, output_file = research_paths(payload["base_name"])
+    run_deep_research_from_file(input_file=input_file, output_file=output_file)
+
+    if not os.path.exists(output_file):
+        raise RuntimeError("Deep research report was not generated")
+
+    with open(output_file, "r") as f:
+        return json.load(f)
+
+
+job_queue.register("deep_research", run_deep_research)
+
+
+@deep_research_bp.route('/deep_research', methods=['POST'])
 def deep_research_api():
+    """Queues run_deep_research for an /analyze_full result and answers 202 with a job id."""
     req = request.get_json()
 
     if not req or "base_name" not in req:
         return jsonify({"error": "Missing 'base_name' in request body"}), 400
 
     base_name = os.path.splitext(req["base_name"])[0]
-    input_file = os.path.join(DATABASE_FOLDER, f"{base_name}_upgrades.json")
-    output_file = os.path.join(DATABASE_FOLDER, f"{base_name}_deep_research_report.json")
+    input_file, _ = research_paths(base_name)
 
     if not os.path.exists(input_file):
         return jsonify({"error": f"Input file '{input_file}' not found"}), 404
 
-    try: 
-        run_deep_research_from_file(input_file=input_file, output_file=output_file)
-
-        if not os.path.exists(output_file):
-            return jsonify({"error": "Deep research report was not generated"}), 500
-
-
-        with open(output_file, "r") as f:
-            result = json.load(f)
+    return enqueue_response("deep_research", {"base_name": base_name}, cost_bytes=JOB_COSTS["deep_research"])
 
-        return jsonify(result)
-
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    
 
 
-@app.route('/deep_research/<base_name>', methods=['GET'])
+@deep_research_bp.route('/deep_research/<base_name>', methods=['GET'])
 def deep_research_get(base_name):
     output_file = os.path.join(DATABASE_FOLDER, f"{base_name}_deep_research_report.json")
 
@@ -1,60 +1,88 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, request, jsonify
 import os
-from final_generation import generate_accessibility_upgraded_images
-
-from PIL import Image
-from dotenv import load_dotenv
+from routes.jobs_flask import enqueue_response
+from scripts.admission import JOB_COSTS, MAX_VARIATIONS
+from scripts.jobs import job_queue
 
 final_generation_bp = Blueprint("final_generation", __name__)
 
 DATABASE_FOLDER = "database"
+DEFAULT_MAX_VARIATIONS = 3
 os.makedirs(DATABASE_FOLDER, exist_ok=True)
 
-@app.route('/generate_variations', methods=['POST'])
+
+def original_image_path(base_name):
+    """The photo the analysis ran on: {base_name}.jpg as /segment/process saves it, or an uploaded .jpeg / .png."""
+    for extension in (".jpg", ".jpeg", ".png"):
+        path = os.path.join(DATABASE_FOLDER, f"{base_name}{extension}")
+        if os.path.exists(path):
+            return path
+    return os.path.join(DATABASE_FOLDER, f"{base_name}.jpg")
+
+
+def generation_paths(base_name):
+    return [original_image_path(base_name),
+            os.path.join(DATABASE_FOLDER, f"{base_name}_upgrades.json"),
+            os.path.join(DATABASE_FOLDER, f"{base_name}_deep_research_report.json")]
+
+
+def run_generate_variations(payload, input_paths=()):
+    """Job handler: renders up to max_variations upgraded images and saves them as {base_name}_variation_{i}.png."""
+    from scripts.final_generation import generate_accessibility_upgraded_images
+
+    base_name = payload["base_name"]
+    original_path, cohere_path, research_path = generation_paths(base_name)
+    images = generate_accessibility_upgraded_images(
+        original_image_path=original_path,
+        cohere_post_processed_path=cohere_path,
+        deep_research_report_path=research_path,
+        max_variations=payload["max_variations"]
+    )
+
+    output_paths = []
+    for idx, img in enumerate(images):
+        if img:
+            out_path = os.path.join(DATABASE_FOLDER, f"{base_name}_variation_{idx+1}.png")
+            img.save(out_path)
+            output_paths.append(out_path)
+
+    return {
+        "message": f"Successfully generated {len(output_paths)} variations.",
+        "generated_images": output_paths
+    }
+
+
+job_queue.register("generate_variations", run_generate_variations)
+
+
+@final_generation_bp.route('/generate_variations', methods=['POST'])
 def generate_variation_api():
+    """Queues run_generate_variations for a /deep_research result and answers 202 with a job id."""
     req = request.get_json()
 
     if not req or "base_name" not in req:
         return jsonify({"error": "Missing 'base_name' in request body"}), 400
 
-    base_name = os.path.splitext(req["base_name"])[0]
+    try:
+        max_variations = int(req.get("max_variations", DEFAULT_MAX_VARIATIONS))
+    except (TypeError, ValueError):
+        return jsonify({"error": "'max_variations' must be an integer"}), 400
+    max_variations = min(max(max_variations, 1), MAX_VARIATIONS)
 
-    original_image_path = os.path.join(DATABASE_FOLDER, f"{base_name}.jpeg")
-    cohere_path = os.path.join(DATABASE_FOLDER, f"{base_name}_upgrades.json")
-    research_path = os.path.join(DATABASE_FOLDER, f"{base_name}_deep_research_report.json")
+    base_name = os.path.splitext(req["base_name"])[0]
 
     # File existence checks
-    for path in [original_image_path, cohere_path, research_path]:
+    for path in generation_paths(base_name):
         if not os.path.exists(path):
             return jsonify({"error": f"Required file not found: {path}"}), 404
 
-    try:
-        images = generate_accessibility_upgraded_images(
-            original_image_path=original_image_path,
-            cohere_post_processed_path=cohere_path,
-            deep_research_report_path=research_path,
-            max_variations=req.get("max_variations", 3)
-        )
-
-        output_paths = []
-        for idx, img in enumerate(images):
-            if img:
-                out_path = os.path.join(DATABASE_FOLDER, f"{base_name}_variation_{idx+1}.png")
-                img.save(out_path)
-                output_paths.append(out_path)
-
-        return jsonify({
-            "message": f"Successfully generated {len(output_paths)} variations.",
-            "generated_images": output_paths
-        })
-
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    
+    return enqueue_response("generate_variations", {"base_name": base_name, "max_variations": max_variations},
+                            cost_bytes=JOB_COSTS["generate_variations"] * max_variations)
+
 
 
 
-@app.route('/get_variations', methods=['GET'])
+@final_generation_bp.route('/get_variations', methods=['GET'])
 def get_variations():
     base_name = request.args.get("base_name")
     
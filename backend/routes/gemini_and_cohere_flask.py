@@ -1,44 +1,44 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, request, jsonify
 import os
 import json
-from gemini import main_gemini_analysis
-from cohere_post_processing import parse_gemini_output
+from routes.jobs_flask import enqueue_response
+from scripts.admission import JOB_COSTS
+from scripts.jobs import job_queue
 
 gemini_bp = Blueprint("gemini", __name__)
 
 DATABASE_DIR = os.path.join(os.getcwd(), "database")
 
-@app.route('/analyze_full', methods=['POST'])
-def full_accessibility_pipeline():
-    data = request.get_json()
-
-    if not data or 'filename' not in data:
-        return jsonify({"error": "Filename is required."}), 400
 
-    filename = data['filename']
+def analysis_paths(filename):
     base_name = os.path.splitext(filename)[0]
+    return {
+        "detected_objects": os.path.join(DATABASE_DIR, f"{base_name}_objects.json"),
+        "annotated": os.path.join(DATABASE_DIR, f"{base_name}_annotated.jpg"),
+        "depth": os.path.join(DATABASE_DIR, f"{base_name}_depth.jpg"),
+        "image": os.path.join(DATABASE_DIR, filename),
+    }
 
-    # Load detected_objects from saved .json file
-    detected_objects_path = os.path.join(DATABASE_DIR, f"{base_name}_objects.json")
-    try:
-        with open(detected_objects_path, 'r') as f:
-            detected_objects = json.load(f)
-    except Exception as e:
-        return jsonify({"error": f"Could not load detected objects: {e}"}), 500
 
-    # Image paths
-    annotated_path = os.path.join(DATABASE_DIR, f"{base_name}_annotated.jpg")
-    depth_path = os.path.join(DATABASE_DIR, f"{base_name}_depth.jpg")
-    prepro_img_path = os.path.join(DATABASE_DIR, filename)
+def run_full_analysis(payload, input_paths=()):
+    """Job handler: Gemini accessibility analysis of a segmented image, structured by Cohere."""
+    # The API clients are slow to import, so they load with the first job
+    from scripts.cohere_post_processing import parse_gemini_output
+    from scripts.gemini import main_gemini_analysis
 
-    if not all(os.path.exists(p) for p in [prepro_img_path, annotated_path, depth_path]):
-        return jsonify({"error": "Required image files not found in database/"}), 404
+    filename = payload['filename']
+    base_name = os.path.splitext(filename)[0]
+    paths = analysis_paths(filename)
+
+    # Load detected_objects from saved .json file
+    with open(paths["detected_objects"], 'r') as f:
+        detected_objects = json.load(f)
 
     # === Step 1: Run Gemini ===
     gemini_text = main_gemini_analysis(
-        prepro_img_path=prepro_img_path,
-        depth_map_path=depth_path,
-        annotated_image_path=annotated_path,
+        prepro_img_path=paths["image"],
+        depth_map_path=paths["depth"],
+        annotated_image_path=paths["annotated"],
         detected_objects=detected_objects,
         accessibility_type="visual"
     )
@@ -50,10 +50,7 @@ def full_accessibility_pipeline():
 
     # === Validate Gemini Output ===
     if not gemini_text or len(gemini_text.strip()) < 20:
-        return jsonify({
-            "error": "Gemini returned empty or invalid response.",
-            "gemini_raw_text_saved_as": gemini_output_path
-        }), 500
+        raise RuntimeError(f"Gemini returned empty or invalid response (raw text saved as {gemini_output_path})")
 
     # === Try Cohere Parsing ===
     try:
@@ -69,23 +66,39 @@ def full_accessibility_pipeline():
     with open(structured_output_path, "w", encoding="utf-8") as f:
         json.dump(structured_json or {"error": cohere_error}, f, indent=2)
 
-    # === Final Response ===
-    return jsonify({
+    return {
         "original_filename": filename,
-        "annotated_image_path": annotated_path,
-        "depth_image_path": depth_path,
-        "detected_objects_path": detected_objects_path,
+        "annotated_image_path": paths["annotated"],
+        "depth_image_path": paths["depth"],
+        "detected_objects_path": paths["detected_objects"],
         "gemini_raw_text_saved_as": gemini_output_path,
         "structured_upgrades_saved_as": structured_output_path,
         "structured_upgrades": structured_json,
         "cohere_parsing_error": cohere_error
-    })
+    }
+
+
+job_queue.register("analyze_full", run_full_analysis)
+
+
+@gemini_bp.route('/analyze_full', methods=['POST'])
+def full_accessibility_pipeline():
+    """Queues run_full_analysis for a /segment/process result ({base_name}.jpg) and answers 202 with a job id."""
+    data = request.get_json()
+
+    if not data or 'filename' not in data:
+        return jsonify({"error": "Filename is required."}), 400
+
+    if not all(os.path.exists(p) for p in analysis_paths(data['filename']).values()):
+        return jsonify({"error": "Required image files not found in database/"}), 404
+
+    return enqueue_response("analyze_full", {"filename": data['filename']}, cost_bytes=JOB_COSTS["analyze_full"])
 
 
 
 # not sure if we will need the get method seems like the post handles ittt????
 
-@app.route('/get_analysis/<filename>', methods=['GET'])
+@gemini_bp.route('/get_analysis/<filename>', methods=['GET'])
 def get_analysis(filename):
     base_name = os.path.splitext(filename)[0]
     structured_output_path = os.path.join(DATABASE_DIR, f"{base_name}_upgrades.json")
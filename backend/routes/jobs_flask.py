@@ -0,0 +1,84 @@
+from flask import Blueprint, Response, jsonify, request, url_for
+import json
+
+from scripts.admission import Overloaded, admission
+from scripts.jobs import job_queue
+
+
+jobs_bp = Blueprint("jobs", __name__)
+
+# Seconds between SSE keep-alive comments while a job makes no progress
+SSE_HEARTBEAT_SECONDS = 15.0
+
+
+def public_job(job):
+    """The job record as returned to clients (without the internal bookkeeping fields)."""
+    return {k: v for k, v in job.items() if k not in ("dedup_key", "inputs", "version")}
+
+
+def enqueue_response(kind, payload, files=(), priority=0, cost_bytes=0):
+    """
+    Submits a job and answers 202 with its id and where to follow it. With ?wait=1 the request
+    instead blocks until the job is done and returns its result directly (200, or 500 with the error).
+    When the job doesn't fit the admission budget (scripts.admission) it answers 429 with
+    Retry-After, or 413 if it could never fit.
+    """
+    try:
+        job, created = job_queue.submit(kind, payload, files, priority, cost_bytes, admission)
+    except Overloaded as e:
+        if e.retry_after is None:
+            return jsonify({"error": str(e)}), 413
+        response = jsonify({"error": str(e), "retry_after": e.retry_after})
+        response.status_code = 429
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response
+    if request.args.get('wait', 'false').lower() in ('1', 'true', 'yes'):
+        job = job_queue.wait(job["id"])
+        if job["status"] == "failed":
+            return jsonify({"error": job["error"], "job_id": job["id"]}), 500
+        return jsonify(job["result"]), 200
+
+    status_url = url_for("jobs.job_status", job_id=job["id"])
+    response = jsonify({
+        "job_id": job["id"],
+        "status": job["status"],
+        "deduplicated": not created,
+        "status_url": status_url,
+        "events_url": url_for("jobs.job_events", job_id=job["id"]),
+    })
+    response.status_code = 202
+    response.headers["Location"] = status_url
+    return response
+
+
+@jobs_bp.route('/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Status of a job (queued, running, succeeded or failed) with its result or error once finished."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Job '{job_id}' not found"}), 404
+    return jsonify(public_job(job)), 200
+
+
+@jobs_bp.route('/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-Sent Events stream: one "status" event per change, closed after the job finishes."""
+    if job_queue.get(job_id) is None:
+        return jsonify({"error": f"Job '{job_id}' not found"}), 404
+
+    def stream():
+        for job in job_queue.watch(job_id, heartbeat=SSE_HEARTBEAT_SECONDS):
+            if job is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: status\ndata: {json.dumps(public_job(job))}\n\n"
+
+    return Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@jobs_bp.route('', methods=['GET'])
+def job_counts():
+    """Number of jobs per status, plus the admission budget and how much of it is reserved."""
+    stats = job_queue.stats()
+    stats["admission"] = admission.stats(job_queue.records())
+    return jsonify(stats), 200
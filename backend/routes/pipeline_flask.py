@@ -0,0 +1,231 @@
+from flask import Blueprint, request, jsonify
+import io
+import json
+import logging
+import os
+from functools import partial
+from PIL import Image
+
+from routes.jobs_flask import enqueue_response
+from routes.segment_flask import (
+    artifact_base_name, result_cache, save_artifacts, segment_settings
+)
+from scripts.admission import JOB_COSTS, MAX_VARIATIONS, segment_cost
+from scripts.annotate import render_annotations
+from scripts.dag import Stage, run_dag
+from scripts.inference_scheduler import PRIORITY_CLASSES, scheduler
+from scripts.jobs import job_queue
+from scripts.metrics import span
+from scripts.object_stats import convert_numpy
+from scripts.pre_processing_image import preprocess_rgb
+from scripts.result_cache import result_key
+
+pipeline_bp = Blueprint("pipeline", __name__)
+logger = logging.getLogger(__name__)
+
+DATABASE_DIR = os.path.join(os.getcwd(), "database")
+DEFAULT_MAX_VARIATIONS = 3
+
+
+def segment_stage(filename, data, settings):
+    """Decodes and segments the upload (result cache, then the inference scheduler); everything stays in memory."""
+    from scripts.segment import ADE20K_LABELS, load_rgb
+
+    key = result_key(data, settings["tier"], settings["precision"], settings["max_side"], settings["tile_size"],
+                     settings["preprocess"], settings["denoise"])
+    img_np = load_rgb(io.BytesIO(data), settings["max_side"] or None)
+    img_np, preprocess_cost = preprocess_rgb(img_np, settings["denoise"], settings["preprocess"])
+    with span("cache_lookup"):
+        cached = result_cache.get(key) if result_cache else None
+
+    if cached is not None:
+        seg_mask, depth_map, detected_objects = cached
+        with span("annotation"):
+            annotated_img = render_annotations(
+                img_np, detected_objects, segmentation_mask=seg_mask if settings["overlay"] else None,
+                labels=ADE20K_LABELS
+            )
+    else:
+        # Same batch_size as /segment/process, so the image can join batches of other requests
+        future = scheduler.submit(
+            img_np, settings["priority"], batch_size=settings["batch_size"], overlay=settings["overlay"],
+            tile_size=settings["tile_size"] or None, tier=settings["tier"], precision=settings["precision"]
+        )
+        _, seg_mask, depth_map, detected_objects, annotated_img = future.result()
+        detected_objects = [{k: convert_numpy(v) for k, v in obj.items()} for obj in detected_objects]
+
+    return {
+        "filename": filename,
+        "key": key,
+        "base_name": artifact_base_name(filename, key),
+        "cached": cached is not None,
+        "image": img_np,
+        "seg_mask": seg_mask,
+        "depth_map": depth_map,
+        "detected_objects": detected_objects,
+        "annotated": annotated_img,
+        "preprocess": preprocess_cost,
+    }
+
+
+def colourize_depth_stage(segment):
+    """The depth rendering Gemini is shown, as an RGB PIL image (DepthResult caches it for the artifact too)."""
+    import cv2
+
+    return Image.fromarray(cv2.cvtColor(segment["depth_map"].colourized(), cv2.COLOR_BGR2RGB))
+
+
+def gemini_inputs_stage(segment):
+    """The other Gemini inputs: original and annotated images as PIL and the scene brightness."""
+    from scripts.gemini import image_brightness
+
+    return {
+        "original": Image.fromarray(segment["image"]),
+        "annotated": Image.fromarray(segment["annotated"]),
+        "brightness": image_brightness(segment["image"]),
+    }
+
+
+def persist_stage(segment, colourize_depth):
+    """Writes the /segment/process artifacts (and fills the result cache) while the analysis runs."""
+    if not segment["cached"] and result_cache:
+        with span("cache_write"):
+            result_cache.put(segment["key"], segment["seg_mask"], segment["depth_map"], segment["detected_objects"])
+    with span("artifact_write"):
+        saved = save_artifacts(DATABASE_DIR, segment["filename"], segment["key"], segment["annotated"],
+                               segment["seg_mask"], segment["depth_map"], segment["detected_objects"],
+                               image=segment["image"])
+    saved["preprocess"] = segment["preprocess"]
+    return saved
+
+
+def analyze_stage(segment, gemini_inputs, colourize_depth, accessibility_type):
+    """Gemini accessibility analysis, as /analyze_full runs it but on the images in memory."""
+    from scripts.gemini import analyze_accessibility_images
+
+    gemini_text = analyze_accessibility_images(
+        gemini_inputs["original"], colourize_depth, gemini_inputs["annotated"], gemini_inputs["brightness"],
+        segment["detected_objects"], accessibility_type
+    )
+    gemini_output_path = os.path.join(DATABASE_DIR, f"{segment['base_name']}_gemini_raw.txt")
+    with open(gemini_output_path, "w", encoding="utf-8") as f:
+        f.write(gemini_text or "EMPTY_GEMINI_RESPONSE")
+    if not gemini_text or len(gemini_text.strip()) < 20:
+        raise RuntimeError(f"Gemini returned empty or invalid response (raw text saved as {gemini_output_path})")
+    return gemini_text
+
+
+def structure_stage(segment, analyze):
+    """Cohere turns the Gemini text into the structured upgrades; later stages need them, so failure stops the run."""
+    from scripts.cohere_post_processing import parse_gemini_output
+
+    structured_json = parse_gemini_output(analyze)
+    with open(os.path.join(DATABASE_DIR, f"{segment['base_name']}_upgrades.json"), "w", encoding="utf-8") as f:
+        json.dump(structured_json, f, indent=2)
+    return structured_json
+
+
+def deep_research_stage(segment, structure):
+    from deep_research_custom.deep_research import run_deep_research
+
+    return run_deep_research(
+        structure.get("upgrades", []), os.path.join(DATABASE_DIR, f"{segment['base_name']}_deep_research_report.json")
+    )
+
+
+def edit_description_stage(segment, structure, deep_research):
+    """Cohere's image edit instructions, written while the variations render."""
+    from scripts.cohere_final_processing import describe_image_edits
+
+    description = describe_image_edits(structure, deep_research)
+    with open(os.path.join(DATABASE_DIR, f"{segment['base_name']}_image_edit_description.txt"), "w",
+              encoding="utf-8") as f:
+        f.write(description)
+    return description
+
+
+def generate_variations_stage(gemini_inputs, segment, structure, deep_research, max_variations):
+    from scripts.final_generation import generate_upgraded_images, style_variations_from_report
+
+    images = generate_upgraded_images(
+        gemini_inputs["original"], structure.get("upgrades", []), style_variations_from_report(deep_research),
+        max_variations
+    )
+    output_paths = []
+    for idx, img in enumerate(images):
+        if img:
+            out_path = os.path.join(DATABASE_DIR, f"{segment['base_name']}_variation_{idx+1}.png")
+            img.save(out_path)
+            output_paths.append(out_path)
+    return output_paths
+
+
+def pipeline_stages(filename, data, settings):
+    """
+    The whole chain as a DAG (see scripts.dag): segment, then depth colourization next to
+    preparing the other Gemini inputs, the Gemini analysis next to writing the segmentation
+    artifacts, Cohere structuring, deep research, and finally the image edit description next
+    to the variation rendering.
+    """
+    return [
+        Stage("segment", partial(segment_stage, filename, data, settings), ()),
+        Stage("colourize_depth", colourize_depth_stage, ("segment",)),
+        Stage("gemini_inputs", gemini_inputs_stage, ("segment",)),
+        # After colourize_depth so the artifact reuses the rendering DepthResult cached
+        Stage("persist", persist_stage, ("segment", "colourize_depth")),
+        Stage("analyze", partial(analyze_stage, accessibility_type=settings["accessibility_type"]),
+              ("segment", "gemini_inputs", "colourize_depth")),
+        Stage("structure", structure_stage, ("segment", "analyze")),
+        Stage("deep_research", deep_research_stage, ("segment", "structure")),
+        Stage("edit_description", edit_description_stage, ("segment", "structure", "deep_research")),
+        Stage("generate_variations", partial(generate_variations_stage, max_variations=settings["max_variations"]),
+              ("gemini_inputs", "segment", "structure", "deep_research")),
+    ]
+
+
+def run_pipeline(settings, input_paths):
+    """Job handler: segment -> analyze -> deep research -> variations for one upload, in one job."""
+    with open(input_paths[0], "rb") as f:
+        data = f.read()
+    outputs, timings = run_dag(pipeline_stages(settings["filename"], data, settings))
+    logger.info("Pipeline for %s took %.1f s, critical path %s", settings["filename"], timings["wall_seconds"],
+                " -> ".join(step["stage"] for step in timings["critical_path"]))
+    return {
+        "base_name": outputs["segment"]["base_name"],
+        "segmentation": outputs["persist"],
+        "structured_upgrades": outputs["structure"],
+        "deep_research": outputs["deep_research"],
+        "image_edit_description": outputs["edit_description"],
+        "generated_images": outputs["generate_variations"],
+        "timings": timings,
+    }
+
+
+job_queue.register("pipeline", run_pipeline)
+
+
+@pipeline_bp.route('/pipeline', methods=['POST'])
+def pipeline_api():
+    """
+    Queues the whole chain (/segment/process, /analyze_full, /deep_research, /generate_variations)
+    for one uploaded image and answers 202 with a job id. Accepts the /segment/process form fields
+    plus max_variations and accessibility_type; every stage's files are written as the separate
+    endpoints write them, and the result adds a per-stage timing breakdown with the critical path.
+    """
+    image = request.files.get('image')
+    if image is None:
+        return jsonify({"error": "No image uploaded"}), 400
+    try:
+        settings = segment_settings(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    settings["max_variations"] = min(max(request.form.get('max_variations', DEFAULT_MAX_VARIATIONS, type=int), 1),
+                                     MAX_VARIATIONS)
+    settings["accessibility_type"] = request.form.get('accessibility_type', 'visual')
+
+    uploads = [(image.filename, image.stream.read())]
+    settings["filename"] = image.filename
+    cost_bytes = (segment_cost(uploads, settings["max_side"]) + JOB_COSTS["analyze_full"]
+                  + JOB_COSTS["deep_research"] + JOB_COSTS["generate_variations"] * settings["max_variations"])
+    return enqueue_response("pipeline", settings, uploads, PRIORITY_CLASSES[settings["priority"]],
+                            cost_bytes=cost_bytes)
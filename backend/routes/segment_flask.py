@@ -1,95 +1,315 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, request, jsonify
+import logging
 import os
-import tempfile
-import cv2
-import numpy as np
+import io
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import json
-from scripts.segment import process_image
+from werkzeug.datastructures import FileStorage
+from routes.jobs_flask import enqueue_response
+from scripts.admission import segment_cost
+from scripts.annotate import render_annotations
+from scripts.array_store import save_segment_arrays
+from scripts.metrics import span
+from scripts.object_stats import convert_numpy
+from scripts.pre_processing_image import (
+    DEFAULT_DENOISE, DEFAULT_PREPROCESS, DENOISE_MODES, PREPROCESS_MODES, preprocess_rgb
+)
+from scripts.jobs import job_queue
+from scripts.result_cache import ResultCache, result_key
+from scripts.inference_scheduler import DEFAULT_PRIORITY, PRIORITY_CLASSES, scheduler
+from scripts.worker_pool import pool_stats
+from scripts.model_config import DEFAULT_PRECISION, DEFAULT_TIER, MODEL_TIERS, PRECISIONS
+# scripts.segment and scripts.model_registry (torch, transformers) are imported on first use
 
 
 
 segment_bp = Blueprint("segment", __name__)
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.getenv("SEGMENT_BATCH_SIZE", "4"))
+# Caps for very large photos; 0 keeps the full resolution / single-pass segmentation
+MAX_SIDE = int(os.getenv("SEGMENT_MAX_SIDE", "0"))
+TILE_SIZE = int(os.getenv("SEGMENT_TILE_SIZE", "0"))
+# Content-addressed cache of model outputs (RESULT_CACHE=0 disables it)
+result_cache = ResultCache() if os.getenv("RESULT_CACHE", "1") == "1" else None
+ARTIFACT_DIGEST_LENGTH = 12
+# Background threads that encode and write the JPEG / JSON / array artifacts
+WRITER_THREADS = int(os.getenv("SEGMENT_WRITER_THREADS", "2"))
+_writer_pool = ThreadPoolExecutor(max_workers=WRITER_THREADS, thread_name_prefix="artifact-writer")
+_END_OF_UPLOADS = object()
 
 
 # For proper documentation explain what this api does!!!
 
-def convert_numpy(obj):
-    """Convert NumPy types to native Python types."""
-    if isinstance(obj, np.integer):
-        return int(obj)
-    if isinstance(obj, np.floating):
-        return float(obj)
-    if isinstance(obj, np.ndarray):
-        return obj.tolist()
-    return obj
-
-def process_uploaded_images(images):
+def artifact_base_name(filename, key):
+    # The content digest keeps two different uploads with the same filename apart
+    return f"{os.path.splitext(filename)[0]}_{key[:ARTIFACT_DIGEST_LENGTH]}"
+
+def save_artifacts(database_dir, filename, key, annotated_img, seg_mask, depth_map, cleaned_objects, image=None):
+    """
+    Writes the annotated image, colorized depth preview, objects JSON and the lossless
+    mask / depth arrays (see scripts.array_store) as {base}_{digest}_* and returns the paths.
+    image (the RGB array the models saw) is saved as {base}_{digest}.jpg for /analyze_full.
     """
-    Handles saving, processing, and storing all uploaded images.
-    Saves annotated image and depth map in 'database/' directory.
-    Also saves detected_objects to a sidecar JSON.
+    import cv2
+
+    base_name = artifact_base_name(filename, key)
+    image_path = os.path.join(database_dir, f"{base_name}.jpg") if image is not None else None
+    annotated_path = os.path.join(database_dir, f"{base_name}_annotated.jpg")
+    depth_path = os.path.join(database_dir, f"{base_name}_depth.jpg")
+    detected_objects_path = os.path.join(database_dir, f"{base_name}_objects.json")
+
+    # Save images (depth normalized and colorized at the image size)
+    if image_path:
+        cv2.imwrite(image_path, cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+    cv2.imwrite(annotated_path, cv2.cvtColor(annotated_img, cv2.COLOR_RGB2BGR))
+    cv2.imwrite(depth_path, depth_map.colourized())
+
+    with open(detected_objects_path, 'w') as f:
+        json.dump(cleaned_objects, f, indent=2)
+
+    # Raw uint8 mask and float16 depth, memory-mappable by the later stages
+    mask_path, depth_array_path = save_segment_arrays(database_dir, base_name, seg_mask, depth_map)
+
+    return {
+        "filename": filename,
+        "base_name": base_name,
+        "image_saved_as": image_path,
+        "annotated_saved_as": annotated_path,
+        "depth_saved_as": depth_path,
+        "detected_objects_saved_as": detected_objects_path,
+        "mask_saved_as": mask_path,
+        "depth_array_saved_as": depth_array_path,
+        "detected_objects": cleaned_objects
+    }
+
+
+def _decode_uploads(images, decoded_queue, preprocess_costs, max_side, tile_size, tier, precision, preprocess, denoise):
+    """
+    Decode stage: reads each upload from its in-memory stream, hashes it and checks the cache,
+    then decodes and (optionally) preprocesses it, recording the preprocessing cost per image.
+    """
+    # The consumer reads until _END_OF_UPLOADS, so it is posted whatever happens here
+    try:
+        from scripts.segment import load_rgb
+
+        for idx, image in enumerate(images):
+            try:
+                data = image.stream.read()
+                key = result_key(data, tier, precision, max_side, tile_size, preprocess, denoise)
+                img_np = load_rgb(io.BytesIO(data), max_side or None)
+                img_np, preprocess_costs[idx] = preprocess_rgb(img_np, denoise, preprocess)
+                if preprocess_costs[idx]["applied"]:
+                    logger.info("Preprocessed %s in %.0f ms (%s)", image.filename, preprocess_costs[idx]["total_ms"],
+                                denoise)
+                with span("cache_lookup"):
+                    cached = result_cache.get(key) if result_cache else None
+            except Exception as e:
+                decoded_queue.put((idx, None, None, None, e))
+                continue
+            decoded_queue.put((idx, key, img_np, cached, None))
+    except Exception:
+        logger.exception("Decoding the uploads failed")
+    finally:
+        decoded_queue.put(_END_OF_UPLOADS)
+
+
+def _write_result(database_dir, filename, key, img_np, seg_mask, depth_map, detected_objects, annotated_img, overlay):
+    """Writer stage: stores a fresh result in the cache and writes every artifact; returns the response entry."""
+    from scripts.segment import ADE20K_LABELS
+
+    try:
+        if annotated_img is None:
+            # Cache hit: only the (cheap) drawing is redone
+            with span("annotation"):
+                annotated_img = render_annotations(
+                    img_np, detected_objects, segmentation_mask=seg_mask if overlay else None, labels=ADE20K_LABELS
+                )
+        elif result_cache:
+            with span("cache_write"):
+                result_cache.put(key, seg_mask, depth_map, detected_objects)
+        with span("artifact_write"):
+            return save_artifacts(database_dir, filename, key, annotated_img, seg_mask, depth_map, detected_objects,
+                                  image=img_np)
+    except Exception as e:
+        return {"filename": filename, "error": str(e)}
+
+
+def process_uploaded_images(images, batch_size=BATCH_SIZE, overlay=False, max_side=MAX_SIDE, tile_size=TILE_SIZE,
+                            tier=DEFAULT_TIER, precision=DEFAULT_PRECISION, preprocess=DEFAULT_PREPROCESS,
+                            denoise=DEFAULT_DENOISE, priority=DEFAULT_PRIORITY):
+    """
+    Handles processing and storing all uploaded images.
+    Runs as a three-stage pipeline: a decoder thread reads the uploads straight from memory,
+    this thread hands each decoded image to the inference scheduler, which batches it with
+    images from concurrent requests (up to batch_size per batch, in a pre-forked model worker
+    under routes/serve.py), and the writer pool encodes and saves artifacts as results come
+    back, so decode and disk I/O overlap with inference.
+    priority ("interactive" or "bulk") is the image's place in the scheduler's queue.
+    With overlay=True the annotated image also has the segmentation mask blended in.
+    max_side / tile_size bound the working resolution for very large photos (0 disables).
+    tier selects the speed/quality model pair ("fast", "balanced" or "accurate") and
+    precision how the models run ("fp32", "bf16", "int8" or "compiled").
+    preprocess ("off", "dark" or "all") enhances contrast, denoises with the given denoise
+    tier and sharpens in the decode stage; each result reports what that cost.
+    Images seen before with the same settings come from the result cache and skip the models.
+    Saves annotated image and depth map in 'database/' directory, named by filename and
+    content digest. Also saves detected_objects to a sidecar JSON.
     Returns a list of results.
     """
     database_dir = os.path.join(os.getcwd(), "database")
     os.makedirs(database_dir, exist_ok=True)
 
-    saved_files = []
+    saved_files = [None] * len(images)
+    decoded_queue = queue.Queue(maxsize=max(2 * batch_size, 2))
+    # Bounds images between decode and a finished write, so a large upload isn't decoded all at once
+    max_in_flight = WRITER_THREADS + 2 * batch_size
+    in_flight = threading.Semaphore(max_in_flight)
+    preprocess_costs = {}  # index into images -> preprocessing cost
 
-    with tempfile.TemporaryDirectory() as input_dir:
-        for image in images:
-            image_path = os.path.join(input_dir, image.filename)
-            image.save(image_path)
+    def write(idx, *args):
+        try:
+            saved_files[idx] = _write_result(database_dir, images[idx].filename, *args, overlay)
+        finally:
+            in_flight.release()
 
-            try:
-                # Run segmentation + depth + annotation
-                img_np, seg_mask, depth_map, detected_objects, annotated_img = process_image(image_path)
-
-                # Normalize and colorize depth map
-                depth_map_norm = cv2.normalize(depth_map, None, 0, 255, cv2.NORM_MINMAX)
-                depth_map_color = cv2.applyColorMap(depth_map_norm.astype("uint8"), cv2.COLORMAP_INFERNO)
-
-                # Filenames
-                base_name = os.path.splitext(image.filename)[0]
-                annotated_path = os.path.join(database_dir, f"{base_name}_annotated.jpg")
-                depth_path = os.path.join(database_dir, f"{base_name}_depth.jpg")
-                detected_objects_path = os.path.join(database_dir, f"{base_name}_objects.json")
-
-                # Save images
-                cv2.imwrite(annotated_path, cv2.cvtColor(annotated_img, cv2.COLOR_RGB2BGR))
-                cv2.imwrite(depth_path, depth_map_color)
-
-                # Convert detected_objects to serializable and save
-                cleaned_objects = [
-                    {k: convert_numpy(v) for k, v in obj.items()} for obj in detected_objects
-                ]
-                with open(detected_objects_path, 'w') as f:
-                    json.dump(cleaned_objects, f, indent=2)
-
-                saved_files.append({
-                    "filename": image.filename,
-                    "annotated_saved_as": annotated_path,
-                    "depth_saved_as": depth_path,
-                    "detected_objects_saved_as": detected_objects_path,
-                    "detected_objects": cleaned_objects
-                })
+    def on_inferred(idx, key, img_np, future):
+        try:
+            _, seg_mask, depth_map, detected_objects, annotated_img = future.result()
+        except Exception as e:
+            saved_files[idx] = {"filename": images[idx].filename, "error": str(e)}
+            in_flight.release()
+            return
+        # Convert detected_objects to serializable
+        cleaned_objects = [
+            {k: convert_numpy(v) for k, v in obj.items()} for obj in detected_objects
+        ]
+        _writer_pool.submit(write, idx, key, img_np, seg_mask, depth_map, cleaned_objects, annotated_img)
 
-            except Exception as e:
-                saved_files.append({
-                    "filename": image.filename,
-                    "error": str(e)
-                })
+    decoder = threading.Thread(
+        target=_decode_uploads,
+        args=(images, decoded_queue, preprocess_costs, max_side, tile_size, tier, precision, preprocess, denoise),
+        daemon=True
+    )
+    decoder.start()
+
+    for item in iter(decoded_queue.get, _END_OF_UPLOADS):
+        idx, key, img_np, cached, error = item
+        if error is not None:
+            saved_files[idx] = {"filename": images[idx].filename, "error": str(error)}
+            continue
+        in_flight.acquire()
+        try:
+            if cached is not None:
+                seg_mask, depth_map, cleaned_objects = cached
+                _writer_pool.submit(write, idx, key, img_np, seg_mask, depth_map, cleaned_objects, None)
+                continue
+            # Run segmentation + depth + annotation, batched with whatever else is waiting
+            future = scheduler.submit(
+                img_np, priority, batch_size=batch_size, overlay=overlay, tile_size=tile_size or None,
+                tier=tier, precision=precision
+            )
+        except Exception as e:
+            # Nothing was queued that would hand the slot back, and the final drain waits for every slot
+            saved_files[idx] = {"filename": images[idx].filename, "error": str(e)}
+            in_flight.release()
+            continue
+        future.add_done_callback(lambda f, idx=idx, key=key, img_np=img_np: on_inferred(idx, key, img_np, f))
+
+    decoder.join()
+    # Every slot is back once the last write has finished
+    for _ in range(max_in_flight):
+        in_flight.acquire()
+    for idx, saved in enumerate(saved_files):
+        if saved is None:  # the decoder stopped before reaching it
+            saved_files[idx] = {"filename": images[idx].filename, "error": "Upload was not processed"}
+    for idx, cost in preprocess_costs.items():
+        saved_files[idx]["preprocess"] = cost
 
     return saved_files
 
-@app.route('/process', methods=['POST'])
+def run_segment_job(settings, input_paths):
+    """Job handler: runs process_uploaded_images on the uploads stored with the job."""
+    images = []
+    for filename, path in zip(settings["filenames"], input_paths):
+        with open(path, "rb") as f:
+            images.append(FileStorage(stream=io.BytesIO(f.read()), filename=filename))
+    options = {k: v for k, v in settings.items() if k != "filenames"}
+    return process_uploaded_images(images, **options)
+
+
+job_queue.register("segment", run_segment_job)
+
+
+def segment_settings(form):
+    """The process_uploaded_images options in a /process form, with defaults; raises ValueError for unknown choices."""
+    tier = form.get('tier', DEFAULT_TIER)
+    if tier not in MODEL_TIERS:
+        raise ValueError(f"Unknown tier '{tier}', expected one of {sorted(MODEL_TIERS)}")
+    precision = form.get('precision', DEFAULT_PRECISION)
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}', expected one of {list(PRECISIONS)}")
+    preprocess = form.get('preprocess', DEFAULT_PREPROCESS)
+    if preprocess not in PREPROCESS_MODES:
+        raise ValueError(f"Unknown preprocess mode '{preprocess}', expected one of {list(PREPROCESS_MODES)}")
+    denoise = form.get('denoise', DEFAULT_DENOISE)
+    if denoise not in DENOISE_MODES:
+        raise ValueError(f"Unknown denoise mode '{denoise}', expected one of {list(DENOISE_MODES)}")
+    # Interactive uploads run ahead of bulk (survey) ones, both in the job queue and at inference
+    priority = form.get('priority', DEFAULT_PRIORITY)
+    if priority not in PRIORITY_CLASSES:
+        raise ValueError(f"Unknown priority '{priority}', expected one of {list(PRIORITY_CLASSES)}")
+    return {
+        "batch_size": max(form.get('batch_size', BATCH_SIZE, type=int), 1),
+        "overlay": form.get('overlay', 'false').lower() in ('1', 'true', 'yes'),
+        "max_side": form.get('max_side', MAX_SIDE, type=int),
+        "tile_size": form.get('tile_size', TILE_SIZE, type=int),
+        "tier": tier,
+        "precision": precision,
+        "preprocess": preprocess,
+        "denoise": denoise,
+        "priority": priority,
+    }
+
+
+@segment_bp.route('/process', methods=['POST'])
 def analyze_images():
+    """
+    Queues segmentation + depth for the uploaded images and answers 202 with a job id
+    (see routes.jobs_flask); the job's result is the list process_uploaded_images returns.
+    """
     if 'images' not in request.files:
         return jsonify({"error": "No images uploaded"}), 400
+    try:
+        settings = segment_settings(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    images = request.files.getlist('images')
-    results = process_uploaded_images(images)
+    # The uploads are read now: the request's streams are gone by the time a worker runs the job
+    uploads = [(image.filename, image.stream.read()) for image in request.files.getlist('images')]
+    settings["filenames"] = [filename for filename, _ in uploads]
+    priority = settings["priority"]
+    return enqueue_response("segment", settings, uploads, PRIORITY_CLASSES[priority],
+                            cost_bytes=segment_cost(uploads, settings["max_side"]))
+
+
+@segment_bp.route('/models', methods=['GET'])
+def loaded_models():
+    """
+    Load time (seconds) and resident memory (bytes) of every model loaded so far, plus result
+    cache counters, inference batching and, when inference runs in pre-forked workers, how busy they are.
+    """
+    from scripts.model_registry import model_stats
 
-    return jsonify(results), 200
+    stats = model_stats()
+    stats["inference_scheduler"] = scheduler.stats()
+    if result_cache:
+        stats["result_cache"] = result_cache.stats()
+    if pool_stats():
+        stats["worker_pool"] = pool_stats()
+    return jsonify(stats), 200
 
 
 ## no need for a get request api the post handles uploading it in the database make the ui handle this request
\ No newline at end of file
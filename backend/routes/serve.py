@@ -0,0 +1,42 @@
+import argparse
+import logging
+import os
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from scripts.worker_pool import SERVING_PRELOAD, SERVING_THREADS_PER_WORKER, start_worker_pool
+
+# Production entry point (run from backend/): python routes/serve.py --workers 4
+# Inference runs in pre-forked model workers, HTTP and the job queue in this process.
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the API with a pool of pre-forked model workers.")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SERVING_WORKERS", "0")) or (os.cpu_count() or 1),
+                        help="Model worker processes (default SERVING_WORKERS, otherwise one per core)")
+    parser.add_argument("--threads-per-worker", type=int, default=SERVING_THREADS_PER_WORKER,
+                        help="torch intra-op threads per worker (default: cores / workers)")
+    parser.add_argument("--preload", default=SERVING_PRELOAD,
+                        help="tier:precision pairs loaded before forking, comma separated")
+    parser.add_argument("--http-threads", type=int, default=int(os.getenv("SERVING_HTTP_THREADS", "8")))
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5001)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    os.makedirs("database", exist_ok=True)
+
+    # Fork first: importing the app starts the job workers, and a process with threads must not fork
+    pool = start_worker_pool(args.workers, args.threads_per_worker, args.preload)
+    # Enough job workers to keep every model worker busy
+    os.environ.setdefault("JOB_WORKERS", str(args.workers))
+
+    from waitress import serve
+    from app import app
+
+    try:
+        serve(app, host=args.host, port=args.port, threads=args.http_threads)
+    finally:
+        if pool is not None:
+            pool.close()
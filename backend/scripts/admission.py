@@ -0,0 +1,128 @@
+import io
+import logging
+import math
+import os
+import threading
+
+from PIL import Image
+
+from scripts.jobs import FINISHED_STATUSES, JOB_WORKERS
+from scripts.metrics import available_memory_bytes, physical_memory_bytes
+
+logger = logging.getLogger(__name__)
+
+MIB = 1 << 20
+# Estimated peak memory of admitted (queued or running) work may not exceed this
+ADMISSION_MEMORY_BUDGET_BYTES = int(os.getenv("ADMISSION_MEMORY_BUDGET_BYTES", str(physical_memory_bytes() // 2 or 8 << 30)))
+ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", "64"))
+# New work is refused while the host has less than this available, whatever the estimates say
+ADMISSION_MIN_AVAILABLE_BYTES = int(os.getenv("ADMISSION_MIN_AVAILABLE_BYTES", str(512 * MIB)))
+
+# Cost model: model activations per image plus the decoded / preprocessed copies, mask, full-size
+# depth and annotated image, which grow with the megapixels
+BYTES_PER_IMAGE = int(os.getenv("ADMISSION_BYTES_PER_IMAGE", str(256 * MIB)))
+BYTES_PER_MEGAPIXEL = int(os.getenv("ADMISSION_BYTES_PER_MEGAPIXEL", str(48 * MIB)))
+# Flat costs of the API-bound jobs (image generation per requested variation)
+JOB_COSTS = {
+    "analyze_full": 64 * MIB,
+    "deep_research": 32 * MIB,
+    "generate_variations": 96 * MIB,
+}
+# Most variations one request may ask for, which bounds its generate_variations cost
+MAX_VARIATIONS = int(os.getenv("MAX_VARIATIONS", "5"))
+# Assumed job duration (seconds) for Retry-After until a job of that kind has finished
+DEFAULT_JOB_SECONDS = 30.0
+MAX_RETRY_AFTER = 300
+
+
+class Overloaded(Exception):
+    """Raised when a request doesn't fit the admission budget; retry_after is in seconds (None: never fits)."""
+
+    def __init__(self, reason, retry_after=None):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+def image_megapixels(data, max_side=0):
+    """Megapixels the pipeline will work on, read from the image header without decoding it."""
+    try:
+        width, height = Image.open(io.BytesIO(data)).size
+    except Exception:
+        return 0.0
+    if max_side and max(width, height) > max_side:
+        scale = max_side / max(width, height)
+        width, height = width * scale, height * scale
+    return width * height / 1e6
+
+
+def segment_cost(uploads, max_side=0):
+    """Estimated bytes to segment the (filename, bytes) uploads."""
+    return sum(BYTES_PER_IMAGE + int(image_megapixels(data, max_side) * BYTES_PER_MEGAPIXEL) for _, data in uploads)
+
+
+class AdmissionController:
+    """
+    Decides whether a new job may join the queue, from the jobs already admitted (queued or
+    running, as held by scripts.jobs.JobQueue, so the accounting survives restarts): their
+    summed cost must stay within memory_budget, the queue within max_queued, and the host must
+    have min_available bytes free. check() is called under the job queue's lock, so concurrent
+    submissions can't both take the last of the budget.
+    """
+
+    def __init__(self, memory_budget=ADMISSION_MEMORY_BUDGET_BYTES, max_queued=ADMISSION_MAX_QUEUED,
+                 min_available=ADMISSION_MIN_AVAILABLE_BYTES, workers=JOB_WORKERS):
+        self.memory_budget = memory_budget
+        self.max_queued = max_queued
+        self.min_available = min_available
+        self.workers = max(workers, 1)
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def retry_after(self, jobs, kind):
+        """Seconds until a worker is likely free: mean duration of kind's recent jobs times the backlog per worker."""
+        durations = [job["finished_at"] - job["started_at"] for job in jobs
+                     if job["kind"] == kind and job["status"] == "succeeded" and job["started_at"]][-20:]
+        mean_seconds = sum(durations) / len(durations) if durations else DEFAULT_JOB_SECONDS
+        backlog = sum(job["status"] not in FINISHED_STATUSES for job in jobs)
+        return min(max(math.ceil(mean_seconds * backlog / self.workers), 1), MAX_RETRY_AFTER)
+
+    def check(self, kind, cost_bytes, jobs):
+        """Raises Overloaded unless a job of kind costing cost_bytes fits next to jobs (every job record)."""
+        if cost_bytes > self.memory_budget:
+            self._reject()
+            raise Overloaded(f"Request needs ~{cost_bytes // MIB} MiB, more than the whole budget "
+                             f"of {self.memory_budget // MIB} MiB; send fewer or smaller images")
+
+        unfinished = [job for job in jobs if job["status"] not in FINISHED_STATUSES]
+        queued = sum(job["status"] == "queued" for job in unfinished)
+        reserved = sum(job.get("cost_bytes", 0) for job in unfinished)
+        available = available_memory_bytes()
+        if queued >= self.max_queued:
+            reason = f"{queued} jobs already queued"
+        elif reserved + cost_bytes > self.memory_budget:
+            reason = f"{reserved // MIB} of {self.memory_budget // MIB} MiB already reserved"
+        elif available is not None and available < self.min_available:
+            reason = f"only {available // MIB} MiB of memory available"
+        else:
+            return
+        self._reject()
+        raise Overloaded(f"Server busy: {reason}", self.retry_after(jobs, kind))
+
+    def _reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    def stats(self, jobs):
+        unfinished = [job for job in jobs if job["status"] not in FINISHED_STATUSES]
+        return {
+            "reserved_bytes": sum(job.get("cost_bytes", 0) for job in unfinished),
+            "memory_budget_bytes": self.memory_budget,
+            "queued": sum(job["status"] == "queued" for job in unfinished),
+            "running": sum(job["status"] == "running" for job in unfinished),
+            "max_queued": self.max_queued,
+            "available_bytes": available_memory_bytes(),
+            "rejected": self.rejected,
+        }
+
+
+admission = AdmissionController()
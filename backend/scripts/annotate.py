@@ -0,0 +1,60 @@
+import numpy as np
+
+BOX_COLOR = (255, 0, 0)
+MASK_ALPHA = 0.4
+
+
+def build_colour_lut(num_labels=256):
+    """Deterministic (num_labels, 3) uint8 RGB palette, one distinct colour per label id (PASCAL-style bit spreading)."""
+    lut = np.zeros((num_labels, 3), dtype=np.uint8)
+    for label in range(num_labels):
+        r = g = b = 0
+        c = label
+        for shift in range(7, -1, -1):
+            r |= ((c >> 0) & 1) << shift
+            g |= ((c >> 1) & 1) << shift
+            b |= ((c >> 2) & 1) << shift
+            c >>= 3
+        lut[label] = (r, g, b)
+    return lut
+
+
+COLOUR_LUT = build_colour_lut()
+
+
+def object_label_text(obj):
+    return f"{obj['label']} ({obj['median_depth']:.2f}m, W:{obj['estimated_width']:.2f}m, H:{obj['estimated_height']:.2f}m)"
+
+
+def render_annotations(image_np, objects, segmentation_mask=None, labels=None, mask_alpha=MASK_ALPHA, lut=COLOUR_LUT):
+    """
+    Draws every detected object's box and label onto a single copy of image_np.
+    If segmentation_mask is given it is first blended over the image through the colour
+    lookup table; with labels set, only pixels of those label ids are tinted.
+    """
+    import cv2  # here rather than at the top, so importing the routes doesn't load OpenCV
+
+    annotated_img = image_np.copy()
+
+    if segmentation_mask is not None:
+        h, w = annotated_img.shape[:2]
+        if segmentation_mask.shape != (h, w):
+            segmentation_mask = cv2.resize(segmentation_mask.astype(np.uint8), (w, h), interpolation=cv2.INTER_NEAREST)
+
+        colours = lut[segmentation_mask]
+        blended = cv2.addWeighted(annotated_img, 1 - mask_alpha, colours, mask_alpha, 0)
+        if labels is None:
+            annotated_img = blended
+        else:
+            tinted = np.zeros(len(lut), dtype=bool)
+            tinted[[label for label in labels if label < len(lut)]] = True
+            keep = tinted[segmentation_mask]
+            annotated_img[keep] = blended[keep]
+
+    for obj in objects:
+        x_min, y_min, x_max, y_max = obj["bbox"]
+        cv2.rectangle(annotated_img, (x_min, y_min), (x_max, y_max), color=BOX_COLOR, thickness=2)
+        cv2.putText(annotated_img, object_label_text(obj), (x_min, max(y_min - 5, 0)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, BOX_COLOR, thickness=2)
+
+    return annotated_img
@@ -0,0 +1,46 @@
+import os
+import threading
+
+import numpy as np
+
+from scripts.depth_result import DepthResult
+
+
+def mask_path(database_dir, base_name):
+    return os.path.join(database_dir, f"{base_name}_mask.npy")
+
+
+def depth_array_path(database_dir, base_name):
+    return os.path.join(database_dir, f"{base_name}_depth.npy")
+
+
+def _save_npy(path, array):
+    # Written under a temporary name first so readers never map a half-written file; the name is
+    # per writer, since two requests can store the same base name at once
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def save_segment_arrays(database_dir, base_name, segmentation_mask, depth_map):
+    """
+    Stores the uint8 segmentation mask (image size) and the float16 depth at the model's
+    native resolution as plain .npy files, lossless next to the JPEG previews.
+    Returns (mask_path, depth_path).
+    """
+    paths = mask_path(database_dir, base_name), depth_array_path(database_dir, base_name)
+    _save_npy(paths[0], np.ascontiguousarray(segmentation_mask, dtype=np.uint8))
+    _save_npy(paths[1], np.ascontiguousarray(depth_map.native, dtype=np.float16))
+    return paths
+
+
+def load_segment_arrays(database_dir, base_name, mmap=True):
+    """
+    Reads back what save_segment_arrays wrote as (segmentation_mask, DepthResult).
+    With mmap=True both arrays are memory-mapped read-only, so nothing is read until used.
+    """
+    mmap_mode = "r" if mmap else None
+    segmentation_mask = np.load(mask_path(database_dir, base_name), mmap_mode=mmap_mode)
+    depth = np.load(depth_array_path(database_dir, base_name), mmap_mode=mmap_mode)
+    return segmentation_mask, DepthResult(depth, segmentation_mask.shape)
@@ -0,0 +1,277 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+import cv2
+import numpy as np
+
+from scripts.depth_result import DepthResult
+from scripts.metrics import current_rss_bytes, peak_rss_bytes, stage_metrics
+from scripts.model_registry import DEFAULT_TIER, registry, resolve_precision, resolve_tier
+from scripts.object_stats import convert_numpy
+from scripts.pre_processing_image import preprocess_rgb
+from scripts.segment import ADE20K_LABELS, process_images
+
+RESOLUTIONS = [(640, 480), (1280, 960), (2048, 1536), (4032, 3024)]
+DEFAULT_THRESHOLD = 0.2  # fail when p50 latency regresses by more than 20%
+DEFAULT_MEMORY_THRESHOLD = 0.2
+MEMORY_SLACK_MIB = 8  # RSS moves by a few MiB run to run (allocator, page cache of the weights)
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "..", "benchmarks", "hot_paths_{models}.json")
+
+
+def synthetic_image(width, height, seed=0):
+    """Deterministic RGB test image: a lit gradient "room" with flat boxes and sensor-like noise."""
+    rng = np.random.default_rng(seed)
+    y = np.arange(height, dtype=np.float32)[:, None]
+    base = 60 + 120 * (y / height)[..., None] * np.array([1.0, 0.9, 0.8], dtype=np.float32)
+    img = np.broadcast_to(base, (height, width, 3)).copy()
+    for _ in range(6):
+        x0, y0 = rng.integers(0, width // 2), rng.integers(0, height // 2)
+        x1, y1 = x0 + rng.integers(width // 8, width // 2), y0 + rng.integers(height // 8, height // 2)
+        img[y0:y1, x0:x1] = rng.integers(20, 235, 3)
+    img += rng.normal(0, 6, img.shape).astype(np.float32)
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def install_stub_models(tier=DEFAULT_TIER, precision="fp32"):
+    """
+    Registers tiny randomly initialised stand-ins for Segformer and MiDaS under the registry
+    keys the tier would use, so the pipeline runs without downloading or loading weights.
+    Output shapes and dtypes match the real models; the numbers are meaningless.
+    """
+    import torch
+    from transformers import SegformerConfig, SegformerFeatureExtractor, SegformerForSemanticSegmentation
+
+    torch.manual_seed(0)
+    config = resolve_tier(tier)
+    segformer = SegformerForSemanticSegmentation(SegformerConfig(
+        num_labels=150, hidden_sizes=[16, 32, 64, 128], decoder_hidden_size=64,
+        depths=[1, 1, 1, 1], num_attention_heads=[1, 1, 2, 4]
+    )).eval()
+    feature_extractor = SegformerFeatureExtractor(size={"height": 256, "width": 256})
+
+    class StubMidas(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.conv = torch.nn.Conv2d(3, 1, 3, padding=1)
+
+        def forward(self, x):
+            return torch.relu(self.conv(x)).squeeze(1) + x.mean(1)
+
+    def midas_transform(img):
+        h, w = img.shape[:2]
+        scale = 256 / min(h, w)
+        resized = cv2.resize(img, (int(round(w * scale / 32)) * 32, int(round(h * scale / 32)) * 32))
+        normalized = (resized.astype(np.float32) / 255.0 - 0.5) / 0.5
+        return torch.from_numpy(normalized.transpose(2, 0, 1)).unsqueeze(0)
+
+    registry.clear()
+    segformer_weights = resolve_precision(precision, config["segformer"])
+    midas_weights = resolve_precision(precision, config["midas"])
+    registry.get(("segformer", config["segformer"], segformer_weights), lambda: (feature_extractor, segformer))
+    registry.get(("midas", config["midas"], midas_weights), lambda: (StubMidas().eval(), midas_transform))
+
+
+def _sample_objects(count=40, seed=0):
+    rng = np.random.default_rng(seed)
+    labels = list(ADE20K_LABELS.values())
+    return [{
+        "label": labels[i % len(labels)],
+        "bbox": [int(v) for v in rng.integers(0, 4000, 4)],
+        "median_depth": np.float32(rng.random() * 10),
+        "area": np.int64(rng.integers(1, 10**6)),
+        "pixel_width": np.int64(rng.integers(1, 4000)),
+        "pixel_height": np.int64(rng.integers(1, 4000)),
+        "estimated_width": np.float64(rng.random() * 5),
+        "estimated_height": np.float64(rng.random() * 5),
+    } for i in range(count)]
+
+
+def build_cases(resolutions, tier, precision):
+    """Returns {case name: (callable, images processed per call)}, one set per resolution."""
+    cases = {}
+    objects = _sample_objects()
+    output_dir = tempfile.mkdtemp(prefix="benchmark_hot_paths_")
+
+    def sidecar_write():
+        cleaned = [{k: convert_numpy(v) for k, v in obj.items()} for obj in objects]
+        with open(os.path.join(output_dir, "objects.json"), "w") as f:
+            json.dump(cleaned, f, indent=2)
+
+    cases["convert_numpy"] = (lambda: [{k: convert_numpy(v) for k, v in obj.items()} for obj in objects], 1)
+    cases["sidecar_json_write"] = (sidecar_write, 1)
+
+    for width, height in resolutions:
+        img = synthetic_image(width, height)
+        # MiDaS-like native depth: the short side at 384
+        scale = 384 / min(width, height)
+        native = cv2.GaussianBlur(img[..., 0].astype(np.float32), (0, 0), 8)
+        native = cv2.resize(native, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+        size = f"{width}x{height}"
+
+        cases[f"process_image@{size}"] = (
+            lambda img=img: process_images([img], batch_size=1, tier=tier, precision=precision), 1
+        )
+        cases[f"preprocess_bilateral@{size}"] = (lambda img=img: preprocess_rgb(img, "bilateral"), 1)
+        cases[f"preprocess_nlmeans_fast@{size}"] = (lambda img=img: preprocess_rgb(img, "nlmeans_fast"), 1)
+        cases[f"depth_colourize@{size}"] = (
+            lambda native=native, shape=img.shape: DepthResult(native, shape).colourized(), 1
+        )
+        cases[f"depth_full@{size}"] = (lambda native=native, shape=img.shape: DepthResult(native, shape).full(), 1)
+    return cases
+
+
+def measure_peak_rss(case, args):
+    """
+    Runs one case in a fresh interpreter and returns how far its resident set rose above the
+    process's size just before the case ran, in MiB. RSS sees torch / ATen and OpenCV
+    allocations that tracemalloc doesn't, and the high-water mark of a fresh process isn't
+    masked by earlier cases.
+    """
+    command = [
+        sys.executable, "-m", "scripts.benchmark_hot_paths", "--peak-rss-case", case, "--models", args.models,
+        "--tier", args.tier, "--precision", args.precision, "--resolutions", *args.resolutions,
+    ]
+    output = subprocess.run(command, cwd=BACKEND_DIR, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])["peak_rss_mib"]
+
+
+def _high_water_rss_bytes():
+    # VmHWM belongs to this address space; ru_maxrss (peak_rss_bytes) survives exec, so in a child
+    # it starts out at the benchmark process's own size
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return peak_rss_bytes()
+
+
+def _peak_rss_of(fn, warmup=1):
+    # Building the cases peaks above where the process settles; reset VmHWM to the current RSS
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+    rss_before = current_rss_bytes()
+    # The warm-up is included: one-time setup (kernel caches, lazy imports) is part of what a worker pays
+    for _ in range(warmup + 1):
+        fn()
+    return round(max(_high_water_rss_bytes() - rss_before, 0) / 2**20, 1)
+
+
+def run_case(fn, images_per_call, repeats, warmup=1):
+    for _ in range(warmup):
+        fn()
+
+    stage_metrics.reset()
+    latencies = []
+    for _ in range(repeats):
+        start = perf_counter()
+        fn()
+        latencies.append(perf_counter() - start)
+    snapshot = stage_metrics.snapshot()
+    stages = {stage: round(1000 * entry["sum_seconds"] / repeats, 3) for stage, entry in snapshot.items()}
+    stage_peak_rss = {stage: round(entry["peak_rss_bytes"] / 2**20, 1) for stage, entry in snapshot.items()}
+
+    latencies_ms = 1000 * np.asarray(latencies)
+    return {
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "p90_ms": round(float(np.percentile(latencies_ms, 90)), 3),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 3),
+        "throughput_per_s": round(images_per_call * repeats / (latencies_ms.sum() / 1000), 3),
+        "stages_ms": stages,
+        "stages_peak_rss_mib": stage_peak_rss,
+    }
+
+
+def compare_to_baseline(results, baseline, threshold=DEFAULT_THRESHOLD, memory_threshold=DEFAULT_MEMORY_THRESHOLD):
+    """Returns a list of human-readable regressions (empty when everything is within the thresholds)."""
+    regressions = []
+    for case, result in results.items():
+        reference = baseline.get(case)
+        if reference is None:
+            continue
+        if result["p50_ms"] > reference["p50_ms"] * (1 + threshold):
+            regressions.append(f"{case}: p50 {result['p50_ms']:.1f} ms vs baseline {reference['p50_ms']:.1f} ms")
+        if "peak_rss_mib" in reference and (
+                result["peak_rss_mib"] > reference["peak_rss_mib"] * (1 + memory_threshold) + MEMORY_SLACK_MIB):
+            regressions.append(f"{case}: peak RSS +{result['peak_rss_mib']:.1f} MiB "
+                               f"vs baseline +{reference['peak_rss_mib']:.1f} MiB")
+    return regressions
+
+
+def format_table(results):
+    lines = [
+        "| Case | p50 (ms) | p90 (ms) | p99 (ms) | Throughput (/s) | Peak RSS (+MiB) | Slowest stages (ms) |",
+        "|---|---|---|---|---|---|---|",
+    ]
+    for case, r in results.items():
+        slowest = sorted(r["stages_ms"].items(), key=lambda item: -item[1])[:3]
+        stages = ", ".join(f"{stage} {ms:.1f}" for stage, ms in slowest)
+        lines.append(f"| {case} | {r['p50_ms']:.1f} | {r['p90_ms']:.1f} | {r['p99_ms']:.1f} | "
+                     f"{r['throughput_per_s']:.2f} | {r['peak_rss_mib']:.1f} | {stages} |")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the CPU hot paths on synthetic images.")
+    parser.add_argument("--models", choices=["stub", "real"], default="stub",
+                        help="stub: tiny random models (no weights needed); real: the staged / cached models")
+    parser.add_argument("--tier", default=DEFAULT_TIER)
+    parser.add_argument("--precision", default="fp32")
+    parser.add_argument("--resolutions", nargs="*", default=[f"{w}x{h}" for w, h in RESOLUTIONS])
+    parser.add_argument("--cases", nargs="*", help="Only run cases whose name starts with one of these")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--baseline", help="Baseline JSON (default benchmarks/hot_paths_<models>.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--memory-threshold", type=float, default=DEFAULT_MEMORY_THRESHOLD)
+    parser.add_argument("--json", help="Optional path to also write the raw numbers to")
+    parser.add_argument("--peak-rss-case", help=argparse.SUPPRESS)  # internal: one case's memory, see measure_peak_rss
+    args = parser.parse_args()
+
+    if args.models == "stub":
+        install_stub_models(args.tier, args.precision)
+    resolutions = [tuple(int(v) for v in r.lower().split("x")) for r in args.resolutions]
+
+    if args.peak_rss_case:
+        fn, _ = build_cases(resolutions, args.tier, args.precision)[args.peak_rss_case]
+        print(json.dumps({"peak_rss_mib": _peak_rss_of(fn)}))
+        raise SystemExit(0)
+
+    results = {}
+    for case, (fn, images_per_call) in build_cases(resolutions, args.tier, args.precision).items():
+        if args.cases and not any(case.startswith(prefix) for prefix in args.cases):
+            continue
+        results[case] = run_case(fn, images_per_call, args.repeats)
+        results[case]["peak_rss_mib"] = measure_peak_rss(case, args)
+        print(f"{case}: p50 {results[case]['p50_ms']:.1f} ms")
+
+    print(format_table(results))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    baseline_path = args.baseline or DEFAULT_BASELINE.format(models=args.models)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Saved baseline to {baseline_path}")
+    elif os.path.exists(baseline_path):
+        with open(baseline_path, "r") as f:
+            regressions = compare_to_baseline(results, json.load(f), args.threshold, args.memory_threshold)
+        if regressions:
+            raise SystemExit("Regressions against " + baseline_path + ":\n" + "\n".join(regressions))
+        print(f"Within {args.threshold:.0%} of the baseline in {baseline_path}")
+    else:
+        print(f"No baseline at {baseline_path}; run with --save-baseline to create one")
@@ -0,0 +1,110 @@
+import argparse
+import glob
+import json
+import os
+from time import perf_counter
+
+import numpy as np
+
+from scripts.model_registry import MODEL_TIERS, current_rss_bytes, model_stats
+from scripts.segment import ADE20K_LABELS, load_rgb, process_images
+
+REFERENCE_TIER = "accurate"
+
+
+def label_agreement(mask, reference_mask, labels=ADE20K_LABELS):
+    """Mean IoU over the labels of interest (labels absent from both masks are skipped)."""
+    ious = []
+    for label in labels:
+        a = mask == label
+        b = reference_mask == label
+        union = np.count_nonzero(a | b)
+        if union:
+            ious.append(np.count_nonzero(a & b) / union)
+    return float(np.mean(ious)) if ious else 1.0
+
+
+def depth_agreement(depth, reference_depth):
+    """
+    MiDaS predicts relative inverse depth, so the tiers only agree up to scale and shift.
+    Aligns depth to the reference with least squares and returns the mean absolute error
+    relative to the reference's value range.
+    """
+    x = depth.ravel().astype(np.float64)
+    y = reference_depth.ravel().astype(np.float64)
+    scale, shift = np.polyfit(x, y, 1)
+    value_range = y.max() - y.min()
+    return float(np.mean(np.abs(scale * x + shift - y)) / value_range) if value_range else 0.0
+
+
+def benchmark_tiers(image_paths, tiers, max_side=None, repeats=3):
+    images = [load_rgb(path, max_side) for path in image_paths]
+    results = {}
+
+    for tier in tiers:
+        rss_before = current_rss_bytes()
+        process_images(images[:1], batch_size=1, tier=tier)  # warm-up, loads the models
+
+        latencies = []
+        outputs = None
+        for _ in range(repeats):
+            start = perf_counter()
+            outputs = [process_images([img], batch_size=1, tier=tier)[0] for img in images]
+            latencies.append((perf_counter() - start) / len(images))
+
+        results[tier] = {
+            "latency_ms": 1000 * float(np.median(latencies)),
+            "rss_mib": max(current_rss_bytes() - rss_before, 0) / 2**20,
+            "outputs": [(seg_mask, depth_map.full()) for _, seg_mask, depth_map, _, _ in outputs],
+        }
+
+    reference = results.get(REFERENCE_TIER)
+    for tier, result in results.items():
+        if reference is None:
+            result["label_miou"] = result["depth_error"] = None
+            continue
+        result["label_miou"] = float(np.mean([
+            label_agreement(mask, ref_mask) for (mask, _), (ref_mask, _) in zip(result["outputs"], reference["outputs"])
+        ]))
+        result["depth_error"] = float(np.mean([
+            depth_agreement(depth, ref_depth) for (_, depth), (_, ref_depth) in zip(result["outputs"], reference["outputs"])
+        ]))
+    for result in results.values():
+        del result["outputs"]
+    return results
+
+
+def format_table(results):
+    lines = [
+        f"| Tier | Latency / image (ms) | Added RSS (MiB) | Label mIoU vs {REFERENCE_TIER} | Depth error vs {REFERENCE_TIER} |",
+        "|---|---|---|---|---|",
+    ]
+    for tier, r in results.items():
+        miou = "n/a" if r["label_miou"] is None else f"{r['label_miou']:.3f}"
+        depth = "n/a" if r["depth_error"] is None else f"{r['depth_error']:.2%}"
+        lines.append(f"| {tier} | {r['latency_ms']:.0f} | {r['rss_mib']:.0f} | {miou} | {depth} |")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare latency, memory and agreement of the model tiers.")
+    parser.add_argument("images", help="Directory of reference images")
+    parser.add_argument("--tiers", nargs="*", default=list(MODEL_TIERS))
+    parser.add_argument("--max-side", type=int, default=None)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--json", help="Optional path to also write the raw numbers to")
+    args = parser.parse_args()
+
+    paths = sorted(
+        p for p in glob.glob(os.path.join(args.images, "*"))
+        if p.lower().endswith((".jpg", ".jpeg", ".png"))
+    )
+    # Reference tier first so the others can be compared against it
+    tiers = sorted(args.tiers, key=lambda t: t != REFERENCE_TIER)
+    results = benchmark_tiers(paths, tiers, args.max_side, args.repeats)
+
+    print(format_table(results))
+    print(f"\nModel load stats: {json.dumps(model_stats(), indent=2)}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,57 @@
+import argparse
+import glob
+import os
+
+import numpy as np
+
+from scripts.model_registry import DEFAULT_TIER, PRECISIONS
+from scripts.segment import depth_batch, load_rgb
+
+# Same-shape inputs share a forward pass, so only float reordering should differ
+MAX_DEPTH_RELATIVE_ERROR = 1e-4
+
+
+def compare_batched_to_alone(image_paths, tier=DEFAULT_TIER, precision="fp32", max_side=None):
+    """
+    Runs MiDaS on every image alone and on all of them as one mixed-shape batch, as the
+    inference scheduler merges requests. Returns one row per image with the worst relative
+    difference between the two native depth maps.
+    """
+    images = [load_rgb(path, max_side) for path in image_paths]
+    batched = depth_batch(images, tier, precision)
+    rows = []
+    for path, img_np, together in zip(image_paths, images, batched):
+        alone = depth_batch([img_np], tier, precision)[0]
+        if alone.native.shape != together.native.shape:
+            error = float("inf")
+        else:
+            scale = max(float(np.abs(alone.native).max()), 1e-6)
+            error = float(np.abs(together.native - alone.native).max()) / scale
+        rows.append({"image": os.path.basename(path), "max_depth_error": error})
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check that an image's depth is the same alone and inside a mixed batch."
+    )
+    parser.add_argument("images", help="Directory of reference images (ideally of different sizes)")
+    parser.add_argument("--precision", choices=PRECISIONS, default="fp32")
+    parser.add_argument("--tier", default=DEFAULT_TIER)
+    parser.add_argument("--max-side", type=int, default=None)
+    parser.add_argument("--max-depth-error", type=float, default=MAX_DEPTH_RELATIVE_ERROR)
+    args = parser.parse_args()
+
+    paths = sorted(
+        p for p in glob.glob(os.path.join(args.images, "*"))
+        if p.lower().endswith((".jpg", ".jpeg", ".png"))
+    )
+    failures = 0
+    for row in compare_batched_to_alone(paths, args.tier, args.precision, args.max_side):
+        ok = row["max_depth_error"] <= args.max_depth_error
+        failures += not ok
+        print(f"{'OK  ' if ok else 'FAIL'} {row['image']}: max depth difference in a batch {row['max_depth_error']:.2e}")
+
+    if failures:
+        raise SystemExit(f"{failures}/{len(paths)} images changed depth inside a batch")
+    print(f"Depth is independent of batching on {len(paths)} images")
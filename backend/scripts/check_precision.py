@@ -0,0 +1,73 @@
+import argparse
+import glob
+import os
+
+import numpy as np
+
+from scripts.model_registry import DEFAULT_TIER, PRECISIONS
+from scripts.segment import load_rgb, process_images
+
+# Defaults for what counts as "close enough" to fp32
+MIN_MASK_AGREEMENT = 0.97
+MAX_DEPTH_RELATIVE_ERROR = 0.05
+
+
+def compare_to_fp32(image_paths, precision, tier=DEFAULT_TIER, max_side=None):
+    """
+    Runs every image at fp32 and at `precision` and compares the outputs.
+    Returns one row per image with the fraction of mask pixels that agree and the worst
+    relative median_depth difference over the objects both runs detected.
+    """
+    rows = []
+    for path in image_paths:
+        img_np = load_rgb(path, max_side)
+        _, ref_mask, _, ref_objects, _ = process_images([img_np], batch_size=1, tier=tier, precision="fp32")[0]
+        _, mask, _, objects, _ = process_images([img_np], batch_size=1, tier=tier, precision=precision)[0]
+
+        ref_depths = {obj["label"]: obj["median_depth"] for obj in ref_objects}
+        depth_errors = [
+            abs(obj["median_depth"] - ref_depths[obj["label"]]) / max(abs(ref_depths[obj["label"]]), 1e-6)
+            for obj in objects if obj["label"] in ref_depths
+        ]
+        rows.append({
+            "image": os.path.basename(path),
+            "mask_agreement": float(np.mean(mask == ref_mask)),
+            "max_depth_error": float(max(depth_errors)) if depth_errors else 0.0,
+            "labels_fp32": sorted(ref_depths),
+            "labels": sorted(obj["label"] for obj in objects),
+        })
+    return rows
+
+
+def within_tolerance(row, min_mask_agreement=MIN_MASK_AGREEMENT, max_depth_error=MAX_DEPTH_RELATIVE_ERROR):
+    return (
+        row["mask_agreement"] >= min_mask_agreement
+        and row["max_depth_error"] <= max_depth_error
+        and row["labels"] == row["labels_fp32"]
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check a reduced-precision mode against fp32 on reference images.")
+    parser.add_argument("images", help="Directory of reference images")
+    parser.add_argument("--precision", choices=[p for p in PRECISIONS if p != "fp32"], default="int8")
+    parser.add_argument("--tier", default=DEFAULT_TIER)
+    parser.add_argument("--max-side", type=int, default=None)
+    parser.add_argument("--min-mask-agreement", type=float, default=MIN_MASK_AGREEMENT)
+    parser.add_argument("--max-depth-error", type=float, default=MAX_DEPTH_RELATIVE_ERROR)
+    args = parser.parse_args()
+
+    paths = sorted(
+        p for p in glob.glob(os.path.join(args.images, "*"))
+        if p.lower().endswith((".jpg", ".jpeg", ".png"))
+    )
+    failures = 0
+    for row in compare_to_fp32(paths, args.precision, args.tier, args.max_side):
+        ok = within_tolerance(row, args.min_mask_agreement, args.max_depth_error)
+        failures += not ok
+        print(f"{'OK  ' if ok else 'FAIL'} {row['image']}: mask agreement {row['mask_agreement']:.2%}, "
+              f"max median_depth error {row['max_depth_error']:.2%}, labels {row['labels']} vs fp32 {row['labels_fp32']}")
+
+    if failures:
+        raise SystemExit(f"{failures}/{len(paths)} images outside tolerance for {args.precision}")
+    print(f"{args.precision} matches fp32 within tolerance on {len(paths)} images")
@@ -3,6 +3,8 @@ import json
 import cohere
 from dotenv import load_dotenv
 
+from scripts.metrics import span
+
 load_dotenv()
 COHERE_API_KEY = os.getenv("COHERE_API_KEY")
 co = cohere.Client(COHERE_API_KEY)
@@ -15,6 +17,16 @@ def generate_image_edit_description(cohere_path, deep_research_path, output_path
     cohere_data = load_json_file(cohere_path)
     research_data = load_json_file(deep_research_path)
 
+    description_text = describe_image_edits(cohere_data, research_data)
+
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(description_text)
+
+    print(f"[✅] Edit description saved to {output_path}")
+    return description_text
+
+def describe_image_edits(cohere_data, research_data):
+    """The image edit instructions for the structured upgrades and deep research report already in memory."""
     prompt = (
         "You are an accessibility upgrade specialist working with a visual AI team.\n\n"
         "Your task is to **analyze the accessibility upgrades** described below and write **a detailed, visual instruction manual** for how to transform the original image so that it reflects the upgrades perfectly.\n\n"
@@ -30,19 +42,14 @@ def generate_image_edit_description(cohere_path, deep_research_path, output_path
         "--- END OF DATA ---\n"
     )
 
-    response = co.chat(
-        model="command-r-plus",
-        message=prompt,
-        temperature=0.4,
-    )
-
-    description_text = response.text.strip()
+    with span("cohere"):
+        response = co.chat(
+            model="command-r-plus",
+            message=prompt,
+            temperature=0.4,
+        )
 
-    with open(output_path, "w", encoding="utf-8") as f:
-        f.write(description_text)
-
-    print(f"[✅] Edit description saved to {output_path}")
-    return description_text
+    return response.text.strip()
 
 if __name__ == "__main__":
     base_name = "stairs"
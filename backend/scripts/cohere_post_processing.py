@@ -3,6 +3,8 @@ import os
 import json
 from dotenv import load_dotenv
 
+from scripts.metrics import span
+
 load_dotenv()
 COHERE_API_KEY = os.getenv("COHERE_API_KEY") 
 
@@ -56,9 +58,10 @@ def parse_gemini_output(gemini_output: str):
     }
 
     # Call Cohere's Command R+ model
-    response = co.chat(
-        model="command-r-plus",
-        message=f"""Convert the following accessibility upgrade suggestions into structured JSON using the schema provided. 
+    with span("cohere"):
+        response = co.chat(
+            model="command-r-plus",
+            message=f"""Convert the following accessibility upgrade suggestions into structured JSON using the schema provided. 
     For upgrades that apply to multiple locations, such as tactile strips at both the top and bottom of the stairway, include multiple bounding boxes in the 'bbox' field as a list of [x1, y1, x2, y2] arrays.
 
     Respond ONLY with valid JSON.
@@ -74,10 +77,10 @@ def parse_gemini_output(gemini_output: str):
     Suggestions:
     {gemini_output}
     """,
-        response_format={
-            "type": "json_object",
-            "schema": schema
-        }
+            response_format={
+                "type": "json_object",
+                "schema": schema
+            }
         )
 
     # Output result
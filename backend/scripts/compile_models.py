@@ -0,0 +1,118 @@
+import argparse
+import glob
+import os
+
+import torch
+
+from scripts import model_store
+from scripts.model_registry import MODEL_TIERS, load_midas, load_segformer
+
+# MiDaS is traced at one square input size per model (the size its transform targets)
+MIDAS_INPUT_SIZES = {"DPT_Large": 384, "DPT_Hybrid": 384, "MiDaS_small": 256}
+MAX_ABS_ERROR = 1e-3
+
+
+class SegformerLogits(torch.nn.Module):
+    """Segformer with a tensor-only forward (pixel_values -> logits), which is what tracing needs."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return self.model(pixel_values=pixel_values, return_dict=False)[0]
+
+
+def _feature_extractor_size(feature_extractor):
+    size = feature_extractor.size
+    if isinstance(size, dict):
+        return size["height"], size["width"]
+    return size, size
+
+
+def _max_error(a, b):
+    return (a.float() - b.float()).abs().max().item()
+
+
+def trace_and_verify(module, example):
+    """
+    Traces and freezes `module` on `example` and checks it against eager at batch 1 and 2.
+    Returns (script_module, meta); meta["dynamic_batch"] is False when the graph baked in the batch size.
+    """
+    module.eval()
+    with torch.no_grad():
+        traced = torch.jit.trace(module, example)
+        # Only the frozen graph is saved: optimize_for_inference output doesn't reload,
+        # so the store applies that pass after loading
+        traced = torch.jit.freeze(traced)
+
+        error = _max_error(traced(example), module(example))
+        if error > MAX_ABS_ERROR:
+            raise RuntimeError(f"Traced module differs from eager by {error:.2e}")
+
+        pair = torch.cat([example, torch.rand_like(example)])
+        try:
+            dynamic_batch = _max_error(traced(pair), module(pair)) <= MAX_ABS_ERROR
+        except RuntimeError:
+            dynamic_batch = False
+
+    return traced, {
+        "input_shape": list(example.shape[1:]),
+        "dynamic_batch": dynamic_batch,
+        "max_abs_error": error,
+        "torch": torch.__version__,
+    }
+
+
+def compile_segformer(checkpoint):
+    feature_extractor, model = load_segformer(checkpoint)
+    height, width = _feature_extractor_size(feature_extractor)
+    device = next(model.parameters()).device
+    example = torch.rand(1, 3, height, width, device=device)
+    traced, meta = trace_and_verify(SegformerLogits(model), example)
+    return model_store.save_compiled(traced, checkpoint, meta), meta
+
+
+def compile_midas(model_type, transform_name):
+    model, _ = load_midas(model_type, transform_name)
+    size = MIDAS_INPUT_SIZES[model_type]
+    device = next(model.parameters()).device
+    traced, meta = trace_and_verify(model, torch.rand(1, 3, size, size, device=device))
+    meta["input_size"] = size
+    return model_store.save_compiled(traced, model_type, meta), meta
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build TorchScript artifacts for the staged models.")
+    parser.add_argument("--tiers", nargs="*", default=["accurate"], choices=sorted(MODEL_TIERS))
+    parser.add_argument("--reference-images", help="Directory of images to compare the compiled models against "
+                                                   "the eager fp32 pipeline on (see scripts.check_precision)")
+    args = parser.parse_args()
+
+    for tier in args.tiers:
+        config = MODEL_TIERS[tier]
+        for path, meta in (
+            compile_segformer(config["segformer"]),
+            compile_midas(config["midas"], config["midas_transform"]),
+        ):
+            print(f"Compiled {path} (dynamic batch: {meta['dynamic_batch']}, "
+                  f"max error vs eager: {meta['max_abs_error']:.2e})")
+
+    if args.reference_images:
+        # The trace check above feeds both graphs the same square input; this runs whole images
+        # through each pipeline, eager keeping the aspect ratio and compiled squashing to the traced size
+        from scripts.check_precision import compare_to_fp32, within_tolerance
+
+        paths = sorted(
+            p for p in glob.glob(os.path.join(args.reference_images, "*"))
+            if p.lower().endswith((".jpg", ".jpeg", ".png"))
+        )
+        failures = 0
+        for tier in args.tiers:
+            for row in compare_to_fp32(paths, "compiled", tier):
+                ok = within_tolerance(row)
+                failures += not ok
+                print(f"{'OK  ' if ok else 'FAIL'} {tier} {row['image']}: mask agreement {row['mask_agreement']:.2%}, "
+                      f"max median_depth error {row['max_depth_error']:.2%}")
+        if failures:
+            raise SystemExit(f"{failures} images outside tolerance for the compiled models")
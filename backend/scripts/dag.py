@@ -0,0 +1,101 @@
+import logging
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from time import perf_counter
+
+from scripts.metrics import span
+
+logger = logging.getLogger(__name__)
+
+# fn is called with one keyword argument per dependency, holding that stage's return value
+Stage = namedtuple("Stage", ["name", "fn", "deps"])
+
+
+class StageFailed(RuntimeError):
+    """A stage raised; the stages that depended on it were not started."""
+
+    def __init__(self, stage, error):
+        super().__init__(f"Stage '{stage}' failed: {error}")
+        self.stage = stage
+
+
+def run_dag(stages, max_workers=None):
+    """
+    Runs every stage as soon as all of its deps have returned, so independent stages overlap,
+    and passes the outputs along in memory. Returns ({name: output}, timings report, see
+    timing_report). If a stage raises, nothing new is started, the running stages are waited
+    for and StageFailed is raised.
+    """
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        unknown = [dep for dep in stage.deps if dep not in by_name]
+        if unknown:
+            raise ValueError(f"Stage '{stage.name}' depends on unknown stages {unknown}")
+
+    outputs = {}
+    times = {}  # name -> (start, end) relative to the start of the run
+    started = perf_counter()
+
+    def run(stage):
+        start = perf_counter() - started
+        with span(f"pipeline_{stage.name}"):
+            output = stage.fn(**{dep: outputs[dep] for dep in stage.deps})
+        times[stage.name] = (start, perf_counter() - started)
+        return output
+
+    waiting = list(stages)
+    running = {}
+    failure = None
+    with ThreadPoolExecutor(max_workers=max_workers or len(stages), thread_name_prefix="pipeline-stage") as executor:
+        while waiting or running:
+            if failure is None:
+                for stage in [stage for stage in waiting if all(dep in outputs for dep in stage.deps)]:
+                    waiting.remove(stage)
+                    running[executor.submit(run, stage)] = stage
+            if not running:
+                if failure is None:
+                    raise ValueError(f"Stages {[stage.name for stage in waiting]} depend on each other")
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    outputs[stage.name] = future.result()
+                except Exception as e:
+                    logger.exception("Pipeline stage %s failed", stage.name)
+                    failure = failure or StageFailed(stage.name, e)
+    if failure is not None:
+        raise failure
+    return outputs, timing_report(stages, times)
+
+
+def timing_report(stages, times):
+    """
+    Per stage: start and end (seconds from the start of the run), duration and the dependency
+    it waited for last. The critical path follows those last dependencies back from the stage
+    that finished last: speeding up anything off it doesn't shorten the run.
+    """
+    deps = {stage.name: stage.deps for stage in stages}
+    report = {}
+    for name, (start, end) in times.items():
+        waited_for = max(deps[name], key=lambda dep: times[dep][1]) if deps[name] else None
+        report[name] = {"start": round(start, 3), "end": round(end, 3), "seconds": round(end - start, 3),
+                        "waited_for": waited_for}
+
+    path = []
+    name = max(times, key=lambda name: times[name][1]) if times else None
+    while name is not None:
+        path.append(name)
+        name = report[name]["waited_for"]
+    path.reverse()
+
+    wall = max((end for _, end in times.values()), default=0.0)
+    busy = sum(end - start for start, end in times.values())
+    return {
+        "stages": report,
+        "critical_path": [{"stage": name, "seconds": report[name]["seconds"]} for name in path],
+        "critical_path_seconds": round(sum(report[name]["seconds"] for name in path), 3),
+        "wall_seconds": round(wall, 3),
+        # Time the same stages would have taken one after another
+        "sequential_seconds": round(busy, 3),
+    }
@@ -0,0 +1,67 @@
+import numpy as np
+
+from scripts.metrics import span
+
+
+class DepthResult:
+    """
+    MiDaS depth for one image, kept at the model's native resolution.
+    The full image-size map and the colourized BGR image (per colormap) are only computed
+    when first asked for, then cached. np.asarray(result) gives the full-size map. OpenCV is
+    only imported by those methods, so the routes can import this module without loading it.
+    """
+
+    def __init__(self, native, image_shape):
+        self.native = native  # float32 (or stored float16) (h, w) at the model's output resolution
+        self.image_shape = tuple(image_shape[:2])
+        self._full = None
+        self._colourized = {}  # colormap -> BGR image
+
+    @property
+    def shape(self):
+        return self.image_shape
+
+    @property
+    def scale(self):
+        """(sx, sy) factors from native to image pixel coordinates."""
+        h, w = self.native.shape
+        return self.image_shape[1] / w, self.image_shape[0] / h
+
+    def _native_float32(self):
+        # OpenCV has no float16 support; this is a no-op for maps straight from the model
+        return np.asarray(self.native, dtype=np.float32)
+
+    def full(self):
+        """Depth map bicubically upsampled to the image size."""
+        if self._full is None:
+            import cv2
+
+            if self.native.shape == self.image_shape:
+                self._full = self._native_float32()
+            else:
+                h, w = self.image_shape
+                with span("depth_upsample"):
+                    self._full = cv2.resize(self._native_float32(), (w, h), interpolation=cv2.INTER_CUBIC)
+        return self._full
+
+    def colourized(self, colormap=None):
+        """
+        Image-size BGR uint8 rendering (colormap defaults to cv2.COLORMAP_INFERNO), min/max
+        normalized; upsampled from the native map after normalizing.
+        """
+        import cv2
+
+        if colormap is None:
+            colormap = cv2.COLORMAP_INFERNO
+        if colormap not in self._colourized:
+            with span("depth_colourize"):
+                normalized = cv2.normalize(self._native_float32(), None, 0, 255, cv2.NORM_MINMAX)
+                if normalized.shape != self.image_shape:
+                    h, w = self.image_shape
+                    normalized = cv2.resize(normalized, (w, h), interpolation=cv2.INTER_CUBIC)
+                self._colourized[colormap] = cv2.applyColorMap(np.clip(normalized, 0, 255).astype(np.uint8), colormap)
+        return self._colourized[colormap]
+
+    def __array__(self, dtype=None, copy=None):
+        full = self.full()
+        return full if dtype is None else full.astype(dtype)
@@ -6,6 +6,13 @@ from dotenv import load_dotenv
 from google import genai
 from google.genai import types
 from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+
+from scripts.metrics import span
+
+# Image generations in flight across every request; each holds the decoded image and the response
+GENERATION_CONCURRENCY = int(os.getenv("GEMINI_IMAGE_CONCURRENCY", "4"))
+_generation_slots = threading.BoundedSemaphore(GENERATION_CONCURRENCY)
 
 
 def extract_upgrades(cohere_post_processed_path):
@@ -20,7 +27,10 @@ def extract_upgrades(cohere_post_processed_path):
 def extract_deep_research_information(deep_research_report_path):
     with open(deep_research_report_path, 'r', encoding='utf-8') as f:
         data = json.load(f)
+    return style_variations_from_report(data)
 
+def style_variations_from_report(data):
+    """{upgrade name: {"variations": [{"material", "cost"}]}} from a deep research report."""
     style_variations_map = {}
     if "deep_research_results" in data:
         for item in data["deep_research_results"]:
@@ -122,13 +132,14 @@ def generate_single_variation(client, original_image, upgrades, style_variations
         "hyperrealistically integrated. Distinct visuals.\n"
     )
 
-    response = client.models.generate_content(
-        model="gemini-2.0-flash-exp-image-generation",
-        contents=[final_prompt, original_image],
-        config=types.GenerateContentConfig(
-            response_modalities=['Text', 'Image']
+    with _generation_slots, span("gemini_image_generation"):
+        response = client.models.generate_content(
+            model="gemini-2.0-flash-exp-image-generation",
+            contents=[final_prompt, original_image],
+            config=types.GenerateContentConfig(
+                response_modalities=['Text', 'Image']
+            )
         )
-    )
 
     updated_image = None
     raw_text_output = ""
@@ -147,16 +158,19 @@ def generate_accessibility_upgraded_images(
     deep_research_report_path,
     max_variations=3
 ):
+    original_image = Image.open(original_image_path).convert("RGB")
+    upgrades = extract_upgrades(cohere_post_processed_path)
+    style_variations_map = extract_deep_research_information(deep_research_report_path)
+    return generate_upgraded_images(original_image, upgrades, style_variations_map, max_variations)
+
+def generate_upgraded_images(original_image, upgrades, style_variations_map, max_variations=3):
+    """generate_accessibility_upgraded_images on a PIL image, upgrades and variations map already in memory."""
     load_dotenv()
     GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
     if not GEMINI_API_KEY:
         raise ValueError("GEMINI_API_KEY not found in environment variables.")
 
     client = genai.Client(api_key=GEMINI_API_KEY)
-    original_image = Image.open(original_image_path).convert("RGB")
-    upgrades = extract_upgrades(cohere_post_processed_path)
-    style_variations_map = extract_deep_research_information(deep_research_report_path)
-
     n_variations_per_upgrade = [
         len(style_variations_map.get(upg.get("type", ""), {}).get("variations", []))
         for upg in upgrades
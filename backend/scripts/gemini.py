@@ -5,6 +5,8 @@ from dotenv import load_dotenv
 import cv2
 import numpy as np
 
+from scripts.metrics import span
+
 load_dotenv()
 
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
@@ -14,10 +16,11 @@ def calculate_brightness(image_path):
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     return np.mean(gray)
 
-def analyze_accessibility(prepro_img_path, depth_map_path, annotated_image_path, detected_objects, accessibility_type="visual"):
-    # Set your API key
-    genai.configure(api_key=GEMINI_API_KEY)
+def image_brightness(img_np):
+    """calculate_brightness for an RGB array already in memory."""
+    return np.mean(cv2.cvtColor(img_np, cv2.COLOR_RGB2GRAY))
 
+def analyze_accessibility(prepro_img_path, depth_map_path, annotated_image_path, detected_objects, accessibility_type="visual"):
     # Load your image
     original_image = Image.open(prepro_img_path).convert("RGB")
     depth_map_image = Image.open(depth_map_path).convert("RGB")
@@ -26,6 +29,16 @@ def analyze_accessibility(prepro_img_path, depth_map_path, annotated_image_path,
     # Calculate brightness for lighting context
     brightness = calculate_brightness(prepro_img_path)
 
+    return analyze_accessibility_images(
+        original_image, depth_map_image, annotated_image, brightness, detected_objects, accessibility_type
+    )
+
+def analyze_accessibility_images(original_image, depth_map_image, annotated_image, brightness, detected_objects,
+                                 accessibility_type="visual"):
+    """analyze_accessibility on RGB PIL images already in memory."""
+    # Set your API key
+    genai.configure(api_key=GEMINI_API_KEY)
+
     # Identify existing accessibility features
     accessibility_features = ['tactile_strip', 'ramp', 'signage']  # Expand as needed
     existing_features = [obj['label'] for obj in detected_objects if obj['label'] in accessibility_features]
@@ -117,9 +130,10 @@ def analyze_accessibility(prepro_img_path, depth_map_path, annotated_image_path,
     model = genai.GenerativeModel("gemini-2.0-flash")
 
     # Send a prompt with the image
-    response = model.generate_content(
-        [original_image, depth_map_image, annotated_image, full_prompt]
-    )
+    with span("gemini"):
+        response = model.generate_content(
+            [original_image, depth_map_image, annotated_image, full_prompt]
+        )
 
     return response.text
 
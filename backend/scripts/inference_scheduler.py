@@ -0,0 +1,131 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+from concurrent.futures import Future
+from time import perf_counter
+
+from scripts.worker_pool import pool_stats, run_inference
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first: interactive uploads jump ahead of bulk survey work
+PRIORITY_CLASSES = {"interactive": 0, "bulk": 1}
+DEFAULT_PRIORITY = "interactive"
+# How long the first image of a batch waits for others to join it
+BATCH_WINDOW_MS = float(os.getenv("INFERENCE_BATCH_WINDOW_MS", "10"))
+MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", "8"))
+
+
+class InferenceScheduler:
+    """
+    Cross-request micro-batching in front of run_inference. Single images from any number of
+    requests wait in one priority queue; the dispatcher takes the most urgent image, waits up to
+    window_ms (from when it arrived) for more images with the same options, and runs them as one
+    batch of at most min(batch_size, max_batch). Each caller gets a Future of its own
+    process_images result. Up to `concurrency` batches run at once (by default one per model
+    worker, see scripts.worker_pool), and the next batch keeps filling while they do.
+    """
+
+    def __init__(self, window_ms=BATCH_WINDOW_MS, max_batch=MAX_BATCH, concurrency=None):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.concurrency = concurrency
+        self._changed = threading.Condition()
+        self._pending = []  # heap of (priority, arrival order, arrival time, options key, image, options, future)
+        self._order = itertools.count()
+        self._dispatcher = None
+        self.batches = 0
+        self.images = 0
+
+    def _start(self):
+        # Started on first use, once it is known whether inference runs in a worker pool
+        if self.concurrency is None:
+            stats = pool_stats()
+            self.concurrency = stats["workers"] if stats else 1
+        self._free_slots = threading.Semaphore(self.concurrency)
+        self._dispatcher = threading.Thread(target=self._dispatch, name="inference-scheduler", daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, image, priority=DEFAULT_PRIORITY, **options):
+        """
+        Queues one RGB array for process_images(**options) (batch_size, overlay, tile_size, tier,
+        precision). Returns a Future of its (img_np, seg_mask, depth_map, detected_objects,
+        annotated_img) tuple.
+        """
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown priority '{priority}', expected one of {list(PRIORITY_CLASSES)}")
+        future = Future()
+        key = tuple(sorted(options.items()))
+        with self._changed:
+            if self._dispatcher is None:
+                self._start()
+            heapq.heappush(self._pending, (
+                PRIORITY_CLASSES[priority], next(self._order), perf_counter(), key, image, options, future
+            ))
+            self._changed.notify()
+        return future
+
+    def _next_batch(self):
+        """Waits for the batch window of the most urgent image, then removes and returns its batch."""
+        with self._changed:
+            while True:
+                if not self._pending:
+                    self._changed.wait()
+                    continue
+                _, _, arrived, key, _, options, _ = self._pending[0]
+                limit = max(min(options.get("batch_size", self.max_batch), self.max_batch), 1)
+                batch = [item for item in self._pending if item[3] == key]
+                remaining = arrived + self.window - perf_counter()
+                if len(batch) >= limit or remaining <= 0:
+                    break
+                self._changed.wait(remaining)
+
+            batch = sorted(batch)[:limit]
+            taken = {item[1] for item in batch}
+            self._pending = [item for item in self._pending if item[1] not in taken]
+            heapq.heapify(self._pending)
+            return batch
+
+    def _dispatch(self):
+        while True:
+            # Only form a batch once it can start, so images arriving meanwhile still join it
+            self._free_slots.acquire()
+            batch = self._next_batch()
+            # A plain thread per batch (bounded by the slots): unlike an executor's, it can still
+            # start while the interpreter shuts down, so running jobs drain instead of hanging
+            threading.Thread(target=self._run_batch, args=(batch,), name="inference-batch", daemon=True).start()
+
+    def _run_batch(self, batch):
+        try:
+            options = batch[0][5]
+            results = run_inference([item[4] for item in batch], **options)
+            for item, result in zip(batch, results):
+                item[6].set_result(result)
+            with self._changed:
+                self.batches += 1
+                self.images += len(batch)
+            logger.debug("Ran a batch of %d images (%d waiting)", len(batch), len(self._pending))
+        except Exception as e:
+            for item in batch:
+                if not item[6].done():
+                    item[6].set_exception(e)
+        finally:
+            self._free_slots.release()
+
+    def stats(self):
+        with self._changed:
+            waiting = {name: 0 for name in PRIORITY_CLASSES}
+            names = {value: name for name, value in PRIORITY_CLASSES.items()}
+            for item in self._pending:
+                waiting[names[item[0]]] += 1
+        return {
+            "batches": self.batches,
+            "images": self.images,
+            "mean_batch_size": round(self.images / self.batches, 2) if self.batches else None,
+            "waiting": waiting,
+        }
+
+
+scheduler = InferenceScheduler()
@@ -0,0 +1,329 @@
+import hashlib
+import heapq
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+JOBS_DIR = os.getenv("JOBS_DIR", os.path.join("database", "jobs"))
+# How many jobs run at once; the rest wait in the queue
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# A job interrupted by a restart is re-run this many times before it is marked failed
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "2"))
+# Finished jobs older than this are deleted (at startup and whenever a job is submitted or finishes)
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+# Finished records kept in memory; older ones are read back from disk when asked for
+JOB_FINISHED_IN_MEMORY = int(os.getenv("JOB_FINISHED_IN_MEMORY", "1000"))
+# Most recent finished jobs handed to admission control (it estimates job durations from them)
+RECENT_FINISHED_JOBS = 50
+
+JOB_STATUSES = ("queued", "running", "succeeded", "failed")
+FINISHED_STATUSES = ("succeeded", "failed")
+
+
+def dedup_key(kind, payload, files=()):
+    """Identity of a request: the job kind, its JSON payload and the bytes of any uploaded files."""
+    digest = hashlib.sha256(json.dumps([kind, payload], sort_keys=True).encode())
+    for name, data in files:
+        digest.update(name.encode())
+        digest.update(hashlib.sha256(data).digest())
+    return digest.hexdigest()
+
+
+def _is_job_id(job_id):
+    """Whether job_id looks like an id submit hands out (so it is safe to build a path from)."""
+    try:
+        return uuid.UUID(hex=job_id).hex == job_id
+    except ValueError:
+        return False
+
+
+class JobQueue:
+    """
+    Runs registered handlers on a bounded worker pool, lowest priority value first (then oldest
+    first) whenever jobs are waiting for a worker. Every job is a JSON record under
+    jobs_dir/<id>.json (status, timestamps, result or error), rewritten on each transition, and
+    uploaded inputs sit in jobs_dir/<id>/ until the job finishes. Queued and running jobs found at
+    startup are re-queued once their kind's handler is registered. Submitting a request identical
+    to one still queued or running returns that job instead of doing the work twice.
+    Finished jobs are deleted after JOB_RETENTION_SECONDS; only the newest JOB_FINISHED_IN_MEMORY
+    of them stay in memory, so the bookkeeping doesn't grow with the server's uptime.
+    """
+
+    def __init__(self, jobs_dir=JOBS_DIR, workers=JOB_WORKERS):
+        self.jobs_dir = jobs_dir
+        self._pool = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="job-worker")
+        self._changed = threading.Condition()
+        self._jobs = {}  # every unfinished job and the newest finished ones
+        self._unfinished = {}
+        self._finished = deque()  # (finished_at, job id, status) of every retained finished job, oldest first
+        self._finished_in_memory = deque()  # ids of the finished jobs still in self._jobs, oldest first
+        self._finished_counts = {status: 0 for status in FINISHED_STATUSES}
+        self._handlers = {}
+        self._ready = []  # heap of (priority, created_at, job id) waiting for a worker
+
+        os.makedirs(jobs_dir, exist_ok=True)
+        finished = []
+        for entry in os.scandir(jobs_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                with open(entry.path, "r") as f:
+                    job = json.load(f)
+            except (OSError, ValueError):
+                logger.warning("Skipping unreadable job record %s", entry.path)
+                continue
+            if job["status"] in FINISHED_STATUSES:
+                finished.append(job)
+            else:
+                self._jobs[job["id"]] = self._unfinished[job["id"]] = job
+        for job in sorted(finished, key=lambda job: job["finished_at"]):
+            self._add_finished(job)
+        self._prune()
+
+    def _record_path(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def inputs_dir(self, job_id):
+        return os.path.join(self.jobs_dir, job_id)
+
+    def _persist(self, job):
+        path = self._record_path(job["id"])
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(job, f)
+        os.replace(tmp_path, path)
+
+    def _delete(self, job_id):
+        shutil.rmtree(self.inputs_dir(job_id), ignore_errors=True)
+        try:
+            os.remove(self._record_path(job_id))
+        except OSError:
+            pass
+
+    def _load_record(self, job_id):
+        try:
+            with open(self._record_path(job_id), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _add_finished(self, job):
+        self._jobs[job["id"]] = job
+        self._finished_in_memory.append(job["id"])
+        self._finished.append((job["finished_at"], job["id"], job["status"]))
+        self._finished_counts[job["status"]] += 1
+
+    def _prune(self):
+        """Deletes finished jobs past the retention and drops all but the newest finished records from memory."""
+        expired = []
+        with self._changed:
+            now = time.time()
+            while self._finished and now - self._finished[0][0] > JOB_RETENTION_SECONDS:
+                _, job_id, status = self._finished.popleft()
+                if self._finished_in_memory and self._finished_in_memory[0] == job_id:
+                    self._finished_in_memory.popleft()
+                    del self._jobs[job_id]
+                self._finished_counts[status] -= 1
+                expired.append(job_id)
+            while len(self._finished_in_memory) > JOB_FINISHED_IN_MEMORY:
+                del self._jobs[self._finished_in_memory.popleft()]
+        for job_id in expired:
+            self._delete(job_id)
+
+    def _update(self, job_id, **fields):
+        with self._changed:
+            job = self._jobs[job_id]
+            job.update(fields, version=job["version"] + 1)
+            self._persist(job)
+            self._changed.notify_all()
+            return dict(job)
+
+    def register(self, kind, handler):
+        """
+        handler(payload, input_paths) runs in a worker and returns a JSON-serializable result;
+        an exception fails the job. Re-queues this kind's jobs left over from a previous run.
+        """
+        self._handlers[kind] = handler
+        with self._changed:
+            leftover = [job for job in self._unfinished.values() if job["kind"] == kind]
+        for job in sorted(leftover, key=lambda job: job["created_at"]):
+            logger.info("Re-queueing %s job %s interrupted by a restart", kind, job["id"])
+            self._update(job["id"], status="queued")
+            self._enqueue(job)
+
+    def _enqueue(self, job):
+        with self._changed:
+            heapq.heappush(self._ready, (job.get("priority", 0), job["created_at"], job["id"]))
+        # Each submitted call runs whichever job is first in line when a worker frees up
+        self._pool.submit(self._run_next)
+
+    def _run_next(self):
+        with self._changed:
+            _, _, job_id = heapq.heappop(self._ready)
+        self._run(job_id)
+
+    def submit(self, kind, payload, files=(), priority=0, cost_bytes=0, admission=None):
+        """
+        Queues handler(payload, input_paths) for kind, where files are (name, bytes) pairs stored
+        with the job. Returns (job, created); created is False when an identical job is in flight.
+        cost_bytes is the job's estimated memory; admission (see scripts.admission) may refuse a
+        new job by raising, checked atomically with every other submission.
+        """
+        if kind not in self._handlers:
+            raise KeyError(f"No handler registered for job kind '{kind}'")
+        key = dedup_key(kind, payload, files)
+        self._prune()
+        with self._changed:
+            duplicate = self._find_unfinished(key)
+        if duplicate is not None:
+            return duplicate, False
+
+        # The uploads are written before taking the lock, so workers and pollers never wait on the disk
+        job_id = uuid.uuid4().hex
+        input_names = []
+        if files:
+            os.makedirs(self.inputs_dir(job_id), exist_ok=True)
+            for i, (name, data) in enumerate(files):
+                # Index prefix keeps two uploads with the same name apart
+                stored_name = f"{i}_{os.path.basename(name) or 'upload'}"
+                with open(os.path.join(self.inputs_dir(job_id), stored_name), "wb") as f:
+                    f.write(data)
+                input_names.append(stored_name)
+
+        try:
+            with self._changed:
+                # An identical request may have got in while the files were written
+                duplicate = self._find_unfinished(key)
+                if duplicate is None:
+                    if admission is not None:
+                        admission.check(kind, cost_bytes, self.records())
+                    job = self._jobs[job_id] = self._unfinished[job_id] = {
+                        "id": job_id,
+                        "kind": kind,
+                        "status": "queued",
+                        "priority": priority,
+                        "cost_bytes": cost_bytes,
+                        "version": 0,
+                        "payload": payload,
+                        "inputs": input_names,
+                        "dedup_key": key,
+                        "attempts": 0,
+                        "created_at": time.time(),
+                        "started_at": None,
+                        "finished_at": None,
+                        "result": None,
+                        "error": None,
+                    }
+        except BaseException:
+            shutil.rmtree(self.inputs_dir(job_id), ignore_errors=True)
+            raise
+        if duplicate is not None:
+            shutil.rmtree(self.inputs_dir(job_id), ignore_errors=True)
+            return duplicate, False
+        # No worker can see the job before _enqueue, so nothing else writes its record yet
+        self._persist(job)
+        self._enqueue(job)
+        return dict(job), True
+
+    def _find_unfinished(self, key):
+        """Copy of the unfinished job with this dedup key, or None; call with the lock held."""
+        for job in self._unfinished.values():
+            if job["dedup_key"] == key:
+                return dict(job)
+        return None
+
+    def _run(self, job_id):
+        job = self.get(job_id)
+        if job["attempts"] >= JOB_MAX_ATTEMPTS:
+            self._finish(job_id, status="failed", error=f"Gave up after {job['attempts']} interrupted attempts")
+            return
+
+        self._update(job_id, status="running", started_at=time.time(), attempts=job["attempts"] + 1)
+        input_paths = [os.path.join(self.inputs_dir(job_id), name) for name in job["inputs"]]
+        try:
+            result = self._handlers[job["kind"]](job["payload"], input_paths)
+        except Exception as e:
+            logger.exception("%s job %s failed", job["kind"], job_id)
+            self._finish(job_id, status="failed", error=str(e))
+        else:
+            self._finish(job_id, status="succeeded", result=result)
+
+    def _finish(self, job_id, **fields):
+        with self._changed:
+            self._update(job_id, finished_at=time.time(), **fields)
+            self._add_finished(self._unfinished.pop(job_id))
+        shutil.rmtree(self.inputs_dir(job_id), ignore_errors=True)
+        self._prune()
+
+    def get(self, job_id):
+        """A copy of the job record, or None for an unknown (or deleted) id."""
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job:
+                return dict(job)
+        # Finished and no longer held in memory
+        return self._load_record(job_id) if _is_job_id(job_id) else None
+
+    def wait(self, job_id, timeout=None):
+        """Blocks until the job has finished (or timeout seconds passed) and returns its record."""
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return self.get(job_id)
+            # The record itself is held, so it can be read even once it is dropped from memory
+            self._changed.wait_for(lambda: job["status"] in FINISHED_STATUSES, timeout)
+            return dict(job)
+
+    def watch(self, job_id, heartbeat=15.0):
+        """
+        Yields the job record once now and again after every change until it has finished;
+        yields None whenever heartbeat seconds pass without a change.
+        """
+        with self._changed:
+            record = self._jobs.get(job_id)
+        if record is None:
+            job = self.get(job_id)
+            if job is not None:
+                yield job
+            return
+        seen = -1
+        while True:
+            with self._changed:
+                changed = self._changed.wait_for(lambda: record["version"] != seen, heartbeat)
+                job = dict(record)
+            if not changed:
+                yield None
+                continue
+            seen = job["version"]
+            yield job
+            if job["status"] in FINISHED_STATUSES:
+                return
+
+    def records(self):
+        """
+        The unfinished jobs plus the RECENT_FINISHED_JOBS most recently finished ones (not
+        copied; read only), which is what admission control looks at.
+        """
+        with self._changed:
+            recent = [self._jobs[job_id] for job_id in islice(reversed(self._finished_in_memory), RECENT_FINISHED_JOBS)]
+            return list(self._unfinished.values()) + recent[::-1]
+
+    def stats(self):
+        with self._changed:
+            counts = {status: 0 for status in JOB_STATUSES}
+            for job in self._unfinished.values():
+                counts[job["status"]] += 1
+            counts.update(self._finished_counts)
+            return counts
+
+
+job_queue = JobQueue()
@@ -0,0 +1,174 @@
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets, from cheap CPU steps to remote API calls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def current_rss_bytes():
+    """Resident set size of this process in bytes (0 if it can't be read)."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    return peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    """High-water mark of this process's resident set size in bytes (0 if it can't be read)."""
+    try:
+        import resource
+        # ru_maxrss is in KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+    except (ImportError, OSError):
+        return 0
+
+
+def physical_memory_bytes():
+    """Total RAM of the host in bytes (0 if it can't be read)."""
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError):
+        return 0
+
+
+def available_memory_bytes():
+    """Memory the host can hand out without swapping (MemAvailable), or None where /proc/meminfo is missing."""
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class StageMetrics:
+    """Per-stage latency histogram plus resident-memory figures, aggregated over every span."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def record(self, stage, seconds, peak_rss, rss_delta):
+        with self._lock:
+            entry = self._stages.get(stage)
+            if entry is None:
+                entry = self._stages[stage] = {
+                    "bucket_counts": [0] * len(self.buckets),
+                    "count": 0,
+                    "sum_seconds": 0.0,
+                    "max_seconds": 0.0,
+                    "peak_rss_bytes": 0,
+                    "max_rss_delta_bytes": 0,
+                }
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    entry["bucket_counts"][i] += 1
+                    break
+            entry["count"] += 1
+            entry["sum_seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+            entry["peak_rss_bytes"] = max(entry["peak_rss_bytes"], peak_rss)
+            entry["max_rss_delta_bytes"] = max(entry["max_rss_delta_bytes"], rss_delta)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                stage: dict(entry, bucket_counts=list(entry["bucket_counts"]))
+                for stage, entry in self._stages.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+    def take(self):
+        """snapshot() and reset() in one step, so no span recorded in between is lost."""
+        with self._lock:
+            stages, self._stages = self._stages, {}
+            return stages
+
+    def merge(self, snapshot):
+        """Adds another StageMetrics' snapshot (with the same buckets), e.g. a worker process's, to this one."""
+        with self._lock:
+            for stage, other in snapshot.items():
+                entry = self._stages.get(stage)
+                if entry is None:
+                    self._stages[stage] = dict(other, bucket_counts=list(other["bucket_counts"]))
+                    continue
+                entry["bucket_counts"] = [a + b for a, b in zip(entry["bucket_counts"], other["bucket_counts"])]
+                entry["count"] += other["count"]
+                entry["sum_seconds"] += other["sum_seconds"]
+                for key in ("max_seconds", "peak_rss_bytes", "max_rss_delta_bytes"):
+                    entry[key] = max(entry[key], other[key])
+
+    def prometheus_text(self):
+        """Renders the histograms in the Prometheus text exposition format."""
+        lines = [
+            "# HELP stage_duration_seconds Wall time of each pipeline stage.",
+            "# TYPE stage_duration_seconds histogram",
+        ]
+        snapshot = self.snapshot()
+        for stage, entry in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry["bucket_counts"]):
+                cumulative += count
+                lines.append(f'stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {entry["count"]}')
+            lines.append(f'stage_duration_seconds_sum{{stage="{stage}"}} {entry["sum_seconds"]:.6f}')
+            lines.append(f'stage_duration_seconds_count{{stage="{stage}"}} {entry["count"]}')
+
+        lines += [
+            "# HELP stage_peak_rss_bytes Highest resident set size observed during a stage.",
+            "# TYPE stage_peak_rss_bytes gauge",
+        ]
+        lines += [f'stage_peak_rss_bytes{{stage="{stage}"}} {entry["peak_rss_bytes"]}'
+                  for stage, entry in sorted(snapshot.items())]
+        lines += [
+            "# HELP stage_max_rss_delta_bytes Largest resident set growth across a single span of a stage.",
+            "# TYPE stage_max_rss_delta_bytes gauge",
+        ]
+        lines += [f'stage_max_rss_delta_bytes{{stage="{stage}"}} {entry["max_rss_delta_bytes"]}'
+                  for stage, entry in sorted(snapshot.items())]
+        lines += [
+            "# HELP process_resident_memory_bytes Current resident set size.",
+            "# TYPE process_resident_memory_bytes gauge",
+            f"process_resident_memory_bytes {current_rss_bytes()}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+stage_metrics = StageMetrics()
+
+
+@contextmanager
+def span(stage, **fields):
+    """
+    Times the enclosed block as one span of `stage` and records it in stage_metrics.
+    Peak RSS is exact when the process reached a new high-water mark inside the span and
+    otherwise the larger of the RSS at entry and exit. Extra fields only go to the debug log.
+    """
+    rss_before = current_rss_bytes()
+    high_water_before = peak_rss_bytes()
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        seconds = perf_counter() - start
+        rss_after = current_rss_bytes()
+        high_water_after = peak_rss_bytes()
+        peak = high_water_after if high_water_after > high_water_before else max(rss_before, rss_after)
+        stage_metrics.record(stage, seconds, peak, max(rss_after - rss_before, 0))
+        logger.debug("span %s %.1f ms rss %+.1f MiB %s", stage, 1000 * seconds,
+                     (rss_after - rss_before) / 2**20, fields or "")
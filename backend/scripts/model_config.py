@@ -0,0 +1,46 @@
+import os
+
+# Model choices only, importable without torch; scripts.model_registry loads what they name
+
+SEGFORMER_CHECKPOINT = "nvidia/segformer-b5-finetuned-ade-640-640"
+# MiDaS is pinned to its v3.1 release tag, for downloads and for the model store
+MIDAS_HUB_REPO = "intel-isl/MiDaS:v3_1"
+MIDAS_MODEL_TYPE = "DPT_Large"
+# Hub commit to stage per Segformer checkpoint (scripts/model_store.py). The Segformer repos have
+# no release tags; a checkpoint missing here is staged at the commit the store's manifest already
+# records, and the first staging needs an explicit --segformer-revision, whose commit is recorded
+SEGFORMER_REVISIONS = {}
+
+# Speed/quality trade-off: each tier pairs a Segformer checkpoint (which brings its own
+# input resolution via its feature extractor) with a MiDaS model and its matching transform.
+MODEL_TIERS = {
+    "fast": {
+        "segformer": "nvidia/segformer-b0-finetuned-ade-512-512",
+        "midas": "MiDaS_small",
+        "midas_transform": "small_transform",
+    },
+    "balanced": {
+        "segformer": "nvidia/segformer-b2-finetuned-ade-512-512",
+        "midas": "DPT_Hybrid",
+        "midas_transform": "dpt_transform",
+    },
+    "accurate": {
+        "segformer": SEGFORMER_CHECKPOINT,
+        "midas": MIDAS_MODEL_TYPE,
+        "midas_transform": "dpt_transform",
+    },
+}
+DEFAULT_TIER = os.getenv("MODEL_TIER", "accurate")
+
+# fp32: plain eager inference. bf16: same weights, forward passes under bfloat16 autocast.
+# int8: nn.Linear layers dynamically quantized (CPU only), cached on disk after the first build.
+# compiled: the TorchScript artifacts built by scripts/compile_models.py. MiDaS was traced at one
+# square size, so images are squashed to it; opt-in only, like int8, since depth changes.
+PRECISIONS = ("fp32", "bf16", "int8", "compiled")
+DEFAULT_PRECISION = os.getenv("MODEL_PRECISION", "fp32")
+
+
+def resolve_tier(tier):
+    if tier not in MODEL_TIERS:
+        raise ValueError(f"Unknown model tier '{tier}', expected one of {sorted(MODEL_TIERS)}")
+    return MODEL_TIERS[tier]
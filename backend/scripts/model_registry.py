@@ -0,0 +1,245 @@
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+from types import SimpleNamespace
+
+import cv2
+import torch
+from transformers import SegformerFeatureExtractor, SegformerForSemanticSegmentation
+
+from scripts import model_store
+from scripts.metrics import current_rss_bytes
+# The model choices live in model_config (no torch needed) and are re-exported from here
+from scripts.model_config import (
+    DEFAULT_PRECISION, DEFAULT_TIER, MIDAS_HUB_REPO, MIDAS_MODEL_TYPE, MODEL_TIERS, PRECISIONS,
+    SEGFORMER_CHECKPOINT, resolve_tier
+)
+
+logger = logging.getLogger(__name__)
+
+DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded models.
+    Each entry is loaded once (under its own lock, so two different models can load
+    in parallel) and then handed out to every caller. Load time and the resident
+    memory the load added are recorded per entry.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entry_locks = {}
+        self._models = {}
+        self._stats = {}
+
+    def get(self, key, loader):
+        model = self._models.get(key)
+        if model is not None:
+            return model
+
+        with self._lock:
+            entry_lock = self._entry_locks.setdefault(key, threading.Lock())
+
+        with entry_lock:
+            model = self._models.get(key)
+            if model is not None:
+                return model
+
+            rss_before = current_rss_bytes()
+            start = perf_counter()
+            model = loader()
+            load_seconds = perf_counter() - start
+            rss_delta = max(current_rss_bytes() - rss_before, 0)
+
+            self._models[key] = model
+            self._stats[key] = {
+                "load_seconds": round(load_seconds, 3),
+                "rss_bytes": rss_delta,
+            }
+            logger.info("Loaded %s in %.2fs (+%.0f MiB RSS)", key, load_seconds, rss_delta / 2**20)
+            return model
+
+    def is_loaded(self, key):
+        return key in self._models
+
+    def stats(self):
+        """Load time and resident memory per loaded model, keyed by str(key)."""
+        return {str(key): dict(value) for key, value in self._stats.items()}
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._stats.clear()
+
+
+registry = ModelRegistry()
+
+
+def load_segformer(checkpoint=SEGFORMER_CHECKPOINT):
+    # Prefer the pre-staged local copy (memory-mapped, no network); fall back to the hub
+    if model_store.has_segformer(checkpoint):
+        feature_extractor, model = model_store.load_segformer_local(checkpoint)
+    else:
+        logger.warning("%s not staged in %s, downloading", checkpoint, model_store.MODEL_STORE_DIR)
+        feature_extractor = SegformerFeatureExtractor.from_pretrained(checkpoint)
+        model = SegformerForSemanticSegmentation.from_pretrained(checkpoint)
+    model.to(DEVICE)
+    model.eval()
+    return feature_extractor, model
+
+
+def load_midas(model_type=MIDAS_MODEL_TYPE, transform_name="dpt_transform"):
+    if model_store.has_midas(model_type):
+        model, transform = model_store.load_midas_local(model_type, transform_name)
+    else:
+        logger.warning("MiDaS %s not staged in %s, downloading", model_type, model_store.MODEL_STORE_DIR)
+        model = torch.hub.load(MIDAS_HUB_REPO, model_type, trust_repo=True)
+        midas_transforms = torch.hub.load(MIDAS_HUB_REPO, "transforms", trust_repo=True)
+        transform = getattr(midas_transforms, transform_name)
+    model.to(DEVICE)
+    model.eval()
+    return model, transform
+
+
+def load_segformer_feature_extractor(checkpoint):
+    if model_store.has_segformer(checkpoint):
+        return SegformerFeatureExtractor.from_pretrained(model_store.segformer_dir(checkpoint), local_files_only=True)
+    return SegformerFeatureExtractor.from_pretrained(checkpoint)
+
+
+def load_midas_transform(transform_name):
+    if os.path.exists(os.path.join(model_store.midas_hub_dir(), "hubconf.py")):
+        midas_transforms = torch.hub.load(model_store.midas_hub_dir(), "transforms", source="local")
+    else:
+        midas_transforms = torch.hub.load(MIDAS_HUB_REPO, "transforms", trust_repo=True)
+    return getattr(midas_transforms, transform_name)
+
+
+def midas_source_dir():
+    """Directory holding the MiDaS python sources (needed to unpickle cached MiDaS modules)."""
+    if os.path.exists(model_store.midas_hub_dir()):
+        return model_store.midas_hub_dir()
+    return model_store.hub_cache_dir(MIDAS_HUB_REPO)
+
+
+def quantize_int8(name, load_fp32, source_dir=None):
+    """Returns an int8 dynamically quantized copy of a model, from the on-disk cache when possible."""
+    if DEVICE.type != "cpu":
+        raise ValueError("int8 dynamic quantization is only supported for CPU inference")
+
+    model = model_store.load_quantized(name, source_dir)
+    if model is None:
+        model = torch.ao.quantization.quantize_dynamic(load_fp32(), {torch.nn.Linear}, dtype=torch.qint8)
+        path = model_store.save_quantized(model, name)
+        logger.info("Cached int8 %s at %s", name, path)
+    model.eval()
+    return model
+
+
+@contextmanager
+def precision_context(precision=DEFAULT_PRECISION):
+    """Context for a forward pass at the given precision (always without autograd)."""
+    with torch.no_grad():
+        if precision == "bf16":
+            with torch.autocast(device_type=DEVICE.type, dtype=torch.bfloat16):
+                yield
+        else:
+            yield
+
+
+def resolve_precision(precision, name=None):
+    """Maps a precision to the weights variant that serves it: "int8", "compiled" or eager "fp32"."""
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}', expected one of {list(PRECISIONS)}")
+    if precision == "int8":
+        return "int8"
+    if precision == "compiled":
+        # Only when asked for: running eager instead would cache eager results under "compiled"
+        if name and not model_store.has_compiled(name):
+            raise ValueError(f"No compiled artifact for {name}; build it with python -m scripts.compile_models")
+        return "compiled"
+    # Traced graphs don't follow autocast, so bf16 runs the eager fp32 weights
+    return "fp32"
+
+
+class CompiledSegformer:
+    """Calls a TorchScript Segformer artifact with the eager model's interface (outputs.logits)."""
+
+    def __init__(self, module, meta):
+        self.module = module
+        self.dynamic_batch = meta.get("dynamic_batch", False)
+
+    def __call__(self, pixel_values):
+        if self.dynamic_batch or pixel_values.shape[0] == 1:
+            logits = self.module(pixel_values)
+        else:
+            logits = torch.cat([self.module(pixel_values[i:i + 1]) for i in range(pixel_values.shape[0])])
+        return SimpleNamespace(logits=logits)
+
+
+class CompiledMidas:
+    """Calls a TorchScript MiDaS artifact; inputs must be input_size x input_size (see fixed_size_transform)."""
+
+    def __init__(self, module, meta):
+        self.module = module
+        self.dynamic_batch = meta.get("dynamic_batch", False)
+        self.input_size = meta["input_size"]
+
+    def __call__(self, input_batch):
+        if self.dynamic_batch or input_batch.shape[0] == 1:
+            return self.module(input_batch)
+        return torch.cat([self.module(input_batch[i:i + 1]) for i in range(input_batch.shape[0])])
+
+
+def fixed_size_transform(transform, size):
+    """MiDaS transform for a traced graph: squares the image first, so every input has the traced shape."""
+    def apply(img):
+        return transform(cv2.resize(img, (size, size), interpolation=cv2.INTER_CUBIC))
+    return apply
+
+
+def get_segformer(tier=DEFAULT_TIER, precision=DEFAULT_PRECISION):
+    """Returns the shared (feature_extractor, model) pair for the tier and precision, loading it on first use."""
+    checkpoint = resolve_tier(tier)["segformer"]
+    weights = resolve_precision(precision, checkpoint)
+    if weights == "int8":
+        def loader():
+            model = quantize_int8(checkpoint, lambda: load_segformer(checkpoint)[1])
+            return load_segformer_feature_extractor(checkpoint), model
+    elif weights == "compiled":
+        def loader():
+            return load_segformer_feature_extractor(checkpoint), CompiledSegformer(*model_store.load_compiled(checkpoint))
+    else:
+        def loader():
+            return load_segformer(checkpoint)
+    return registry.get(("segformer", checkpoint, weights), loader)
+
+
+def get_midas(tier=DEFAULT_TIER, precision=DEFAULT_PRECISION):
+    """Returns the shared (model, transform) pair for the tier and precision, loading it on first use."""
+    config = resolve_tier(tier)
+    weights = resolve_precision(precision, config["midas"])
+    if weights == "int8":
+        def loader():
+            model = quantize_int8(
+                config["midas"],
+                lambda: load_midas(config["midas"], config["midas_transform"])[0],
+                midas_source_dir()
+            )
+            return model, load_midas_transform(config["midas_transform"])
+    elif weights == "compiled":
+        def loader():
+            model = CompiledMidas(*model_store.load_compiled(config["midas"]))
+            return model, fixed_size_transform(load_midas_transform(config["midas_transform"]), model.input_size)
+    else:
+        def loader():
+            return load_midas(config["midas"], config["midas_transform"])
+    return registry.get(("midas", config["midas"], weights), loader)
+
+
+def model_stats():
+    return registry.stats()
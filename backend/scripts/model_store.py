@@ -0,0 +1,420 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import struct
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import torch
+
+from scripts.model_config import MIDAS_HUB_REPO, SEGFORMER_REVISIONS
+
+MODEL_STORE_DIR = os.getenv(
+    "MODEL_STORE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models")
+)
+MANIFEST_NAME = "manifest.json"
+MIDAS_HUB_DIR = "midas_hub"
+HUB_DEPENDENCIES_DIR = "hub_dependencies"
+# Hub repos a MiDaS model itself loads with torch.hub.load while it is built: MiDaS_small's
+# EfficientNet-Lite3 encoder. They are staged too, so every tier builds without the network
+MIDAS_HUB_DEPENDENCIES = {
+    "MiDaS_small": ("rwightman/gen-efficientnet-pytorch",),
+}
+_hub_load_lock = threading.Lock()
+# Left out of staging and of the hashes: Python writes bytecode next to the staged sources when
+# they are first imported (one file per interpreter version), which doesn't change what they build
+SOURCE_IGNORE_PATTERNS = (".git", "*.pt", "*.pth", "__pycache__", "*.pyc")
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def _safe_name(name):
+    return name.replace("/", "__")
+
+
+def segformer_dir(checkpoint, store_dir=MODEL_STORE_DIR):
+    return os.path.join(store_dir, "segformer", _safe_name(checkpoint))
+
+
+def midas_weights_path(model_type, store_dir=MODEL_STORE_DIR):
+    return os.path.join(store_dir, "midas", f"{model_type}.safetensors")
+
+
+def midas_hub_dir(store_dir=MODEL_STORE_DIR):
+    return os.path.join(store_dir, "midas", MIDAS_HUB_DIR)
+
+
+def has_segformer(checkpoint, store_dir=MODEL_STORE_DIR):
+    return os.path.exists(os.path.join(segformer_dir(checkpoint, store_dir), "model.safetensors"))
+
+
+def hub_dependency_dir(hub_repo, store_dir=MODEL_STORE_DIR):
+    return os.path.join(store_dir, "midas", HUB_DEPENDENCIES_DIR, _safe_name(hub_repo))
+
+
+def has_midas(model_type, store_dir=MODEL_STORE_DIR):
+    return (
+        os.path.exists(midas_weights_path(model_type, store_dir))
+        and os.path.exists(os.path.join(midas_hub_dir(store_dir), "hubconf.py"))
+        and all(os.path.exists(os.path.join(hub_dependency_dir(repo, store_dir), "hubconf.py"))
+                for repo in MIDAS_HUB_DEPENDENCIES.get(model_type, ()))
+    )
+
+
+# --------------------------
+# Memory-mapped loading
+# --------------------------
+
+def load_safetensors_mmap(path):
+    """
+    Reads a .safetensors file into a state dict whose tensors are views of one private
+    (copy-on-write) memory map of the file. Nothing is copied at load time and every
+    process mapping the same file shares the page cache, so N workers cost one copy of the
+    weights as long as nobody writes to them.
+    """
+    with open(path, "rb") as f:
+        header_len = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_len))
+    data_start = 8 + header_len
+    storage = torch.UntypedStorage.from_file(path, shared=False, nbytes=os.path.getsize(path))
+
+    state_dict = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        raw = torch.empty(0, dtype=torch.uint8).set_(storage, data_start + begin, (end - begin,))
+        if (data_start + begin) % torch.empty((), dtype=dtype).element_size():
+            raw = raw.clone()  # misaligned for this dtype; a copy is the only option
+        state_dict[name] = raw.view(dtype).view(info["shape"])
+    return state_dict
+
+
+def assign_state_dict(build_module, state_dict):
+    """
+    Builds a module and binds the given tensors as its parameters (load_state_dict with
+    assign=True), so mmap-backed weights are used in place instead of being copied.
+    The module is built on the meta device when its constructor allows it; otherwise it is
+    built normally and its freshly initialized weights are dropped in favour of the mapped ones.
+    """
+    try:
+        with torch.device("meta"):
+            module = build_module()
+        module.load_state_dict(state_dict, assign=True)
+        if not any(t.is_meta for t in list(module.parameters()) + list(module.buffers())):
+            return module
+    except (RuntimeError, TypeError, NotImplementedError):
+        pass
+
+    module = build_module()
+    module.load_state_dict(state_dict, assign=True)
+    return module
+
+
+def load_segformer_local(checkpoint, store_dir=MODEL_STORE_DIR):
+    from transformers import SegformerConfig, SegformerFeatureExtractor, SegformerForSemanticSegmentation
+
+    model_dir = segformer_dir(checkpoint, store_dir)
+    config = SegformerConfig.from_pretrained(model_dir, local_files_only=True)
+    feature_extractor = SegformerFeatureExtractor.from_pretrained(model_dir, local_files_only=True)
+    state_dict = load_safetensors_mmap(os.path.join(model_dir, "model.safetensors"))
+    model = assign_state_dict(lambda: SegformerForSemanticSegmentation(config), state_dict)
+    return feature_extractor, model
+
+
+@contextmanager
+def _staged_hub_dependencies(store_dir):
+    """
+    While a MiDaS model is built, serves its own torch.hub.load calls for MIDAS_HUB_DEPENDENCIES
+    from the staged copies (the MiDaS code calls torch.hub.load directly, so it is swapped for
+    the duration). Their pretrained downloads are skipped: the staged state dict holds every weight.
+    """
+    dependencies = {repo for repos in MIDAS_HUB_DEPENDENCIES.values() for repo in repos}
+    hub_load = torch.hub.load
+
+    def load(repo_or_dir, model, *args, **kwargs):
+        if repo_or_dir not in dependencies:
+            return hub_load(repo_or_dir, model, *args, **kwargs)
+        kwargs.pop("trust_repo", None)
+        kwargs["pretrained"] = False
+        return hub_load(hub_dependency_dir(repo_or_dir, store_dir), model, *args, source="local", **kwargs)
+
+    # The lock keeps concurrent loads from restoring each other's replacement
+    with _hub_load_lock:
+        torch.hub.load = load
+        try:
+            yield
+        finally:
+            torch.hub.load = hub_load
+
+
+def load_midas_local(model_type, transform_name, store_dir=MODEL_STORE_DIR):
+    hub_dir = midas_hub_dir(store_dir)
+    state_dict = load_safetensors_mmap(midas_weights_path(model_type, store_dir))
+    with _staged_hub_dependencies(store_dir):
+        model = assign_state_dict(
+            lambda: torch.hub.load(hub_dir, model_type, source="local", pretrained=False),
+            state_dict
+        )
+    midas_transforms = torch.hub.load(hub_dir, "transforms", source="local")
+    return model, getattr(midas_transforms, transform_name)
+
+
+# --------------------------
+# Quantized artifacts
+# --------------------------
+
+def quantized_path(name, store_dir=MODEL_STORE_DIR):
+    # Pickled quantized modules are tied to the torch version that produced them
+    return os.path.join(store_dir, "quantized", f"{_safe_name(name)}-int8-torch{torch.__version__}.pt")
+
+
+def save_quantized(module, name, store_dir=MODEL_STORE_DIR):
+    path = quantized_path(name, store_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    torch.save(module, tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_quantized(name, source_dir=None, store_dir=MODEL_STORE_DIR):
+    """Loads a cached quantized module, or returns None. source_dir is put on sys.path so the module's classes unpickle."""
+    path = quantized_path(name, store_dir)
+    if not os.path.exists(path):
+        return None
+    if source_dir and source_dir not in sys.path:
+        sys.path.insert(0, source_dir)
+    return torch.load(path, map_location="cpu", weights_only=False)
+
+
+# --------------------------
+# Compiled (TorchScript) artifacts
+# --------------------------
+
+def compiled_path(name, store_dir=MODEL_STORE_DIR):
+    return os.path.join(store_dir, "compiled", f"{_safe_name(name)}-torch{torch.__version__}.pt")
+
+
+def save_compiled(script_module, name, meta, store_dir=MODEL_STORE_DIR):
+    """Saves a TorchScript module plus a JSON sidecar describing how it must be fed (input size, batching)."""
+    path = compiled_path(name, store_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    torch.jit.save(script_module, tmp_path)
+    os.replace(tmp_path, path)
+    with open(f"{path}.json", "w") as f:
+        json.dump(meta, f, indent=2)
+    return path
+
+
+def has_compiled(name, store_dir=MODEL_STORE_DIR):
+    path = compiled_path(name, store_dir)
+    return os.path.exists(path) and os.path.exists(f"{path}.json")
+
+
+def load_compiled(name, store_dir=MODEL_STORE_DIR):
+    """Returns (script_module, meta) for a compiled artifact, or None if it hasn't been built."""
+    if not has_compiled(name, store_dir):
+        return None
+    path = compiled_path(name, store_dir)
+    with open(f"{path}.json", "r") as f:
+        meta = json.load(f)
+    return torch.jit.optimize_for_inference(torch.jit.load(path, map_location="cpu")), meta
+
+
+# --------------------------
+# Staging (needs network; run once per release, then copy MODEL_STORE_DIR to the nodes)
+# --------------------------
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _is_bytecode(path):
+    return path.endswith(".pyc") or "__pycache__" in path.split(os.sep)
+
+
+def _file_hashes(root):
+    """Hashes of the staged weights and configs, plus every file of the copied hub sources (they build the models)."""
+    hashes = {}
+    for subdir in ("segformer", "midas"):
+        for dirpath, _, filenames in os.walk(os.path.join(root, subdir)):
+            is_source = os.path.relpath(dirpath, root).split(os.sep)[1:2] in ([MIDAS_HUB_DIR], [HUB_DEPENDENCIES_DIR])
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                if (is_source and not _is_bytecode(path)) or filename.endswith((".safetensors", ".json")):
+                    hashes[os.path.relpath(path, root)] = _sha256(path)
+    return hashes
+
+
+def hub_cache_dir(hub_repo):
+    """Where torch.hub keeps its checkout of "owner/name[:ref]" (without a ref: main or master, whichever exists)."""
+    repo, _, ref = hub_repo.partition(":")
+    owner, name = repo.split("/")
+    if not ref:
+        ref = next((branch for branch in ("main", "master")
+                    if os.path.exists(os.path.join(torch.hub.get_dir(), f"{owner}_{name}_{branch}"))), "master")
+    return os.path.join(torch.hub.get_dir(), f"{owner}_{name}_{ref.replace('/', '_')}")
+
+
+def read_manifest(store_dir=MODEL_STORE_DIR):
+    path = os.path.join(store_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _write_manifest(manifest, store_dir):
+    path = os.path.join(store_dir, MANIFEST_NAME)
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def stage_segformer(checkpoint, revision, store_dir=MODEL_STORE_DIR):
+    from transformers import SegformerFeatureExtractor, SegformerForSemanticSegmentation
+
+    model_dir = segformer_dir(checkpoint, store_dir)
+    os.makedirs(model_dir, exist_ok=True)
+    feature_extractor = SegformerFeatureExtractor.from_pretrained(checkpoint, revision=revision)
+    model = SegformerForSemanticSegmentation.from_pretrained(checkpoint, revision=revision)
+    feature_extractor.save_pretrained(model_dir)
+    model.save_pretrained(model_dir, safe_serialization=True)
+
+    return {
+        "checkpoint": checkpoint,
+        "revision": revision,
+        "commit": getattr(model.config, "_commit_hash", None),
+    }
+
+
+def stage_midas(hub_repo, model_type, store_dir=MODEL_STORE_DIR):
+    from safetensors.torch import save_file
+
+    model = torch.hub.load(hub_repo, model_type, trust_repo=True)
+
+    # Keep a copy of the hub source so the architecture and transforms build offline
+    hub_dir = midas_hub_dir(store_dir)
+    if os.path.exists(hub_dir):
+        shutil.rmtree(hub_dir)
+    shutil.copytree(hub_cache_dir(hub_repo), hub_dir, ignore=shutil.ignore_patterns(*SOURCE_IGNORE_PATTERNS))
+    # ... and of the repos the model pulled in while it was built (the load above checked them out)
+    dependencies = MIDAS_HUB_DEPENDENCIES.get(model_type, ())
+    for repo in dependencies:
+        dependency_dir = hub_dependency_dir(repo, store_dir)
+        if os.path.exists(dependency_dir):
+            shutil.rmtree(dependency_dir)
+        shutil.copytree(hub_cache_dir(repo), dependency_dir, ignore=shutil.ignore_patterns(*SOURCE_IGNORE_PATTERNS))
+
+    state_dict = {k: v.detach().clone().contiguous() for k, v in model.state_dict().items()}
+    save_file(state_dict, midas_weights_path(model_type, store_dir))
+
+    return {"hub_repo": hub_repo, "model_type": model_type, "hub_dependencies": list(dependencies)}
+
+
+def pinned_segformer_revision(checkpoint, manifest):
+    """The commit to stage for checkpoint: SEGFORMER_REVISIONS, else the one the manifest recorded, else None."""
+    return SEGFORMER_REVISIONS.get(checkpoint) or manifest.get("segformer", {}).get(checkpoint, {}).get("commit")
+
+
+def stage_models(segformer_checkpoints, midas_model_types, store_dir=MODEL_STORE_DIR,
+                 segformer_revision=None, midas_hub_repo=MIDAS_HUB_REPO):
+    """
+    Downloads every requested model into store_dir and records versions and file hashes in the
+    manifest. Segformer is staged at segformer_revision when given, otherwise at its pinned
+    commit (pinned_segformer_revision); MiDaS at the ref in midas_hub_repo.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    manifest = read_manifest(store_dir)
+    manifest.setdefault("segformer", {})
+    manifest.setdefault("midas", {})
+
+    revisions = {checkpoint: segformer_revision or pinned_segformer_revision(checkpoint, manifest)
+                 for checkpoint in segformer_checkpoints}
+    unpinned = [checkpoint for checkpoint, revision in revisions.items() if not revision]
+    if unpinned:
+        raise ValueError(f"No pinned revision for {unpinned}: add the commits to SEGFORMER_REVISIONS in "
+                         f"scripts/model_config.py or pass --segformer-revision (its commit is then recorded)")
+
+    for checkpoint in segformer_checkpoints:
+        print(f"[stage] Segformer {checkpoint}@{revisions[checkpoint]}")
+        manifest["segformer"][checkpoint] = stage_segformer(checkpoint, revisions[checkpoint], store_dir)
+    for model_type in midas_model_types:
+        print(f"[stage] MiDaS {model_type} from {midas_hub_repo}")
+        manifest["midas"][model_type] = stage_midas(midas_hub_repo, model_type, store_dir)
+
+    import transformers
+    manifest["torch_version"] = torch.__version__
+    manifest["transformers_version"] = transformers.__version__
+    manifest["staged_at"] = datetime.now(timezone.utc).isoformat()
+    manifest["files"] = _file_hashes(store_dir)
+    _write_manifest(manifest, store_dir)
+    print(f"[stage] Model store ready at {store_dir}")
+    return manifest
+
+
+def verify_store(store_dir=MODEL_STORE_DIR):
+    """
+    Re-hashes the staged files; returns the list of files that are missing or changed, plus any
+    file in the copied hub sources that wasn't staged (it would be imported when the models build).
+    Bytecode caches are not reported, see SOURCE_IGNORE_PATTERNS.
+    """
+    expected = read_manifest(store_dir).get("files", {})
+    bad = []
+    for rel_path, digest in expected.items():
+        path = os.path.join(store_dir, rel_path)
+        if not os.path.exists(path) or _sha256(path) != digest:
+            bad.append(rel_path)
+    for source_dir in (midas_hub_dir(store_dir), os.path.join(store_dir, "midas", HUB_DEPENDENCIES_DIR)):
+        for dirpath, _, filenames in os.walk(source_dir):
+            for filename in filenames:
+                rel_path = os.path.relpath(os.path.join(dirpath, filename), store_dir)
+                if rel_path not in expected and not _is_bytecode(rel_path):
+                    bad.append(rel_path)
+    return bad
+
+
+if __name__ == "__main__":
+    from scripts.model_config import MODEL_TIERS
+
+    parser = argparse.ArgumentParser(description="Stage model weights for offline serving.")
+    parser.add_argument("command", choices=["stage", "verify"])
+    parser.add_argument("--store-dir", default=MODEL_STORE_DIR)
+    parser.add_argument("--tiers", nargs="*", default=["accurate"], choices=sorted(MODEL_TIERS))
+    parser.add_argument("--segformer-revision", default=None,
+                        help="Hub revision for every staged Segformer (default: the pinned commits)")
+    parser.add_argument("--midas-hub-repo", default=MIDAS_HUB_REPO)
+    args = parser.parse_args()
+
+    if args.command == "stage":
+        segformer_checkpoints = sorted({MODEL_TIERS[tier]["segformer"] for tier in args.tiers})
+        midas_model_types = sorted({MODEL_TIERS[tier]["midas"] for tier in args.tiers})
+        stage_models(segformer_checkpoints, midas_model_types, args.store_dir,
+                     args.segformer_revision, args.midas_hub_repo)
+    else:
+        bad_files = verify_store(args.store_dir)
+        if bad_files:
+            raise SystemExit(f"Model store check failed for: {bad_files}")
+        print("Model store OK")
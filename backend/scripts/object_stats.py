@@ -0,0 +1,122 @@
+import numpy as np
+
+DEPTH_HISTOGRAM_BINS = 4096
+
+
+def convert_numpy(obj):
+    """Convert NumPy types to native Python types."""
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return float(obj)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    return obj
+
+
+def compute_label_stats(segmentation_mask, depth_map, labels, depth_bins=DEPTH_HISTOGRAM_BINS):
+    """
+    Computes area, bounding box and median depth for every label in `labels` at once.
+
+    Instead of building a boolean mask per label, each pixel is mapped to a compact label
+    index through a lookup table and per-row / per-column pixel counts are gathered with
+    bincount; area and bbox fall out of those counts. Median depths come from a per-label
+    depth histogram: the bins holding the middle rank(s) are located from the cumulative
+    counts and only the pixels inside those bins are sorted, so the result is the exact
+    median without sorting every pixel of every label.
+
+    Returns {label: {"area", "bbox": [x_min, y_min, x_max, y_max], "median_depth"}} for the
+    labels that are present, in ascending label order.
+    """
+    labels = sorted(int(label) for label in labels)
+    if not labels:
+        return {}
+
+    h, w = segmentation_mask.shape
+    n = len(labels)
+
+    # Lookup table from raw label id to compact index; n means "not a label of interest"
+    lut_size = 256 if segmentation_mask.dtype == np.uint8 else max(int(segmentation_mask.max()), labels[-1]) + 1
+    lut = np.full(lut_size, n, dtype=np.uint8 if n < 255 else np.uint16)
+    for idx, label in enumerate(labels):
+        if label < lut_size:
+            lut[label] = idx
+    compact = lut[segmentation_mask]
+
+    stride = n + 1
+    row_counts = np.bincount(
+        (compact + np.arange(h, dtype=np.int64)[:, None] * stride).ravel(), minlength=h * stride
+    ).reshape(h, stride)[:, :n]
+    col_counts = np.bincount(
+        (compact + np.arange(w, dtype=np.int64)[None, :] * stride).ravel(), minlength=w * stride
+    ).reshape(w, stride)[:, :n]
+
+    areas = row_counts.sum(axis=0)
+    present = np.flatnonzero(areas)
+    if present.size == 0:
+        return {}
+
+    rows_hit = row_counts > 0
+    cols_hit = col_counts > 0
+    y_min = rows_hit.argmax(axis=0)
+    y_max = h - 1 - rows_hit[::-1].argmax(axis=0)
+    x_min = cols_hit.argmax(axis=0)
+    x_max = w - 1 - cols_hit[::-1].argmax(axis=0)
+
+    medians = _median_depths(compact, depth_map, n, areas, depth_bins)
+
+    stats = {}
+    for idx in present:
+        stats[labels[idx]] = {
+            "area": int(areas[idx]),
+            "bbox": [int(x_min[idx]), int(y_min[idx]), int(x_max[idx]), int(y_max[idx])],
+            "median_depth": medians[idx],
+        }
+    return stats
+
+
+def _median_depths(compact, depth_map, n, areas, depth_bins):
+    """Exact per-label median of depth_map via a histogram pass and a small refinement sort."""
+    medians = [float("nan")] * n
+    # float16 depth (as stored by scripts.array_store) is widened first: binning in float16 rounds
+    # the top values up past the last bin; every float16 value is exact in float32
+    values = np.asarray(depth_map, dtype=np.float32 if depth_map.dtype == np.float16 else None).ravel()
+    labels_flat = compact.ravel()
+
+    d_min, d_max = float(values.min()), float(values.max())
+    scale = (depth_bins - 1) / (d_max - d_min) if d_max > d_min else 0.0
+
+    # Every pixel gets a (label, depth bin) key; "other" pixels land in an extra row that is ignored.
+    # Clipped so rounding can never spill a value into the next label's row
+    keys = labels_flat.astype(np.int64) * depth_bins
+    keys += np.minimum(((values - d_min) * scale).astype(np.int64), depth_bins - 1)
+    histogram = np.bincount(keys, minlength=(n + 1) * depth_bins).reshape(n + 1, depth_bins)[:n]
+    cumulative = np.cumsum(histogram, axis=1)
+
+    # Middle ranks (equal for odd areas) and the histogram bins they fall in
+    present = np.flatnonzero(areas)
+    low_rank = (areas - 1) // 2
+    high_rank = areas // 2
+    wanted = np.zeros((n + 1, depth_bins), dtype=bool)
+    low_bin = np.zeros(n, dtype=np.int64)
+    for idx in present:
+        low_bin[idx] = np.searchsorted(cumulative[idx], low_rank[idx], side="right")
+        high_bin = np.searchsorted(cumulative[idx], high_rank[idx], side="right")
+        wanted[idx, low_bin[idx]:high_bin + 1] = True
+
+    # Keep only the pixels inside each label's median bins, then sort that small candidate set
+    candidates = np.flatnonzero(wanted.ravel()[keys])
+    candidate_values = values[candidates].astype(np.float64)
+    candidate_labels = labels_flat[candidates]
+    order = np.lexsort((candidate_values, candidate_labels))
+    candidate_values = candidate_values[order]
+    starts = np.searchsorted(candidate_labels[order], np.arange(n))
+
+    for idx in present:
+        below = cumulative[idx, low_bin[idx] - 1] if low_bin[idx] > 0 else 0
+        start = starts[idx]
+        low = candidate_values[start + low_rank[idx] - below]
+        high = candidate_values[start + high_rank[idx] - below]
+        medians[idx] = float((low + high) / 2)
+
+    return medians
@@ -1,38 +1,147 @@
-import cv2
+import os
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
 import numpy as np
-import matplotlib.pyplot as plt
 
-def preprocess_image(image_path):
+from scripts.metrics import span
+
+
+# OpenCV is imported where it is used, so importing this module (and the routes, at app
+# start) doesn't load it
+
+
+def _bilateral(img):
+    import cv2
+    return cv2.bilateralFilter(img, 9, 75, 75)
+
+
+def _nlmeans_fast(img):
+    import cv2
+    return cv2.fastNlMeansDenoisingColored(img, None, 10, 10, 3, 9)
+
+
+def _nlmeans(img):
+    import cv2
+    return cv2.fastNlMeansDenoisingColored(img, None, 10, 10, 7, 21)
+
+
+# Denoise tiers, cheapest first: (filter, halo rows a band needs from its neighbours)
+DENOISE_MODES = {
+    "none": (None, 0),
+    "bilateral": (_bilateral, 4),
+    "nlmeans_fast": (_nlmeans_fast, 5),
+    "nlmeans": (_nlmeans, 13),
+}
+DEFAULT_DENOISE = os.getenv("PREPROCESS_DENOISE", "bilateral")
+# "off": never, "dark": only images whose mean luma is below DARK_LUMA_THRESHOLD, "all": every image
+PREPROCESS_MODES = ("off", "dark", "all")
+DEFAULT_PREPROCESS = os.getenv("PREPROCESS", "off")
+DARK_LUMA_THRESHOLD = float(os.getenv("PREPROCESS_DARK_LUMA", "90"))
+
+PREPROCESS_BANDS = int(os.getenv("PREPROCESS_BANDS", str(min(os.cpu_count() or 1, 8))))
+_band_pool = ThreadPoolExecutor(max_workers=max(PREPROCESS_BANDS, 1), thread_name_prefix="preprocess-band")
+
+SHARPEN_KERNEL = np.array([[-1, -1, -1],
+                           [-1,  9, -1],
+                           [-1, -1, -1]])
+
+
+def run_in_bands(fn, image, halo, bands=PREPROCESS_BANDS):
+    """
+    Applies a local filter to horizontal bands of the image in parallel (OpenCV releases the GIL).
+    Each band is filtered with `halo` extra rows above and below, which are cropped off again,
+    so the output matches filtering the whole image whenever halo covers the filter radius.
+    """
+    h = image.shape[0]
+    bands = min(bands, h // max(4 * halo, 16))
+    if bands <= 1:
+        return fn(image)
+
+    edges = np.linspace(0, h, bands + 1).astype(int)
+    out = np.empty_like(image)
+
+    def filter_band(i):
+        top, bottom = edges[i], edges[i + 1]
+        start, stop = max(top - halo, 0), min(bottom + halo, h)
+        out[top:bottom] = fn(image[start:stop])[top - start:bottom - start]
+
+    list(_band_pool.map(filter_band, range(bands)))
+    return out
+
+
+def mean_luma(image_rgb):
+    import cv2
+    return float(cv2.cvtColor(image_rgb, cv2.COLOR_RGB2GRAY).mean())
+
+
+def preprocess_rgb(image_rgb, denoise=DEFAULT_DENOISE, mode="all"):
+    """
+    Contrast (Y-channel histogram equalization), denoise and sharpen an RGB array at its own size.
+    mode is one of PREPROCESS_MODES. Returns (image, cost) where cost reports whether the
+    image was processed and the milliseconds each step took.
+    """
+    if denoise not in DENOISE_MODES:
+        raise ValueError(f"Unknown denoise mode '{denoise}', expected one of {list(DENOISE_MODES)}")
+    if mode not in PREPROCESS_MODES:
+        raise ValueError(f"Unknown preprocess mode '{mode}', expected one of {list(PREPROCESS_MODES)}")
+    import cv2
+
+    start = perf_counter()
+    luma = mean_luma(image_rgb) if mode == "dark" else None
+    cost = {"applied": False, "denoise": denoise, "mean_luma": luma}
+    if mode == "off" or (mode == "dark" and luma >= DARK_LUMA_THRESHOLD):
+        cost["total_ms"] = round(1000 * (perf_counter() - start), 2)
+        return image_rgb, cost
+
+    with span("preprocess", denoise=denoise):
+        # Enhance contrast: equalize the Y channel in YUV
+        step = perf_counter()
+        img_yuv = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2YUV)
+        img_yuv[:, :, 0] = cv2.equalizeHist(img_yuv[:, :, 0])
+        image = cv2.cvtColor(img_yuv, cv2.COLOR_YUV2RGB)
+        cost["contrast_ms"] = round(1000 * (perf_counter() - step), 2)
+
+        step = perf_counter()
+        denoise_filter, halo = DENOISE_MODES[denoise]
+        if denoise_filter is not None:
+            image = run_in_bands(denoise_filter, image, halo)
+        cost["denoise_ms"] = round(1000 * (perf_counter() - step), 2)
+
+        step = perf_counter()
+        image = run_in_bands(lambda band: cv2.filter2D(band, -1, SHARPEN_KERNEL), image, 1)
+        cost["sharpen_ms"] = round(1000 * (perf_counter() - step), 2)
+
+    cost["applied"] = True
+    cost["total_ms"] = round(1000 * (perf_counter() - start), 2)
+    return image, cost
+
+
+def preprocess_image(image_path, denoise="nlmeans", max_width=800, max_height=600):
+    import cv2
+
     # Step 1: Read the image
     image = cv2.imread(image_path)
     if image is None:
         raise ValueError("Error: Image not found or could not be loaded.")
-    
+
     # Convert from BGR (OpenCV default) to RGB
     image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    
-    # Step 2: Resize the image to a standard dimension (e.g., 800x600)
-    target_width, target_height = 800, 600
-    image_resized = cv2.resize(image_rgb, (target_width, target_height))
-    
-    # Step 3: Enhance Contrast
-    # Convert to YUV color space and equalize the Y channel
-    img_yuv = cv2.cvtColor(image_resized, cv2.COLOR_RGB2YUV)
-    img_yuv[:, :, 0] = cv2.equalizeHist(img_yuv[:, :, 0])
-    image_contrast = cv2.cvtColor(img_yuv, cv2.COLOR_YUV2RGB)
-    
-    # Step 4: Denoise the image using fastNlMeansDenoisingColored
-    image_denoised = cv2.fastNlMeansDenoisingColored(image_contrast, None, 10, 10, 7, 21)
-    
-    # Step 5: Sharpen the image
-    kernel_sharpening = np.array([[-1, -1, -1],
-                                  [-1,  9, -1],
-                                  [-1, -1, -1]])
-    image_sharpened = cv2.filter2D(image_denoised, -1, kernel_sharpening)
-    
-    return image_sharpened
+
+    # Step 2: Fit the image inside max_width x max_height, keeping its aspect ratio
+    h, w = image_rgb.shape[:2]
+    scale = min(max_width / w, max_height / h, 1.0)
+    if scale < 1.0:
+        image_rgb = cv2.resize(image_rgb, (max(int(w * scale), 1), max(int(h * scale), 1)),
+                               interpolation=cv2.INTER_AREA)
+
+    # Steps 3-5: contrast, denoise, sharpen
+    image_processed, cost = preprocess_rgb(image_rgb, denoise=denoise)
+    print(f"Preprocessed {image_path} in {cost['total_ms']:.0f} ms ({denoise})")
+    return image_processed
 
 def display_image(image, title="Image"):
+    import matplotlib.pyplot as plt  # only needed for local debugging
     plt.figure(figsize=(10, 8))
     plt.imshow(image)
     plt.title(title)
@@ -9,6 +9,8 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 from google import genai
 from google.genai import types
 
+from scripts.metrics import span
+
 
 ##############################################################################
 # 1. Load Gemini Client from .env
@@ -57,11 +59,12 @@ def evaluate_image(client, image_path, accessible_flag):
     prompt = build_scoring_prompt(accessible_flag)
     image = Image.open(image_path).convert("RGB")
 
-    response = client.models.generate_content(
-        model="gemini-1.5-pro-latest",
-        contents=[prompt, image],
-        config=types.GenerateContentConfig(response_modalities=["Text"])
-    )
+    with span("gemini"):
+        response = client.models.generate_content(
+            model="gemini-1.5-pro-latest",
+            contents=[prompt, image],
+            config=types.GenerateContentConfig(response_modalities=["Text"])
+        )
 
     raw_text = response.candidates[0].content.parts[0].text.strip()
 
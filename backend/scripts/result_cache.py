@@ -0,0 +1,136 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from scripts.depth_result import DepthResult
+from scripts.model_config import resolve_tier
+
+logger = logging.getLogger(__name__)
+
+# Bump when the stored layout or the meaning of a cached result changes
+CACHE_VERSION = 1
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join("database", "cache"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(1 << 30)))
+
+
+def result_key(image_bytes, tier, precision, max_side=None, tile_size=None, preprocess="off", denoise=None):
+    """
+    Content address of a segmentation/depth result: the image bytes plus everything that
+    changes the output (model checkpoints of the tier, precision, working resolution, tiling,
+    preprocessing).
+    """
+    config = resolve_tier(tier)
+    digest = hashlib.sha256(image_bytes)
+    digest.update(json.dumps([
+        CACHE_VERSION, config["segformer"], config["midas"], precision, max_side or 0, tile_size or 0,
+        preprocess, denoise if preprocess != "off" else None
+    ]).encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Size-bounded LRU of (segmentation mask, native depth, detected_objects) on disk, one
+    compressed .npz per key. Recency is kept in memory and mirrored in file mtimes, so the
+    order survives restarts; the least recently used entries are deleted past max_bytes.
+    """
+
+    def __init__(self, cache_dir=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> size in bytes, least recently used first
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        files = [f for f in os.scandir(cache_dir) if f.name.endswith(".npz")]
+        for entry in sorted(files, key=lambda f: f.stat().st_mtime):
+            size = entry.stat().st_size
+            self._entries[entry.name[:-len(".npz")]] = size
+            self._total_bytes += size
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def get(self, key):
+        """Returns (segmentation_mask, DepthResult, detected_objects), or None on a miss."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        try:
+            with np.load(self._path(key)) as data:
+                mask = data["mask"]
+                depth = DepthResult(data["depth"], tuple(int(v) for v in data["image_shape"]))
+                objects = json.loads(data["objects"].tobytes().decode())
+            os.utime(self._path(key))
+        except Exception:
+            # Unreadable, truncated or corrupt (BadZipFile, zlib.error, ...): drop it and recompute
+            logger.warning("Discarding unreadable result cache entry %s", key)
+            self._discard(key)
+            with self._lock:
+                self.hits -= 1
+                self.misses += 1
+            return None
+        return mask, depth, objects
+
+    def put(self, key, segmentation_mask, depth_map, detected_objects):
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            mask=segmentation_mask.astype(np.uint8),
+            depth=depth_map.native.astype(np.float32),
+            image_shape=np.asarray(depth_map.image_shape),
+            objects=np.frombuffer(json.dumps(detected_objects).encode(), dtype=np.uint8),
+        )
+        data = buffer.getvalue()
+
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._total_bytes += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            evicted = []
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, size = self._entries.popitem(last=False)
+                self._total_bytes -= size
+                evicted.append(old_key)
+
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def _discard(self, key):
+        with self._lock:
+            self._total_bytes -= self._entries.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
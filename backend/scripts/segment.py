@@ -1,96 +1,342 @@
-from transformers import SegformerFeatureExtractor, SegformerForSemanticSegmentation
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 from PIL import Image
 import torch
 import requests
 import numpy as np
-import matplotlib.pyplot as plt
 import cv2
 
-def process_image(image_path):
-    image = Image.open(image_path).convert("RGB")
-    img_np = np.array(image)
+from scripts.model_registry import DEFAULT_PRECISION, DEFAULT_TIER, DEVICE, get_midas, get_segformer, precision_context
+from scripts.depth_result import DepthResult
+from scripts.metrics import span
+from scripts.object_stats import compute_label_stats
+from scripts.annotate import COLOUR_LUT, render_annotations
+
+logger = logging.getLogger(__name__)
+
+ADE20K_LABELS = {
+    0: "wall",
+    14: "door",
+    38: "railing",
+    59: "stairway",
+}
+
+
+TILE_OVERLAP = 128
+# Mask value for pixels whose class is not one of the labels of interest
+OTHER_LABEL = 255
+
+# Segformer and MiDaS are independent, so they run side by side and split the cores between them
+CONCURRENT_BRANCHES = os.getenv("CONCURRENT_BRANCHES", "1") == "1"
+SEGMENTATION_THREAD_SHARE = float(os.getenv("SEGMENTATION_THREAD_SHARE", "0.5"))
+TOTAL_THREADS = torch.get_num_threads()
+SEGMENTATION_THREADS = max(int(TOTAL_THREADS * SEGMENTATION_THREAD_SHARE), 1)
+DEPTH_THREADS = max(TOTAL_THREADS - SEGMENTATION_THREADS, 1)
+_BRANCH_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="model-branch")
+
+
+def load_rgb(image, max_side=None):
+    """
+    Accepts an image path or an RGB numpy array and returns the RGB array.
+    With max_side set, the result is downscaled so its longer side is at most max_side;
+    JPEGs are decoded at reduced scale directly, so the full-resolution frame never exists.
+    """
+    if isinstance(image, np.ndarray):
+        img_np = image
+    else:
+        with span("decode"):
+            pil_image = Image.open(image)
+            if max_side:
+                pil_image.draft("RGB", (max_side, max_side))
+            img_np = np.array(pil_image.convert("RGB"))
+
+    h, w = img_np.shape[:2]
+    if max_side and max(h, w) > max_side:
+        with span("resize"):
+            scale = max_side / max(h, w)
+            img_np = cv2.resize(img_np, (max(int(round(w * scale)), 1), max(int(round(h * scale)), 1)),
+                                interpolation=cv2.INTER_AREA)
+    return img_np
+
+
+def reduce_logits(logits, labels=None, return_confidence=False):
+    """
+    Collapses Segformer logits (batch, num_labels, h, w) to uint8 label masks on their device,
+    so only the small masks cross to the host. With labels set, classes outside them become
+    OTHER_LABEL. return_confidence also returns, per image, {label: float16 probability map}
+    for the labels of interest (computed from a logsumexp, without a full softmax copy).
+    """
+    num_labels = logits.shape[1]
+    class_ids = logits.argmax(dim=1)
+    if labels is None:
+        masks = class_ids.to(torch.uint8)
+    else:
+        ids = [label for label in sorted(labels) if label < num_labels]
+        lut = torch.full((num_labels,), OTHER_LABEL, dtype=torch.uint8, device=logits.device)
+        lut[ids] = torch.tensor(ids, dtype=torch.uint8, device=logits.device)
+        masks = lut[class_ids]
+    del class_ids
+
+    confidences = None
+    if return_confidence:
+        ids = [label for label in sorted(labels if labels is not None else range(num_labels)) if label < num_labels]
+        log_norm = torch.logsumexp(logits.float(), dim=1, keepdim=True)
+        probs = (logits[:, ids].float() - log_norm).exp().half().cpu().numpy()
+        confidences = [{label: image_probs[j] for j, label in enumerate(ids)} for image_probs in probs]
+
+    return list(masks.cpu().numpy()), confidences
+
+
+def segment_batch(images_np, tier=DEFAULT_TIER, precision=DEFAULT_PRECISION, labels=None, return_confidence=False):
+    """
+    Runs Segformer on a list of RGB arrays in one forward pass.
+    Returns (masks, confidences), one uint8 label mask per image, see reduce_logits.
+    """
+    seg_feature_extractor, seg_model = get_segformer(tier, precision)
+
+    # The feature extractor resizes every image to the model resolution, so they stack directly
+    with span("segformer", batch=len(images_np)):
+        inputs = seg_feature_extractor(images=list(images_np), return_tensors="pt").to(DEVICE)
+        with precision_context(precision):
+            logits = seg_model(**inputs).logits  # shape (batch_size, num_labels, height/4, width/4)
+            del inputs
+            return reduce_logits(logits, labels, return_confidence)
+
+
+def _tile_starts(length, tile_size, overlap):
+    if length <= tile_size:
+        return [0]
+    step = tile_size - min(overlap, tile_size // 2)
+    starts = list(range(0, length - tile_size, step))
+    starts.append(length - tile_size)
+    return starts
+
+
+def segment_tiled(img_np, tile_size, overlap=TILE_OVERLAP, batch_size=4, tier=DEFAULT_TIER,
+                  precision=DEFAULT_PRECISION, labels=None, return_confidence=False):
+    """
+    Runs Segformer over overlapping tile_size x tile_size tiles and stitches one label mask.
+    Each tile is reduced to its argmax label and top-class probability at the model's output
+    resolution before being scaled to the tile, and overlapping pixels keep the label with the
+    higher probability. Memory is bounded by the tile size rather than by the image size.
+    labels and return_confidence work as in reduce_logits; confidence maps are stitched
+    from the same winning tiles as the mask. Returns (mask, confidence_maps or None).
+    """
+    seg_feature_extractor, seg_model = get_segformer(tier, precision)
+    h, w = img_np.shape[:2]
+
+    segmentation_mask = np.zeros((h, w), dtype=np.uint8)
+    confidence = np.full((h, w), -1.0, dtype=np.float16)
+    confidence_maps = None
 
-    # Segmenting the Image
-    seg_feature_extractor = SegformerFeatureExtractor.from_pretrained("nvidia/segformer-b5-finetuned-ade-640-640")
-    seg_model = SegformerForSemanticSegmentation.from_pretrained("nvidia/segformer-b5-finetuned-ade-640-640")
+    windows = [
+        (y, x, min(tile_size, h), min(tile_size, w))
+        for y in _tile_starts(h, tile_size, overlap)
+        for x in _tile_starts(w, tile_size, overlap)
+    ]
 
-    ADE20K_LABELS = {
-        0: "wall",
-        14: "door",
-        38: "railing",
-        59: "stairway",
-    }
+    for start in range(0, len(windows), batch_size):
+        batch_windows = windows[start:start + batch_size]
+        tiles = [img_np[y:y + th, x:x + tw] for y, x, th, tw in batch_windows]
 
-    inputs = seg_feature_extractor(images=image, return_tensors="pt")
-    outputs = seg_model(**inputs)
-    logits = outputs.logits  # shape (batch_size, num_labels, height/4, width/4)
+        with span("segformer", batch=len(tiles), tiled=True), precision_context(precision):
+            inputs = seg_feature_extractor(images=tiles, return_tensors="pt").to(DEVICE)
+            logits = seg_model(**inputs).logits
+            # Top-class probability without materializing the full softmax
+            logits_fp32 = logits.float()
+            probs = (logits_fp32.amax(dim=1) - torch.logsumexp(logits_fp32, dim=1)).exp().cpu().numpy()
+            del logits_fp32
+            tile_masks, tile_confidences = reduce_logits(logits, labels, return_confidence)
+        del inputs, logits
 
-    segmentation_mask = logits.argmax(dim=1)[0].cpu().numpy()  # shape: (H, W)
+        if return_confidence and confidence_maps is None:
+            confidence_maps = {label: np.zeros((h, w), dtype=np.float16) for label in tile_confidences[0]}
 
-    print(f"Reached the segmentation mask stage and completed! -> {segmentation_mask}")
+        for i, (y, x, th, tw) in enumerate(batch_windows):
+            tile_labels = cv2.resize(tile_masks[i], (tw, th), interpolation=cv2.INTER_NEAREST)
+            tile_probs = cv2.resize(probs[i], (tw, th), interpolation=cv2.INTER_LINEAR).astype(np.float16)
 
-    # Depth Map of the Image
-    midas = torch.hub.load("intel-isl/MiDaS", "DPT_Large", trust_repo=True)
-    midas.eval()
+            current = confidence[y:y + th, x:x + tw]
+            better = tile_probs > current
+            segmentation_mask[y:y + th, x:x + tw][better] = tile_labels[better]
+            current[better] = tile_probs[better]
+            if return_confidence:
+                for label, label_probs in tile_confidences[i].items():
+                    resized = cv2.resize(label_probs.astype(np.float32), (tw, th), interpolation=cv2.INTER_LINEAR)
+                    confidence_maps[label][y:y + th, x:x + tw][better] = resized[better]
 
-    midas_transforms = torch.hub.load("intel-isl/MiDaS", "transforms", trust_repo=True)
-    transform = midas_transforms.dpt_transform
+    return segmentation_mask, confidence_maps
 
-    img = cv2.imread(image_path)
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    input_batch = transform(img)
 
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    midas.to(device)
-    input_batch = input_batch.to(device)
+def depth_batch(images_np, tier=DEFAULT_TIER, precision=DEFAULT_PRECISION):
+    """
+    Runs MiDaS on a list of RGB arrays, returns one DepthResult per image holding the
+    prediction at the model's resolution (full-size views are built lazily).
+    The transform resizes each image keeping its aspect ratio, so only images whose inputs
+    came out the same shape share a forward pass; padding them to a common size would change
+    the depth of the real pixels (the DPT backbones attend globally), making an image's
+    result depend on what it was batched with.
+    """
+    midas, transform = get_midas(tier, precision)
 
-    with torch.no_grad():
-        prediction = midas(input_batch)
-        prediction = torch.nn.functional.interpolate(
-            prediction.unsqueeze(1),
-            size=img.shape[:2],
-            mode="bicubic",
-            align_corners=False
-        ).squeeze()
+    with span("midas", batch=len(images_np)):
+        input_tensors = [transform(img) for img in images_np]  # each (1, 3, h, w)
+        groups = {}
+        for i, t in enumerate(input_tensors):
+            groups.setdefault(tuple(t.shape[-2:]), []).append(i)
 
-    depth_map = prediction.cpu().numpy()
+        predictions = [None] * len(images_np)
+        for indices in groups.values():
+            input_batch = torch.cat([input_tensors[i] for i in indices]).to(DEVICE)
+            with precision_context(precision):
+                prediction = midas(input_batch)  # shape (len(indices), h, w)
+            prediction = prediction.float().cpu().numpy()
+            for j, i in enumerate(indices):
+                predictions[i] = prediction[j]
 
-    print(f"Reached the depth map stage and completed! -> {depth_map}")
+    return [DepthResult(prediction, img.shape) for prediction, img in zip(predictions, images_np)]
 
+
+def segment_images(images_np, batch_size=4, labels=ADE20K_LABELS, tile_size=None, tier=DEFAULT_TIER,
+                   precision=DEFAULT_PRECISION, confidence=False):
+    """Segmentation branch of process_images: returns (masks, confidence maps or Nones), one per image."""
+    # Images that fit in one tile (or all of them, without tiling) share one Segformer batch
+    segmentation_masks = [None] * len(images_np)
+    confidence_maps = [None] * len(images_np)
+    single_pass = [i for i, img_np in enumerate(images_np) if not tile_size or max(img_np.shape[:2]) <= tile_size]
+    if single_pass:
+        masks, confidences = segment_batch(
+            [images_np[i] for i in single_pass], tier, precision, labels, return_confidence=confidence
+        )
+        for j, i in enumerate(single_pass):
+            segmentation_masks[i] = masks[j]
+            confidence_maps[i] = confidences[j] if confidence else None
+    for i, img_np in enumerate(images_np):
+        if segmentation_masks[i] is None:
+            segmentation_masks[i], confidence_maps[i] = segment_tiled(
+                img_np, tile_size, batch_size=batch_size, tier=tier, precision=precision,
+                labels=labels, return_confidence=confidence
+            )
+    return segmentation_masks, confidence_maps
+
+
+def set_thread_budget(num_threads):
+    """Caps this process at num_threads intra-op threads, split between the two branches as above."""
+    global TOTAL_THREADS, SEGMENTATION_THREADS, DEPTH_THREADS
+    torch.set_num_threads(num_threads)
+    TOTAL_THREADS = num_threads
+    SEGMENTATION_THREADS = max(int(num_threads * SEGMENTATION_THREAD_SHARE), 1)
+    DEPTH_THREADS = max(num_threads - SEGMENTATION_THREADS, 1)
+
+
+def _with_threads(num_threads, fn, *args):
+    # The intra-op thread count is per calling thread, so this only limits the branch's own ops
+    torch.set_num_threads(num_threads)
+    return fn(*args)
+
+
+def process_images(images, batch_size=4, labels=ADE20K_LABELS, overlay=False, max_side=None, tile_size=None,
+                   tier=DEFAULT_TIER, precision=DEFAULT_PRECISION, confidence=False):
+    """
+    Batched version of process_image.
+    images is a list of image paths or RGB numpy arrays; both models run on stacked
+    batches of up to batch_size images. Returns one
+    (img_np, seg_mask, depth_map, detected_objects, annotated_img) tuple per input, in order.
+    labels maps the ADE20K class ids to report to their names; overlay=True also tints
+    those labels' pixels in the annotated image.
+
+    For very large photos, max_side caps the working resolution (everything returned,
+    including bounding boxes, is in that resolution) and tile_size segments images larger
+    than one tile as overlapping tiles instead of a single downscaled pass.
+    tier ("fast", "balanced" or "accurate") picks the Segformer/MiDaS pair, see MODEL_TIERS,
+    and precision ("fp32", "bf16", "int8" or "compiled") how they run, see PRECISIONS.
+
+    depth_map is a DepthResult (native-resolution depth, full-size views on demand).
+    seg_mask is uint8 with every class outside labels set to OTHER_LABEL. confidence=True
+    appends a sixth item per result: {label: float16 probability map} at seg_mask's size.
+    """
+    results = []
+    for start in range(0, len(images), batch_size):
+        images_np = [load_rgb(image, max_side) for image in images[start:start + batch_size]]
+
+        if CONCURRENT_BRANCHES:
+            # Both branches read the same decoded arrays; each gets its share of the intra-op threads
+            seg_future = _BRANCH_POOL.submit(
+                _with_threads, SEGMENTATION_THREADS, segment_images,
+                images_np, batch_size, labels, tile_size, tier, precision, confidence
+            )
+            depth_future = _BRANCH_POOL.submit(_with_threads, DEPTH_THREADS, depth_batch, images_np, tier, precision)
+            segmentation_masks, confidence_maps = seg_future.result()
+            depth_maps = depth_future.result()
+        else:
+            segmentation_masks, confidence_maps = segment_images(
+                images_np, batch_size, labels, tile_size, tier, precision, confidence
+            )
+            depth_maps = depth_batch(images_np, tier, precision)
+        logger.info("Segmentation and depth done for %d images", len(images_np))
+
+        for img_np, segmentation_mask, depth_map, confidence_map in zip(
+            images_np, segmentation_masks, depth_maps, confidence_maps
+        ):
+            results.append(merge_segmentation_and_depth(
+                img_np, segmentation_mask, depth_map, labels, overlay, confidence_map
+            ))
+
+    return results
+
+
+def process_image(image_path, labels=ADE20K_LABELS, overlay=False, max_side=None, tile_size=None,
+                  tier=DEFAULT_TIER, precision=DEFAULT_PRECISION, confidence=False):
+    return process_images([image_path], batch_size=1, labels=labels, overlay=overlay, max_side=max_side,
+                          tile_size=tile_size, tier=tier, precision=precision, confidence=confidence)[0]
+
+
+def merge_segmentation_and_depth(img_np, segmentation_mask, depth_map, labels=ADE20K_LABELS, overlay=False,
+                                 confidence_maps=None):
     # --------------------------
     # Step 4: Merge Segmentation & Depth Data
     # --------------------------
-    print("Merging segmentation with depth data...")
-    # Ensure segmentation mask and depth map have the same dimensions.
-    seg_h, seg_w = segmentation_mask.shape
-    depth_h, depth_w = depth_map.shape
-
-    if (seg_h != depth_h) or (seg_w != depth_w):
-        print("The segmentation mask and the depth map don't have the same dimensions")
-        segmentation_mask = cv2.resize(segmentation_mask.astype(np.uint8),
-                                    (depth_w, depth_h),
-                                    interpolation=cv2.INTER_NEAREST)
-
-    # For each relevant object in our key class mapping, extract its mask, bounding box, and average depth.
+    logger.debug("Merging segmentation with depth data")
+    img_h, img_w = img_np.shape[:2]
+    depth_h, depth_w = depth_map.native.shape
+
+    # Statistics run at the depth model's resolution, so the mask is brought to that grid
+    stats_mask = segmentation_mask
+    if stats_mask.shape != (depth_h, depth_w):
+        stats_mask = cv2.resize(stats_mask.astype(np.uint8), (depth_w, depth_h), interpolation=cv2.INTER_NEAREST)
+
+    # Area, bounding box and median depth for every label of interest in a single pass.
+    with span("object_stats"):
+        label_stats = compute_label_stats(stats_mask, depth_map.native, labels)
+    logger.debug("Detected labels: %s", [labels[label] for label in label_stats])
+
+    # The returned mask (and confidence maps) match the image
+    if segmentation_mask.shape != (img_h, img_w):
+        segmentation_mask = cv2.resize(segmentation_mask.astype(np.uint8), (img_w, img_h),
+                                       interpolation=cv2.INTER_NEAREST)
+        if confidence_maps is not None:
+            confidence_maps = {
+                label: cv2.resize(probs.astype(np.float32), (img_w, img_h),
+                                  interpolation=cv2.INTER_LINEAR).astype(np.float16)
+                for label, probs in confidence_maps.items()
+            }
+
     detected_objects = []
-    unique_labels = np.unique(segmentation_mask)
-    print(f"Unique_labels: {unique_labels}")
-    for label in unique_labels:
-        if label not in ADE20K_LABELS:
-            print("Skip")
-            continue  # Skip labels not in our defined mapping
-        label_name = ADE20K_LABELS[label]
-        mask = segmentation_mask == label
-        if np.sum(mask) == 0:
-            continue
+    for label, stats in label_stats.items():
+        label_name = labels[label]
 
         # Use median instead of mean for depth to reduce outlier impact
-        median_depth = np.median(depth_map[mask])
-        coords = np.column_stack(np.where(mask))
-        y_min, x_min = coords.min(axis=0)
-        y_max, x_max = coords.max(axis=0)
+        median_depth = stats["median_depth"]
 
-        bbox = [int(x_min), int(y_min), int(x_max), int(y_max)]
+        # Native depth pixels back to image pixels
+        sx, sy = depth_map.scale
+        x_min, y_min, x_max, y_max = stats["bbox"]
+        x_min, y_min = int(x_min * sx), int(y_min * sy)
+        x_max = min(int(np.ceil((x_max + 1) * sx)) - 1, img_w - 1)
+        y_max = min(int(np.ceil((y_max + 1) * sy)) - 1, img_h - 1)
+        bbox = [x_min, y_min, x_max, y_max]
         pixel_width = x_max - x_min
         pixel_height = y_max - y_min
 
@@ -102,33 +348,31 @@ def process_image(image_path):
             "label": label_name,
             "bbox": bbox,
             "median_depth": float(median_depth),  # Renamed from average_depth
-            "area": int(np.sum(mask)),
+            "area": int(round(stats["area"] * sx * sy)),
             "pixel_width": pixel_width,
             "pixel_height": pixel_height,
             "estimated_width": estimated_width,
             "estimated_height": estimated_height
         })
 
-        annotated_img = img_np.copy()
-        for obj in detected_objects:
-            x_min, y_min, x_max, y_max = obj["bbox"]
-            cv2.rectangle(annotated_img, (x_min, y_min), (x_max, y_max), color=(255, 0, 0), thickness=2)
-            label_text = f"{obj['label']} ({obj['median_depth']:.2f}m, W:{obj['estimated_width']:.2f}m, H:{obj['estimated_height']:.2f}m)"
-            cv2.putText(annotated_img, label_text, (x_min, max(y_min - 5, 0)),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), thickness=2)
+    # Draw all boxes (and optionally the mask overlay) once, after every object is known
+    with span("annotation"):
+        annotated_img = render_annotations(
+            img_np, detected_objects,
+            segmentation_mask=segmentation_mask if overlay else None,
+            labels=labels
+        )
 
+    if confidence_maps is not None:
+        return img_np, segmentation_mask, depth_map, detected_objects, annotated_img, confidence_maps
     return img_np, segmentation_mask, depth_map, detected_objects, annotated_img
 
 
-def visualize_results(image_np, segmentation_mask, depth_map, objects):
-    # Create a copy of the original image for annotation
-    annotated_img = image_np.copy()
-    for obj in objects:
-        x_min, y_min, x_max, y_max = obj["bbox"]
-        cv2.rectangle(annotated_img, (x_min, y_min), (x_max, y_max), color=(255, 0, 0), thickness=2)
-        label_text = f"{obj['label']} ({obj['median_depth']:.2f}m, W:{obj['estimated_width']:.2f}m, H:{obj['estimated_height']:.2f}m)"
-        cv2.putText(annotated_img, label_text, (x_min, max(y_min - 5, 0)),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), thickness=2)
+def visualize_results(image_np, segmentation_mask, depth_map, objects, annotated_img=None):
+    import matplotlib.pyplot as plt  # only needed for local debugging
+    # Reuse the annotation already rendered by process_image when the caller has it
+    if annotated_img is None:
+        annotated_img = render_annotations(image_np, objects)
     
     plt.figure(figsize=(14, 10))
     
@@ -138,12 +382,12 @@ def visualize_results(image_np, segmentation_mask, depth_map, objects):
     plt.axis("off")
     
     plt.subplot(2, 2, 2)
-    plt.imshow(segmentation_mask, cmap="jet")
+    plt.imshow(COLOUR_LUT[segmentation_mask])
     plt.title("Segmentation Mask")
     plt.axis("off")
     
     plt.subplot(2, 2, 3)
-    plt.imshow(depth_map, cmap="inferno")
+    plt.imshow(depth_map.native, cmap="inferno")
     plt.title("Depth Map")
     plt.axis("off")
     
@@ -159,4 +403,4 @@ if __name__ == "__main__":
     # For standalone testing
     img_np, seg_mask, depth_map, objects, annotated_img = process_image("stairs.jpeg")
     print("Detected objects:", objects)
-    visualize_results(img_np, seg_mask, depth_map, objects)
\ No newline at end of file
+    visualize_results(img_np, seg_mask, depth_map, objects, annotated_img)
\ No newline at end of file
@@ -0,0 +1,174 @@
+import ctypes
+import itertools
+import logging
+import os
+from collections import namedtuple
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Worker results move their arrays (masks, depth, annotated images) through shared memory
+# instead of being pickled through the result pipe; 0 turns it off
+SHARED_RESULTS = os.getenv("SHARED_RESULTS", "1") == "1"
+# Smaller arrays are cheaper to pickle than to map
+SHARED_RESULT_MIN_BYTES = int(os.getenv("SHARED_RESULT_MIN_BYTES", str(64 << 10)))
+# Segment names are SEGMENT_PREFIX<web process pid>_<batch>_<image>, so leftovers can be traced to their owner
+SEGMENT_PREFIX = "genai_"
+_SHM_DIR = "/dev/shm"  # where POSIX shared memory shows up on Linux
+_ALIGNMENT = 64
+
+# Stands in for an array that was moved into the segment
+SharedSlot = namedtuple("SharedSlot", ["offset", "shape", "dtype"])
+
+_batches = itertools.count()
+
+
+def segment_names(count):
+    """Fresh segment names for one batch of count results, owned by this process."""
+    batch = next(_batches)
+    return [f"{SEGMENT_PREFIX}{os.getpid()}_{batch}_{i}" for i in range(count)]
+
+
+def _map_arrays(value, fn):
+    """Copy of value with fn applied to every array (or SharedSlot) inside tuples, lists, dicts and plain objects."""
+    if isinstance(value, (np.ndarray, SharedSlot)):
+        return fn(value)
+    if isinstance(value, (tuple, list)):
+        return type(value)(_map_arrays(item, fn) for item in value)
+    if isinstance(value, dict):
+        return {key: _map_arrays(item, fn) for key, item in value.items()}
+    if hasattr(value, "__dict__") and not isinstance(value, type):
+        # Objects such as DepthResult that hold their arrays as attributes
+        copy = object.__new__(type(value))
+        copy.__dict__.update({key: _map_arrays(item, fn) for key, item in vars(value).items()})
+        return copy
+    return value
+
+
+def export_result(result, name):
+    """
+    Worker side: copies the large arrays in result into a new shared memory segment called name
+    and returns (name, result with SharedSlots in their place). The segment is left for the
+    receiver to map and unlink (import_result); name is None when nothing was worth sharing.
+    """
+    arrays = []
+    size = 0
+
+    def to_slot(array):
+        nonlocal size
+        if array.nbytes < SHARED_RESULT_MIN_BYTES or array.dtype.hasobject:
+            return array
+        slot = SharedSlot(size, array.shape, array.dtype.str)
+        arrays.append((slot, array))
+        size += -(-array.nbytes // _ALIGNMENT) * _ALIGNMENT
+        return slot
+
+    result = _map_arrays(result, to_slot)
+    if not arrays:
+        return None, result
+
+    segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+    try:
+        # The receiver owns the segment from here on: it unlinks it, and the cleanup paths below
+        # cover crashes, so this process's resource tracker must not unlink it (or warn) at exit
+        resource_tracker.unregister(segment._name, "shared_memory")
+        buffer = np.ndarray((size,), np.uint8, buffer=segment.buf)
+        for slot, array in arrays:
+            target = buffer[slot.offset:slot.offset + array.nbytes].view(slot.dtype).reshape(slot.shape)
+            target[...] = array
+        del buffer, target
+    except BaseException:
+        segment.unlink()
+        raise
+    finally:
+        segment.close()
+    return name, result
+
+
+class _Mapping:
+    """
+    An attached segment, exposed to numpy as one byte array. Arrays viewing it keep this object
+    alive through their base, and the segment is unmapped once the last of them is gone.
+    """
+
+    def __init__(self, segment):
+        self._segment = segment
+        pointer = ctypes.c_char.from_buffer(segment.buf)
+        # Only the address is kept, so close() doesn't find the buffer still exported
+        address = ctypes.addressof(pointer)
+        del pointer
+        self.__array_interface__ = {
+            "shape": (segment.size,), "typestr": "|u1", "data": (address, False), "version": 3
+        }
+
+    def __del__(self):
+        self._segment.close()
+
+
+def import_result(name, result):
+    """
+    Receiver side of export_result: maps the segment, unlinks its name (the memory is freed once
+    the returned arrays are) and returns result with zero-copy arrays in place of the SharedSlots.
+    """
+    if name is None:
+        return result
+    segment = shared_memory.SharedMemory(name=name)
+    segment.unlink()
+    buffer = np.asarray(_Mapping(segment))
+
+    def from_slot(slot):
+        if not isinstance(slot, SharedSlot):
+            return slot
+        nbytes = int(np.prod(slot.shape)) * np.dtype(slot.dtype).itemsize
+        return buffer[slot.offset:slot.offset + nbytes].view(slot.dtype).reshape(slot.shape)
+
+    return _map_arrays(result, from_slot)
+
+
+def discard(names):
+    """Unlinks whichever of the named segments still exist (results that will never be imported)."""
+    for name in names:
+        try:
+            segment = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            continue
+        segment.unlink()
+        segment.close()
+
+
+def sweep_stale_segments(owner_pid=None):
+    """
+    Unlinks segments left by a web process that died before importing them: those of
+    owner_pid, or (by default) of every process that no longer exists. Linux only, where
+    the segments are listed in /dev/shm; elsewhere only the per-batch cleanup applies.
+    """
+    if not os.path.isdir(_SHM_DIR):
+        return 0
+    stale = []
+    for entry in os.listdir(_SHM_DIR):
+        if not entry.startswith(SEGMENT_PREFIX):
+            continue
+        pid = entry[len(SEGMENT_PREFIX):].split("_", 1)[0]
+        if not pid.isdigit():
+            continue
+        if owner_pid is not None:
+            if int(pid) == owner_pid:
+                stale.append(entry)
+        elif not _process_exists(int(pid)):
+            stale.append(entry)
+    discard(stale)
+    if stale:
+        logger.warning("Removed %d leftover shared memory result segments", len(stale))
+    return len(stale)
+
+
+def _process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,308 @@
+import gc
+import itertools
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from concurrent.futures import Future
+
+from scripts.metrics import stage_metrics
+from scripts.model_config import DEFAULT_PRECISION, DEFAULT_TIER
+from scripts.shared_results import (
+    SHARED_RESULTS, discard, export_result, import_result, segment_names, sweep_stale_segments
+)
+
+# torch, transformers and the models are only imported where they are used, so the web tier
+# starts without them and the model host process loads them after forking
+
+logger = logging.getLogger(__name__)
+
+SERVING_WORKERS = int(os.getenv("SERVING_WORKERS", "0"))  # 0: run inference in the web process
+# Intra-op threads per worker; by default the cores are divided evenly between the workers
+SERVING_THREADS_PER_WORKER = int(os.getenv("SERVING_THREADS_PER_WORKER", "0"))
+# Tier/precision pairs loaded at startup (before forking the workers), "tier:precision" separated by commas
+SERVING_PRELOAD = os.getenv("SERVING_PRELOAD", f"{DEFAULT_TIER}:{DEFAULT_PRECISION}")
+_IDLE = -1
+
+
+def preload_models(pairs):
+    """Loads Segformer and MiDaS for every (tier, precision) so forked workers share the weights."""
+    from scripts.model_registry import get_midas, get_segformer
+
+    for tier, precision in pairs:
+        get_segformer(tier, precision)
+        get_midas(tier, precision)
+
+
+def parse_preload(spec):
+    pairs = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        tier, _, precision = item.partition(":")
+        pairs.append((tier, precision or DEFAULT_PRECISION))
+    return pairs
+
+
+def _worker_main(index, threads, tasks, results, current_tasks):
+    import cv2
+    from scripts.segment import set_thread_budget
+
+    set_thread_budget(threads)
+    cv2.setNumThreads(threads)
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        task_id, fn, args, kwargs = task
+        current_tasks[index] = task_id
+        try:
+            outcome = (task_id, True, fn(*args, **kwargs))
+        except Exception as e:
+            outcome = (task_id, False, e)
+        current_tasks[index] = _IDLE
+        try:
+            results.put(outcome)
+        except Exception as e:  # the result or exception didn't pickle
+            results.put((task_id, False, RuntimeError(f"Could not return the result from the worker: {e}")))
+
+
+def _supervise(workers, threads, preload, tasks, results, current_tasks, ready):
+    """
+    Model host process: loads the models, freezes them for the garbage collector and forks the
+    workers from itself, then replaces any worker that dies. It runs no other threads, so it can
+    fork safely at any time, and it exits (taking the workers along) when the web process is gone.
+    """
+    # Ctrl-C goes to the whole process group; the web process decides when the pool stops
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    web_process = os.getppid()
+    context = multiprocessing.get_context("fork")
+    processes = []
+
+    def stop(*_):
+        for process in processes:
+            process.terminate()
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+
+    def fork(index):
+        process = context.Process(
+            target=_worker_main, name=f"model-worker-{index}", daemon=True,
+            args=(index, threads, tasks, results, current_tasks)
+        )
+        process.start()
+        return process
+
+    preload_models(preload)
+    # Objects in the frozen generation are never scanned by the collector, so it doesn't
+    # write to (and un-share) the pages holding the model objects in the workers
+    gc.collect()
+    gc.freeze()
+    processes.extend(fork(i) for i in range(workers))
+    ready.set()
+
+    while os.getppid() == web_process:
+        time.sleep(1.0)
+        for index, process in enumerate(processes):
+            if process.is_alive():
+                continue
+            task_id = current_tasks[index]
+            current_tasks[index] = _IDLE
+            logger.error("Model worker %d exited with code %s; restarting it", index, process.exitcode)
+            if task_id != _IDLE:
+                results.put((task_id, False, RuntimeError(f"Model worker exited with code {process.exitcode}")))
+            processes[index] = fork(index)
+    # The web process is gone without importing what the workers handed it
+    sweep_stale_segments(web_process)
+    stop()
+
+
+class ModelWorkerPool:
+    """
+    Pre-forked inference processes. A model host process forked from this one loads the models
+    and the garbage collector's view of them is frozen (gc.freeze) before it forks the workers,
+    so they share the weight pages copy-on-write instead of each holding a copy. This process
+    doesn't wait for that: `ready` turns True once the workers are up, and tasks submitted
+    earlier wait in the queue. Every worker pins its intra-op threads to threads_per_worker and
+    takes the next task from one shared queue, so tasks go to whichever worker is free. A worker
+    that dies fails its current task and is replaced.
+    Only tier/precision pairs in preload are shared; others load separately inside each worker.
+    """
+
+    def __init__(self, workers, threads_per_worker=0, preload=()):
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker or max((os.cpu_count() or 1) // workers, 1)
+        context = multiprocessing.get_context("fork")
+        self._tasks = context.SimpleQueue()
+        self._results = context.SimpleQueue()
+        self._current_tasks = context.Array("q", [_IDLE] * workers)
+        self._ready = context.Event()
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._task_ids = itertools.count()
+        self._closed = False
+
+        # Not a daemon: daemonic processes can't have children
+        self._supervisor = context.Process(
+            target=_supervise, name="model-host",
+            args=(workers, self.threads_per_worker, list(preload), self._tasks, self._results,
+                  self._current_tasks, self._ready)
+        )
+        # Results a previous web process never collected (it was killed mid-batch)
+        sweep_stale_segments()
+        self._supervisor.start()
+        logger.info("Starting %d model workers with %d threads each", workers, self.threads_per_worker)
+
+        threading.Thread(target=self._collect_results, name="worker-results", daemon=True).start()
+        threading.Thread(target=self._watch_supervisor, name="worker-monitor", daemon=True).start()
+
+    @property
+    def ready(self):
+        return self._ready.is_set() and self._supervisor.is_alive()
+
+    def status(self):
+        if not self._supervisor.is_alive():
+            return {"status": "failed", "error": f"Model host exited with code {self._supervisor.exitcode}"}
+        return {"status": "ready" if self._ready.is_set() else "loading"}
+
+    def submit(self, fn, *args, **kwargs):
+        """Runs fn(*args, **kwargs) in a free worker; fn must be a module-level function. Returns a Future."""
+        if self._closed or not self._supervisor.is_alive():
+            raise RuntimeError("The model worker pool is not running")
+        future = Future()
+        with self._lock:
+            task_id = next(self._task_ids)
+            self._futures[task_id] = future
+        self._tasks.put((task_id, fn, args, kwargs))
+        return future
+
+    def _resolve(self, task_id, ok, value):
+        with self._lock:
+            future = self._futures.pop(task_id, None)
+        if future is None:
+            return
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+
+    def _collect_results(self):
+        while True:
+            try:
+                task_id, ok, value = self._results.get()
+            except (EOFError, OSError):
+                return
+            self._resolve(task_id, ok, value)
+
+    def _watch_supervisor(self):
+        self._supervisor.join()
+        if self._closed:
+            return
+        # Without the model host nothing will run; fail what is waiting (readiness reports it too)
+        logger.error("Model host exited with code %s", self._supervisor.exitcode)
+        with self._lock:
+            pending = list(self._futures)
+        for task_id in pending:
+            self._resolve(task_id, False, RuntimeError("The model worker pool stopped"))
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "threads_per_worker": self.threads_per_worker,
+            "busy": sum(task_id != _IDLE for task_id in self._current_tasks),
+            "pending": len(self._futures),
+            **self.status(),
+        }
+
+    def close(self, timeout=10.0):
+        self._closed = True
+        # The model host terminates its workers on SIGTERM
+        self._supervisor.terminate()
+        self._supervisor.join(timeout)
+
+
+worker_pool = None
+_warmup = {"status": "lazy"}
+
+
+def start_worker_pool(workers=SERVING_WORKERS, threads_per_worker=SERVING_THREADS_PER_WORKER,
+                      preload=SERVING_PRELOAD):
+    """
+    Forks the model host, which loads the models and forks the workers in the background. Call
+    it before anything starts threads (importing the routes can resume jobs), since forking a
+    multi-threaded process is unsafe.
+    """
+    global worker_pool
+    if workers > 0 and worker_pool is None:
+        worker_pool = ModelWorkerPool(workers, threads_per_worker, parse_preload(preload))
+    return worker_pool
+
+
+def start_warmup(preload=SERVING_PRELOAD):
+    """Without a worker pool: loads the preload models in a background thread of this process."""
+    def load():
+        started = time.perf_counter()
+        try:
+            preload_models(parse_preload(preload))
+        except Exception as e:
+            logger.exception("Model warm-up failed")
+            _warmup.update(status="failed", error=str(e))
+            return
+        _warmup.update(status="ready", seconds=round(time.perf_counter() - started, 1))
+        logger.info("Models loaded in %.1f s", _warmup["seconds"])
+
+    _warmup.update(status="loading")
+    threading.Thread(target=load, name="model-warmup", daemon=True).start()
+
+
+def readiness():
+    """
+    {"status": ...}: "ready" once the startup models are resident, "loading" until then, "failed"
+    if they couldn't be loaded, and "lazy" when nothing was preloaded (models load on first use).
+    """
+    if worker_pool is not None:
+        return worker_pool.status()
+    return dict(_warmup)
+
+
+def pool_stats():
+    return worker_pool.stats() if worker_pool is not None else None
+
+
+def _process_in_worker(images, shared_names=None, **kwargs):
+    """Runs in a worker: returns (results, the spans this batch recorded) for run_inference."""
+    from scripts.segment import process_images
+
+    # Anything left over (a failed batch, spans copied in by the fork) isn't this batch's
+    stage_metrics.take()
+    # The caller already has the input arrays, so they are not sent back
+    results = [(None,) + tuple(result[1:]) for result in process_images(images, **kwargs)]
+    if shared_names is None:
+        return [(None, result) for result in results], stage_metrics.take()
+    return [export_result(result, name) for result, name in zip(results, shared_names)], stage_metrics.take()
+
+
+def run_inference(images, **kwargs):
+    """
+    process_images on RGB arrays, in a pooled worker when the pool is running, otherwise in this
+    thread. The workers' arrays come back through shared memory (see scripts.shared_results):
+    each result's segment is unlinked as soon as it is mapped here, and every segment of a batch
+    that fails is discarded, so none outlive the batch. The spans the worker recorded (segformer,
+    midas, ...) are merged into this process's stage_metrics, which /metrics reports.
+    """
+    if worker_pool is None:
+        from scripts.segment import process_images
+
+        return process_images(images, **kwargs)
+    names = segment_names(len(images)) if SHARED_RESULTS else None
+    try:
+        results, worker_stages = worker_pool.submit(_process_in_worker, images, names, **kwargs).result()
+        stage_metrics.merge(worker_stages)
+        results = [import_result(name, result) for name, result in results]
+    except BaseException:
+        if names:
+            discard(names)
+        raise
+    return [(image,) + tuple(result[1:]) for image, result in zip(images, results)]